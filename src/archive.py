@@ -0,0 +1,572 @@
+import bz2
+import concurrent.futures
+import dataclasses
+import datetime
+import functools
+import hashlib
+import io
+import json
+import logging
+import lzma
+import os
+from os.path import basename
+import pickle
+import tarfile
+import time
+import typing
+import zipfile
+from zipfile import ZipFile
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from get_chargecloud_data import FMT_QUERY_TIME, SUFFIX_API_RESULTS
+
+logger = logging.getLogger(__name__)
+
+
+CODECS = {"zstd": ".zst", "gzip": ".gz", "xz": ".xz", "bz2": ".bz2", "zip": ".zip"}
+EXTENSIONS_TAR = (".tar", ".tar.gz", ".tgz", ".tar.xz", ".tar.bz2")
+DEFAULT_CODEC = "zstd" if zstandard is not None else "gzip"
+DEFAULT_LEVELS = {"zstd": 10, "gzip": 6, "xz": 6, "bz2": 9, "zip": 6}
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+PREFIX_ARCHIVE = "archive" + SUFFIX_API_RESULTS + "_"
+SUFFIX_INDEX = ".index.json"
+SUFFIX_DICTIONARY = ".dict"
+# reference to an archived API result, e.g. 'archive_cp_data_cities_20220111_221822.zst::20220111_215824_cp_data_cities.json'
+SEP_ARCHIVE_MEMBER = "::"
+
+CHUNK_SIZE = 1 << 20
+DICTIONARY_SIZE = 1 << 17
+DICTIONARY_MIN_SAMPLES = 5
+DICTIONARY_MAX_SAMPLES = 200
+DICTIONARY_SAMPLE_SIZE = 1 << 16
+
+
+@dataclasses.dataclass
+class ArchiveStats:
+    n_files: int
+    bytes_in: int
+    bytes_out: int
+    seconds: float
+
+    @property
+    def compression_ratio(self) -> float:
+        return self.bytes_in / self.bytes_out if self.bytes_out else float("nan")
+
+    @property
+    def throughput_mb_s(self) -> float:
+        return self.bytes_in / 1e6 / self.seconds if self.seconds else float("nan")
+
+
+def _flatten_files(files_results: typing.List[typing.Union[str, typing.List[str]]]) -> typing.List[str]:
+    """Flatten paths of API results which might contain lists of city shards of one query interval"""
+    return [f for files in files_results for f in (files if isinstance(files, list) else [files])]
+
+
+def _get_member_name(fullpath: str, root_dir: str) -> str:
+    """Get name of archive member relative to root directory using forward slashes"""
+    return os.path.relpath(fullpath, root_dir).replace(os.sep, "/")
+
+
+def _parse_member_query_time(name: str) -> typing.Optional[str]:
+    """Parse query time from name of archive member. Returns None if name does not contain a query time."""
+    query_time = basename(name).split(SUFFIX_API_RESULTS, maxsplit=1)[0]
+    try:
+        datetime.datetime.strptime(query_time, FMT_QUERY_TIME)
+    except ValueError:
+        return None
+    return query_time
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("Codec 'zstd' requires package 'zstandard'. Install it or choose any other codec of "
+                          f"{set(CODECS)}.")
+
+
+def _train_zstd_dictionary(files: typing.List[str], level: int) -> typing.Optional[bytes]:
+    """Train zstd dictionary on a sample of API results
+
+    Args:
+        files (typing.List[str]): paths of API results
+        level (int): compression level
+
+    Returns:
+        typing.Optional[bytes]: trained dictionary or None if there are too few samples or training failed
+    """
+    if len(files) < DICTIONARY_MIN_SAMPLES:
+        logger.debug(f"Too few API results to train zstd dictionary: {len(files)}")
+        return None
+    step = max(len(files) // DICTIONARY_MAX_SAMPLES, 1)
+    samples = []
+    for f in files[::step]:
+        with open(f, 'rb') as fp:
+            samples.append(fp.read(DICTIONARY_SAMPLE_SIZE))
+    try:
+        return zstandard.train_dictionary(DICTIONARY_SIZE, samples, level=level).as_bytes()
+    except zstandard.ZstdError as e:
+        logger.warning(f"Training zstd dictionary failed, compressing without dictionary: {e}")
+        return None
+
+
+def _new_compressor(codec: str, level: int, dictionary: bytes = None):
+    """Create incremental compressor object providing `compress` and `flush`"""
+    if codec == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+    elif codec == "xz":
+        return lzma.LZMACompressor(preset=level)
+    elif codec == "bz2":
+        return bz2.BZ2Compressor(level)
+    elif codec == "zstd":
+        _require_zstandard()
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdCompressor(level=level, dict_data=dict_data).compressobj()
+    raise ValueError(f"Codec must be any of {set(CODECS)}, but is actually '{codec}'.")
+
+
+def _new_decompressor(codec: str, dictionary: bytes = None):
+    """Create incremental decompressor object providing `decompress`"""
+    if codec == "gzip":
+        return zlib.decompressobj(31)
+    elif codec == "xz":
+        return lzma.LZMADecompressor()
+    elif codec == "bz2":
+        return bz2.BZ2Decompressor()
+    elif codec == "zstd":
+        _require_zstandard()
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompressobj()
+    raise ValueError(f"Codec must be any of {set(CODECS)}, but is actually '{codec}'.")
+
+
+def _compress_file(fullpath: str, codec: str, level: int, dictionary: bytes = None) -> typing.Tuple[bytes, int, str]:
+    """Compress a file to a single independent frame, reading it in chunks
+
+    Args:
+        fullpath (str): path of file to compress
+        codec (str): any of {'zstd', 'gzip', 'xz', 'bz2'}
+        level (int): compression level
+        dictionary (bytes, optional): zstd dictionary. Defaults to None.
+
+    Returns:
+        typing.Tuple[bytes, int, str]: compressed frame, uncompressed size and sha256 hash of uncompressed file
+    """
+    compressor = _new_compressor(codec, level, dictionary)
+    sha256 = hashlib.sha256()
+    size = 0
+    frame = []
+    with open(fullpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+            size += len(chunk)
+            frame.append(compressor.compress(chunk))
+    frame.append(compressor.flush())
+    return b"".join(frame), size, sha256.hexdigest()
+
+
+def _iter_frame(f: typing.BinaryIO, member: dict, codec: str, dictionary: bytes = None) -> typing.Iterator[bytes]:
+    """Stream decompressed chunks of a single frame of a frame bundle
+
+    Args:
+        f (typing.BinaryIO): file object of frame bundle
+        member (dict): index entry of member containing 'offset' and 'length'
+        codec (str): any of {'zstd', 'gzip', 'xz', 'bz2'}
+        dictionary (bytes, optional): zstd dictionary. Defaults to None.
+
+    Yields:
+        typing.Iterator[bytes]: decompressed chunks
+    """
+    decompressor = _new_decompressor(codec, dictionary)
+    f.seek(member["offset"])
+    remaining = member["length"]
+    while remaining > 0:
+        chunk = f.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise EOFError(f"Unexpected end of archive while reading member '{member['name']}'.")
+        remaining -= len(chunk)
+        yield decompressor.decompress(chunk)
+    if hasattr(decompressor, "flush"):
+        yield decompressor.flush()
+
+
+def _verify_bundle(fullpath_bundle: str, index: dict, dictionary: bytes = None):
+    """Verify all members of a frame bundle by decompressing them and comparing size and hash
+
+    Raises:
+        ValueError: Raised if any member does not match its index entry
+    """
+    with open(fullpath_bundle, 'rb') as f:
+        for member in index["members"]:
+            sha256 = hashlib.sha256()
+            size = 0
+            for chunk in _iter_frame(f, member, codec=index["codec"], dictionary=dictionary):
+                sha256.update(chunk)
+                size += len(chunk)
+            if size != member["size"] or sha256.hexdigest() != member["sha256"]:
+                raise ValueError(f"Verification of archive member '{member['name']}' failed.")
+
+
+def _write_frame_bundle(files: typing.List[str],
+                        fullpath_bundle: str,
+                        root_dir: str,
+                        codec: str,
+                        level: int,
+                        workers: int,
+                        train_dictionary: bool) -> int:
+    """Write files as independently compressed frames into a single bundle with a sidecar index
+
+    Returns:
+        int: size of bundle including dictionary in bytes
+    """
+    dictionary = _train_zstd_dictionary(files, level=level) if codec == "zstd" and train_dictionary else None
+
+    index = {"codec": codec,
+             "dictionary": basename(fullpath_bundle) + SUFFIX_DICTIONARY if dictionary else None,
+             "members": []}
+    fullpath_tmp = fullpath_bundle + ".tmp"
+
+    # frames are compressed in parallel (zlib, lzma, bz2 and zstd release the GIL) and written in order,
+    # at most 2 * workers compressed frames are held in memory
+    with open(fullpath_tmp, 'wb') as f_bundle, concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        batch_size = 2 * workers
+        for i in range(0, len(files), batch_size):
+            batch = files[i:i + batch_size]
+            frames = executor.map(lambda f: _compress_file(f, codec=codec, level=level, dictionary=dictionary), batch)
+            for f, (frame, size, sha256) in zip(batch, frames):
+                name = _get_member_name(f, root_dir)
+                index["members"].append({"name": name,
+                                         "query_time": _parse_member_query_time(name),
+                                         "offset": f_bundle.tell(),
+                                         "length": len(frame),
+                                         "size": size,
+                                         "sha256": sha256})
+                f_bundle.write(frame)
+
+    _verify_bundle(fullpath_tmp, index=index, dictionary=dictionary)
+
+    bytes_out = os.path.getsize(fullpath_tmp)
+    if dictionary:
+        with open(fullpath_bundle + SUFFIX_DICTIONARY, 'wb') as f:
+            f.write(dictionary)
+        bytes_out += len(dictionary)
+    with open(fullpath_bundle + SUFFIX_INDEX + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    # a bundle is only read with its index, which is replaced last, so readers never see an index of another bundle
+    if os.path.exists(fullpath_bundle + SUFFIX_INDEX):
+        os.remove(fullpath_bundle + SUFFIX_INDEX)
+    os.replace(fullpath_tmp, fullpath_bundle)
+    os.replace(fullpath_bundle + SUFFIX_INDEX + ".tmp", fullpath_bundle + SUFFIX_INDEX)
+    return bytes_out
+
+
+def _write_zip(files: typing.List[str], fullpath_zip: str, root_dir: str, level: int) -> int:
+    """Write files to ZIP archive, which is streamed by `ZipFile.write`, and verify CRCs
+
+    Returns:
+        int: size of ZIP archive in bytes
+    """
+    fullpath_tmp = fullpath_zip + ".tmp"
+    with ZipFile(fullpath_tmp, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=level) as zip_obj:
+        for f in files:
+            zip_obj.write(f, arcname=_get_member_name(f, root_dir))
+
+    with ZipFile(fullpath_tmp, 'r') as zip_obj:
+        bad_member = zip_obj.testzip()
+        sizes = {info.filename: info.file_size for info in zip_obj.infolist()}
+    if bad_member is not None:
+        raise ValueError(f"Verification of archive member '{bad_member}' failed.")
+    if any(sizes.get(_get_member_name(f, root_dir)) != os.path.getsize(f) for f in files):
+        raise ValueError(f"Verification of archive '{fullpath_zip}' failed. Sizes of members do not match.")
+
+    os.replace(fullpath_tmp, fullpath_zip)
+    return os.path.getsize(fullpath_zip)
+
+
+def _remove_empty_dirs(dirs: typing.Iterable[str], root_dir: str):
+    """Remove empty directories, e.g. city and date shards of removed API results, and their empty parents below root_dir"""
+    root_dir = os.path.abspath(root_dir)
+    for dir_ in sorted(set(os.path.abspath(d) for d in dirs), key=len, reverse=True):
+        while dir_ != root_dir and dir_.startswith(root_dir + os.sep) and os.path.isdir(dir_) and not os.listdir(dir_):
+            os.rmdir(dir_)
+            dir_ = os.path.dirname(dir_)
+
+
+def archive_raw_results(files_results: typing.List[typing.Union[str, typing.List[str]]],
+                        dir_archive: str,
+                        name_archive: str = None,
+                        codec: str = DEFAULT_CODEC,
+                        level: int = None,
+                        workers: int = DEFAULT_WORKERS,
+                        train_dictionary: bool = True,
+                        remove_originals: bool = False,
+                        root_dir: str = None) -> ArchiveStats:
+    """Archive raw API results. Every file is compressed into an independent frame of a single bundle file with a
+    sidecar index (for codec 'zip' into a ZIP archive), so single API results can be read without extracting the archive.
+    Originals are only removed after the archive has been verified.
+
+    Args:
+        files_results (typing.List[typing.Union[str, typing.List[str]]]): list of paths of chargecloud API results
+        dir_archive (str): directory to save archive
+        name_archive (str, optional): name of archive. If not provided date of last API result is incorporated in name of archive. Defaults to None.
+        codec (str, optional): any of {'zstd', 'gzip', 'xz', 'bz2', 'zip'}. Defaults to 'zstd' if package zstandard is installed, else 'gzip'.
+        level (int, optional): compression level. If not specified DEFAULT_LEVELS of codec is used. Defaults to None.
+        workers (int, optional): number of threads compressing files in parallel. Defaults to number of CPUs.
+        train_dictionary (bool, optional): whether to train a zstd dictionary on the API results. Only used for codec 'zstd'. Defaults to True.
+        remove_originals (bool, optional): whether to remove archived API results after verification. Shard directories left empty are removed as well. Defaults to False.
+        root_dir (str, optional): directory names of archive members are relative to. If not specified the common directory of all API results is used. Defaults to None.
+
+    Raises:
+        ValueError: Raised if codec is invalid or archive verification fails.
+
+    Returns:
+        ArchiveStats: number of archived files, uncompressed and compressed bytes and duration
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Parameter 'codec' must be any of {set(CODECS)}, but is actually '{codec}'.")
+
+    files = _flatten_files(files_results)
+    if not files:
+        logger.warning("No API results to archive.")
+        return ArchiveStats(n_files=0, bytes_in=0, bytes_out=0, seconds=0.0)
+
+    _level = DEFAULT_LEVELS[codec] if level is None else level
+    _root_dir = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files]) if root_dir is None else root_dir
+
+    if name_archive is None:
+        query_time = basename(files[-1]).split(SUFFIX_API_RESULTS, maxsplit=1)[0]
+        name_archive = PREFIX_ARCHIVE + query_time + CODECS[codec]
+
+    os.makedirs(dir_archive, exist_ok=True)
+    fullpath_archive = os.path.join(dir_archive, name_archive)
+
+    logger.info(f"Archiving {len(files)} API results to '{fullpath_archive}' with codec '{codec}'.")
+    t_start = time.perf_counter()
+    if codec == "zip":
+        bytes_out = _write_zip(files, fullpath_zip=fullpath_archive, root_dir=_root_dir, level=_level)
+    else:
+        bytes_out = _write_frame_bundle(files,
+                                        fullpath_bundle=fullpath_archive,
+                                        root_dir=os.path.abspath(_root_dir),
+                                        codec=codec,
+                                        level=_level,
+                                        workers=workers,
+                                        train_dictionary=train_dictionary)
+    stats = ArchiveStats(n_files=len(files),
+                         bytes_in=sum(os.path.getsize(f) for f in files),
+                         bytes_out=bytes_out,
+                         seconds=time.perf_counter() - t_start)
+
+    logger.info(f"Archived {stats.n_files} API results: {stats.bytes_in / 1e6:.1f} MB -> {stats.bytes_out / 1e6:.1f} MB "
+                f"(ratio {stats.compression_ratio:.1f}) at {stats.throughput_mb_s:.1f} MB/s.")
+
+    if remove_originals:
+        logger.info(f"Removing {len(files)} archived API results.")
+        for f in files:
+            os.remove(f)
+        _remove_empty_dirs([os.path.dirname(f) for f in files], root_dir=_root_dir)
+
+    return stats
+
+
+@functools.lru_cache(maxsize=32)
+def _load_index(fullpath_archive: str, mtime: float) -> dict:
+    """Load sidecar index (and dictionary) of frame bundle. Cached per archive and modification time."""
+    with open(fullpath_archive + SUFFIX_INDEX, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    index["members_by_name"] = {member["name"]: member for member in index["members"]}
+    index["dictionary_data"] = None
+    if index["dictionary"]:
+        with open(os.path.join(os.path.dirname(fullpath_archive), index["dictionary"]), 'rb') as f:
+            index["dictionary_data"] = f.read()
+    return index
+
+
+def _get_index(fullpath_archive: str) -> dict:
+    return _load_index(fullpath_archive, os.path.getmtime(fullpath_archive + SUFFIX_INDEX))
+
+
+def _is_tar(fullpath_archive: str) -> bool:
+    return fullpath_archive.endswith(EXTENSIONS_TAR)
+
+
+def is_archive(fullpath: str) -> bool:
+    """Check whether a path is a readable archive of API results, i.e. a ZIP archive, a tar archive or a frame bundle
+    with sidecar index"""
+    if fullpath.endswith(".zip") or _is_tar(fullpath):
+        return True
+    return fullpath.endswith(tuple(CODECS.values())) and os.path.exists(fullpath + SUFFIX_INDEX)
+
+
+class _FrameReader(io.RawIOBase):
+    """Readable stream over the decompressed chunks of a single frame of a frame bundle"""
+
+    def __init__(self, fullpath_bundle: str, member: dict, codec: str, dictionary: bytes = None):
+        self._f = open(fullpath_bundle, 'rb')
+        self._chunks = _iter_frame(self._f, member, codec=codec, dictionary=dictionary)
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+def list_archive_members(fullpath_archive: str) -> typing.List[dict]:
+    """List API results contained in an archive without decompressing them. Frame bundles use their sidecar index, 
+    ZIP archives their central directory and tar archives their member headers.
+
+    Args:
+        fullpath_archive (str): path of archive
+
+    Returns:
+        typing.List[dict]: members with keys 'name' and 'query_time' in archive order
+    """
+    if fullpath_archive.endswith(".zip"):
+        with ZipFile(fullpath_archive, 'r') as zip_obj:
+            names = [info.filename for info in zip_obj.infolist() if not info.is_dir()]
+    elif _is_tar(fullpath_archive):
+        with tarfile.open(fullpath_archive, 'r:*') as tar_obj:
+            names = [info.name for info in tar_obj if info.isfile()]
+    else:
+        return [{"name": member["name"], "query_time": member["query_time"]}
+                for member in _get_index(fullpath_archive)["members"]]
+    return [{"name": name, "query_time": _parse_member_query_time(name)} for name in names]
+
+
+def open_archive_member(fullpath_archive: str, name: str) -> typing.BinaryIO:
+    """Open an API result inside an archive as a decompressing stream without extracting the archive. Members of frame 
+    bundles and ZIP archives are accessed randomly, members of compressed tar archives require decompressing all 
+    preceding members, use `iter_archived_results` to read several members of a tar archive.
+
+    Args:
+        fullpath_archive (str): path of archive
+        name (str): name of member
+
+    Raises:
+        KeyError: Raised if archive does not contain member
+
+    Returns:
+        typing.BinaryIO: readable binary stream of member
+    """
+    if fullpath_archive.endswith(".zip"):
+        # opened members keep the underlying file open after the archive is closed
+        with ZipFile(fullpath_archive, 'r') as zip_obj:
+            return zip_obj.open(name)
+    elif _is_tar(fullpath_archive):
+        with tarfile.open(fullpath_archive, 'r:*') as tar_obj:
+            return io.BytesIO(tar_obj.extractfile(name).read())
+
+    index = _get_index(fullpath_archive)
+    member = index["members_by_name"][name]
+    return io.BufferedReader(_FrameReader(fullpath_archive,
+                                          member=member,
+                                          codec=index["codec"],
+                                          dictionary=index["dictionary_data"]))
+
+
+def find_archive_members(fullpath_archive: str, 
+                         start: str = None, 
+                         end: str = None) -> typing.List[dict]:
+    """Find members of an archive by query time using the index of the archive
+
+    Args:
+        fullpath_archive (str): path of archive
+        start (str, optional): start of time range (inclusive) formatted as FMT_QUERY_TIME. Defaults to None.
+        end (str, optional): end of time range (exclusive) formatted as FMT_QUERY_TIME. Defaults to None.
+
+    Returns:
+        typing.List[dict]: members with keys 'name' and 'query_time' sorted by query time
+    """
+    members = [m for m in list_archive_members(fullpath_archive) if m["query_time"] is not None]
+    if start is not None:
+        members = [m for m in members if m["query_time"] >= start]
+    if end is not None:
+        members = [m for m in members if m["query_time"] < end]
+    return sorted(members, key=lambda m: (m["query_time"], m["name"]))
+
+
+def iter_archived_results(fullpath_archive: str, 
+                          start: str = None, 
+                          end: str = None, 
+                          names: typing.Collection[str] = None) -> typing.Iterator[typing.Tuple[str, dict]]:
+    """Iterate API results of an archive one member at a time without extracting the archive
+
+    Args:
+        fullpath_archive (str): path of archive
+        start (str, optional): start of time range (inclusive) formatted as FMT_QUERY_TIME. Defaults to None.
+        end (str, optional): end of time range (exclusive) formatted as FMT_QUERY_TIME. Defaults to None.
+        names (typing.Collection[str], optional): names of members to read, other members are skipped without decoding them. Defaults to None.
+
+    Yields:
+        typing.Iterator[typing.Tuple[str, dict]]: name of member and API result in archive order
+    """
+    names = set(names) if names is not None else None
+    if _is_tar(fullpath_archive):
+        # single sequential pass, as members of compressed tar archives can not be accessed randomly
+        with tarfile.open(fullpath_archive, 'r|*') as tar_obj:
+            for info in tar_obj:
+                query_time = _parse_member_query_time(info.name)
+                if not info.isfile() or query_time is None:
+                    continue
+                if (start is not None and query_time < start) or (end is not None and query_time >= end):
+                    continue
+                if names is not None and info.name not in names:
+                    continue
+                yield info.name, read_archive_member_stream(tar_obj.extractfile(info), info.name)
+        return
+
+    for member in find_archive_members(fullpath_archive, start=start, end=end):
+        if names is not None and member["name"] not in names:
+            continue
+        yield member["name"], read_archived_result(fullpath_archive, member["name"])
+
+
+def read_archive_member_stream(f: typing.BinaryIO, name: str) -> dict:
+    """Decode API result from a stream of an archive member based on the member's file extension"""
+    with f:
+        if name.endswith(".pkl"):
+            return pickle.load(f)
+        return json.load(f)
+
+
+def read_archived_result(fullpath_archive: str, name: str) -> dict:
+    """Read a single API result from an archive
+
+    Args:
+        fullpath_archive (str): path of archive
+        name (str): name of member
+
+    Returns:
+        dict: dictionary containing cities as keys and chargecloud API results as values
+    """
+    return read_archive_member_stream(open_archive_member(fullpath_archive, name), name)
+
+
+def split_archive_reference(reference: str) -> typing.Tuple[str, str]:
+    """Split reference of an archived API result into path of archive and name of member"""
+    fullpath_archive, name = reference.split(SEP_ARCHIVE_MEMBER, maxsplit=1)
+    return fullpath_archive, name
+
+
+def get_archive_references(fullpath_archive: str, start: str = None, end: str = None) -> typing.List[str]:
+    """Get references 'archive::member' of archived API results within time range sorted by query time"""
+    return [fullpath_archive + SEP_ARCHIVE_MEMBER + member["name"]
+            for member in find_archive_members(fullpath_archive, start=start, end=end)]
@@ -0,0 +1,325 @@
+"""Command line entry point of the pipeline, e.g. `python src/cli.py preprocess --start 2022-01-01`.
+
+Modules of the commands are imported inside the command handlers, so each command only loads the dependencies it
+needs, e.g. `scrape` and `preprocess` do not import geopandas or osmnx.
+"""
+import argparse
+import logging
+import logging.config
+import typing
+import socket
+import sys
+import os
+
+from settings import (LOGGING_CONFIG,
+                      METRICS_FILENAME,
+                      PROMETHEUS_PORT,
+                      CONFIG_FILE,
+                      DIR_DATA,
+                      DIR_SAVE_API_RESULTS,
+                      DIR_MERGED_API_RESULTS,
+                      DIR_SAVE_OSM,
+                      DIR_STATUS_LOG,
+                      DIR_PROFILES,
+                      DIR_TRANSITIONS,
+                      DIR_FEATURES,
+                      LATEST_STATUS_HOST,
+                      LATEST_STATUS_PORT,
+                      LATEST_STATUS_POLL_INTERVAL,
+                      BASE_URL_CHARGECLOUD,
+                      SCRAPING_INTERVAL,
+                      REQUEST_TIMEOUT,
+                      MAX_RETRIES,
+                      FNAME_TRANSITIONS,
+                      FNAME_TRANSITIONS_DB,
+                      FNAME_LEASE_DB,
+                      MERGE_MIN_AGE)
+
+logger = logging.getLogger(__name__)
+
+
+def _split_cities(value: str) -> typing.List[str]:
+    return [city.strip() for city in value.split(",") if city.strip()]
+
+
+def _build_transition_tracker(args: argparse.Namespace):
+    import transitions
+
+    sinks = []
+    last_statuses = None
+    if args.transitions_file is not None:
+        sinks.append(transitions.JsonLinesSink(args.transitions_file))
+    if args.transitions_db is not None:
+        sink_db = transitions.SQLiteSink(args.transitions_db)
+        # transitions across a restart of the scraper are emitted with the first tick
+        last_statuses = sink_db.last_statuses()
+        sinks.append(sink_db)
+    if not sinks:
+        return None
+    return transitions.TransitionTracker(sinks=sinks, last_statuses=last_statuses)
+
+
+def run_scrape(args: argparse.Namespace):
+    import get_chargecloud_data
+
+    cities = args.cities or get_chargecloud_data.CITIES_CC
+    dir_status_log = None if args.no_status_log else args.dir_status_log
+    transition_tracker = _build_transition_tracker(args)
+    request_kwargs = {"base_url": args.base_url,
+                      "timeout": (args.connect_timeout, args.timeout),
+                      "max_retries": args.max_retries,
+                      "transition_tracker": transition_tracker}
+    lease_table = None
+    if args.lease_db is not None:
+        import partitioning
+
+        lease_table = partitioning.LeaseTable(args.lease_db)
+        request_kwargs["partitioner"] = partitioning.CityPartitioner(args.node_id,
+                                                                     lease_table=lease_table,
+                                                                     interval=args.interval * 60)
+    try:
+        if args.once and lease_table is None:
+            get_chargecloud_data.scrape_cp_cities(cities=cities,
+                                                  dir_save=args.dir_save,
+                                                  save_raw=not args.pickle,
+                                                  dir_status_log=dir_status_log,
+                                                  shard_by_city=args.shard_by_city,
+                                                  **request_kwargs)
+            return
+        # a partitioned scrape of a single tick still waits for the tick on the wall clock shared by the nodes
+        get_chargecloud_data.call_chargecloud_api(scraping_interval=args.interval,
+                                                  cities=cities,
+                                                  dir_save_api_results=args.dir_save,
+                                                  save_raw=not args.pickle,
+                                                  dir_status_log=dir_status_log,
+                                                  shard_by_city=args.shard_by_city,
+                                                  max_ticks=1 if args.once else args.max_ticks,
+                                                  diff_payloads=not args.no_diff_payloads,
+                                                  **request_kwargs)
+    finally:
+        if transition_tracker is not None:
+            transition_tracker.close()
+        if lease_table is not None:
+            lease_table.close()
+
+
+def run_merge_shards(args: argparse.Namespace):
+    import get_chargecloud_data
+    import partitioning
+
+    lease_table = partitioning.LeaseTable(args.lease_db)
+    transition_tracker = _build_transition_tracker(args)
+    try:
+        partitioning.merge_ticks(lease_table,
+                                 cities=args.cities or get_chargecloud_data.CITIES_CC,
+                                 dir_shards=args.dir_shards,
+                                 dir_merged=args.dir_merged,
+                                 save_raw=not args.pickle,
+                                 min_age=args.min_age,
+                                 transition_tracker=transition_tracker)
+    finally:
+        if transition_tracker is not None:
+            transition_tracker.close()
+        lease_table.close()
+
+
+def run_osm(args: argparse.Namespace):
+    import get_osm_data
+
+    get_poi_kwargs = {"dir_save": args.dir_save}
+    if args.cities:
+        get_poi_kwargs["cities"] = {city: get_osm_data.CITIES_OSM.get(city, city) for city in args.cities}
+    get_osm_data.get_poi_osm_data(**get_poi_kwargs)
+
+
+def run_preprocess(args: argparse.Namespace):
+    import preprocess_results
+
+    preprocess_kwargs = {}
+    if args.codec is not None:
+        preprocess_kwargs["archive_codec"] = args.codec
+    preprocess_results.postprocess_api_results(dir_api_results=args.dir_api_results,
+                                               dir_status_cps=args.dir_output,
+                                               dir_status_connectors=args.dir_output,
+                                               dir_master_data=args.dir_output,
+                                               dir_sessions=None if args.no_sessions else args.dir_output,
+                                               dir_zip_file=args.dir_archive,
+                                               remove_archived=args.remove_archived,
+                                               dir_archives=args.dir_archives,
+                                               start=args.start,
+                                               end=args.end,
+                                               cities=args.cities,
+                                               strict_validation=args.strict_validation,
+                                               **preprocess_kwargs)
+
+
+def run_match(args: argparse.Namespace):
+    import preprocess_results
+
+    preprocess_results.match_cs_to_poi(dir_charging_stations=args.dir_charging_stations,
+                                       dir_osm_poi=args.dir_osm,
+                                       dir_save_mapping_table=args.dir_output)
+
+
+def run_features(args: argparse.Namespace):
+    import features
+
+    features.build_features(dir_status=args.dir_status,
+                            dir_master_data=args.dir_master_data,
+                            dir_osm_poi=args.dir_osm,
+                            dir_features=args.dir_features,
+                            start=args.start,
+                            end=args.end,
+                            overwrite=args.overwrite)
+
+
+def run_status_api(args: argparse.Namespace):
+    import latest_status
+
+    index = latest_status.build_index(dir_master_data=args.dir_master_data)
+    latest_status.serve(index,
+                        host=args.host,
+                        port=args.port,
+                        dir_status_log=args.dir_status_log,
+                        poll_interval=args.poll_interval)
+
+
+def run_etl(args: argparse.Namespace):
+    import etl
+
+    etl.main(config_file=args.config, resume=args.resume)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Charging data pipeline")
+    parser.add_argument("--log-level", default=None, choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="level of root logger (default: level of logging config)")
+    parser.add_argument("--metrics-file", default=METRICS_FILENAME,
+                        help="file metrics are appended to as JSON lines, empty to disable (default: %(default)s)")
+    parser.add_argument("--profile", nargs="?", const=DIR_PROFILES, default=None, metavar="DIR",
+                        help="profile pipeline stages and write profiles to DIR (default: %(const)s)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scrape = subparsers.add_parser("scrape", help="call chargecloud API in regular time intervals")
+    scrape.add_argument("--cities", type=_split_cities, default=None, help="comma separated cities (default: all)")
+    scrape.add_argument("--interval", type=float, default=SCRAPING_INTERVAL, help="scraping interval in minutes (default: %(default)s)")
+    scrape.add_argument("--once", action="store_true", help="scrape once and exit")
+    scrape.add_argument("--max-ticks", type=int, default=None, help="stop after this number of scrapes (default: run until stopped)")
+    scrape.add_argument("--base-url", default=BASE_URL_CHARGECLOUD, help="base URL of API, e.g. of a local stub (default: %(default)s)")
+    scrape.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT[1], help="read timeout of a request in seconds (default: %(default)s)")
+    scrape.add_argument("--connect-timeout", type=float, default=REQUEST_TIMEOUT[0], help="connect timeout of a request in seconds (default: %(default)s)")
+    scrape.add_argument("--max-retries", type=int, default=MAX_RETRIES, help="retries of a city per scrape (default: %(default)s)")
+    scrape.add_argument("--dir-save", default=DIR_SAVE_API_RESULTS, help="directory of API results (default: %(default)s)")
+    scrape.add_argument("--pickle", action="store_true", help="save API results as pickle instead of json")
+    scrape.add_argument("--shard-by-city", action="store_true", help="save API results sharded by city and date")
+    scrape.add_argument("--dir-status-log", default=DIR_STATUS_LOG, help="directory of status log (default: %(default)s)")
+    scrape.add_argument("--no-status-log", action="store_true", help="do not append to status log")
+    scrape.add_argument("--no-diff-payloads", action="store_true", help="save full API results of cities whose payload did not change")
+    scrape.add_argument("--transitions-file", nargs="?", const=os.path.join(DIR_TRANSITIONS, FNAME_TRANSITIONS), default=None, metavar="PATH",
+                        help="append status transitions as JSON lines to PATH (default: %(const)s)")
+    scrape.add_argument("--transitions-db", nargs="?", const=os.path.join(DIR_TRANSITIONS, FNAME_TRANSITIONS_DB), default=None, metavar="PATH",
+                        help="insert status transitions into SQLite database PATH (default: %(const)s)")
+    scrape.add_argument("--lease-db", nargs="?", const=os.path.join(DIR_SAVE_API_RESULTS, FNAME_LEASE_DB), default=None, metavar="PATH",
+                        help="share cities with other scraper nodes by leases in SQLite database PATH (default: %(const)s)")
+    scrape.add_argument("--node-id", default=f"{socket.gethostname()}-{os.getpid()}", help="id of scraper node sharing cities (default: %(default)s)")
+    scrape.add_argument("--metrics-port", nargs="?", type=int, const=PROMETHEUS_PORT, default=None, metavar="PORT",
+                        help="serve metrics in the Prometheus text format on http://<host>:PORT/metrics (default: %(const)s)")
+    scrape.set_defaults(func=run_scrape)
+
+    merge_shards = subparsers.add_parser("merge-shards", help="merge city shards of scraper nodes to one snapshot per tick")
+    merge_shards.add_argument("--lease-db", default=os.path.join(DIR_SAVE_API_RESULTS, FNAME_LEASE_DB), help="lease database shared by the scraper nodes (default: %(default)s)")
+    merge_shards.add_argument("--dir-shards", default=DIR_SAVE_API_RESULTS, help="directory of API results sharded by city (default: %(default)s)")
+    merge_shards.add_argument("--dir-merged", default=DIR_MERGED_API_RESULTS, help="directory of merged API results (default: %(default)s)")
+    merge_shards.add_argument("--cities", type=_split_cities, default=None, help="comma separated cities expected per tick (default: all)")
+    merge_shards.add_argument("--pickle", action="store_true", help="API results are saved as pickle instead of json")
+    merge_shards.add_argument("--min-age", type=float, default=MERGE_MIN_AGE, help="seconds after the end of a tick until it is merged (default: %(default)s)")
+    merge_shards.add_argument("--transitions-file", nargs="?", const=os.path.join(DIR_TRANSITIONS, FNAME_TRANSITIONS), default=None, metavar="PATH",
+                              help="append status transitions of merged ticks as JSON lines to PATH (default: %(const)s)")
+    merge_shards.add_argument("--transitions-db", nargs="?", const=os.path.join(DIR_TRANSITIONS, FNAME_TRANSITIONS_DB), default=None, metavar="PATH",
+                              help="insert status transitions of merged ticks into SQLite database PATH (default: %(const)s)")
+    merge_shards.set_defaults(func=run_merge_shards)
+
+    osm = subparsers.add_parser("osm", help="download OSM POI locations")
+    osm.add_argument("--cities", type=_split_cities, default=None, help="comma separated cities (default: all)")
+    osm.add_argument("--dir-save", default=DIR_SAVE_OSM, help="directory of POI shapefiles (default: %(default)s)")
+    osm.set_defaults(func=run_osm)
+
+    preprocess = subparsers.add_parser("preprocess", help="extract master data and status data from API results")
+    preprocess.add_argument("--dir-api-results", default=DIR_SAVE_API_RESULTS, help="directory of API results (default: %(default)s)")
+    preprocess.add_argument("--dir-output", default=DIR_DATA, help="directory of extracted data (default: %(default)s)")
+    preprocess.add_argument("--dir-archive", default=None, help="archive raw API results to this directory")
+    preprocess.add_argument("--codec", default=None, choices=["zstd", "gzip", "xz", "bz2", "zip"], help="codec of archive")
+    preprocess.add_argument("--remove-archived", action="store_true", help="remove raw API results after archiving")
+    preprocess.add_argument("--dir-archives", default=None, help="also read API results from archives in this directory")
+    preprocess.add_argument("--start", default=None, help="first query time to process, e.g. 2022-01-01")
+    preprocess.add_argument("--end", default=None, help="query time to stop processing at (exclusive)")
+    preprocess.add_argument("--cities", type=_split_cities, default=None, help="comma separated cities, merged into the existing outputs (default: all)")
+    preprocess.add_argument("--no-sessions", action="store_true", help="do not reconstruct charging sessions")
+    preprocess.add_argument("--strict-validation", action="store_true", help="stop at the first failing data quality check")
+    preprocess.set_defaults(func=run_preprocess)
+
+    match = subparsers.add_parser("match", help="match charging stations to OSM POIs")
+    match.add_argument("--dir-charging-stations", default=DIR_DATA, help="directory of charging_stations.csv (default: %(default)s)")
+    match.add_argument("--dir-osm", default=DIR_SAVE_OSM, help="directory of POI shapefiles (default: %(default)s)")
+    match.add_argument("--dir-output", default=DIR_DATA, help="directory of mapping table (default: %(default)s)")
+    match.set_defaults(func=run_match)
+
+    features = subparsers.add_parser("features", help="materialize occupancy features of completed days in feature store")
+    features.add_argument("--dir-status", default=DIR_DATA, help="directory of status_cps.csv, ids_cps.csv and snapshots.csv (default: %(default)s)")
+    features.add_argument("--dir-master-data", default=DIR_DATA, help="directory of charging_points.csv and mapping_poi_cs.csv (default: %(default)s)")
+    features.add_argument("--dir-osm", default=DIR_SAVE_OSM, help="directory of POI shapefiles (default: %(default)s)")
+    features.add_argument("--dir-features", default=DIR_FEATURES, help="directory of feature store (default: %(default)s)")
+    features.add_argument("--start", default=None, help="first local date to materialize, e.g. 2022-01-01")
+    features.add_argument("--end", default=None, help="local date to stop at (exclusive, default: date of last status record)")
+    features.add_argument("--overwrite", action="store_true", help="recompute dates already materialized")
+    features.set_defaults(func=run_features)
+
+    status_api = subparsers.add_parser("status-api", help="serve latest status of charging points as local JSON API")
+    status_api.add_argument("--host", default=LATEST_STATUS_HOST, help="host to bind to (default: %(default)s)")
+    status_api.add_argument("--port", type=int, default=LATEST_STATUS_PORT, help="port to bind to (default: %(default)s)")
+    status_api.add_argument("--dir-master-data", default=DIR_DATA, help="directory of charging_stations.csv and charging_points.csv (default: %(default)s)")
+    status_api.add_argument("--dir-status-log", default=DIR_STATUS_LOG, help="status log appended by the scraper (default: %(default)s)")
+    status_api.add_argument("--poll-interval", type=float, default=LATEST_STATUS_POLL_INTERVAL, help="seconds between reads of new status records (default: %(default)s)")
+    status_api.add_argument("--metrics-port", nargs="?", type=int, const=PROMETHEUS_PORT, default=None, metavar="PORT",
+                            help="serve metrics in the Prometheus text format on http://<host>:PORT/metrics (default: %(const)s)")
+    status_api.set_defaults(func=run_status_api)
+
+    etl = subparsers.add_parser("etl", help="create data model and ingest data into Redshift")
+    etl.add_argument("--config", default=CONFIG_FILE, help="config file (default: %(default)s)")
+    etl.add_argument("--resume", action="store_true", help="resume a failed run at the failed table, reusing the staging tables it already loaded")
+    etl.set_defaults(func=run_etl)
+
+    return parser
+
+
+def main(argv: typing.List[str] = None):
+    args = build_parser().parse_args(argv)
+
+    logging.config.dictConfig(LOGGING_CONFIG)
+    if args.log_level is not None:
+        logging.getLogger().setLevel(args.log_level)
+
+    import metrics
+    import profiling
+
+    if args.metrics_file:
+        metrics.configure(args.metrics_file)
+    if args.profile is not None:
+        profiling.enable(dir_profiles=args.profile)
+    # only long-running commands have a metrics endpoint
+    server_metrics = None
+    if getattr(args, "metrics_port", None) is not None:
+        server_metrics = metrics.serve_prometheus(port=args.metrics_port)
+
+    try:
+        args.func(args)
+    finally:
+        if server_metrics is not None:
+            server_metrics.shutdown()
+            server_metrics.server_close()
+        metrics.METRICS.log_summary()
+        profiling.dump()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
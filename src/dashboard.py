@@ -1,38 +1,78 @@
 import streamlit as st
 import pandas as pd 
-import configparser
-import psycopg2
-import geopandas as gpd 
 import numpy as np
 import altair as alt 
+import pydeck as pdk
+import requests
 
+import dashboard_data
+import downsampling
+from db import ConnectionPool, dsn_from_config
+from settings import CONFIG_FILE
 
 
-CONFIG_FILE = "../config.cfg"
-
 # can only set this once, first thing to set
 st.set_page_config(layout="wide")
 
-config = configparser.ConfigParser()
-config.read(CONFIG_FILE)
-
+# connections are shared by all sessions of the app
 @st.experimental_singleton
-def get_db_connection(): 
-    
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
-    cur = conn.cursor()
-    return conn
+def get_db_pool(): 
+    return ConnectionPool(dsn_from_config(CONFIG_FILE), minconn=1, maxconn=5)
 
 
 @st.experimental_memo
-def get_master_data(_conn): 
-    
-    df_cs = pd.read_sql(con=_conn, sql="select * from charging_station")
-    df_cp = pd.read_sql(con=_conn, sql="select * from charging_point")
-    df_conn = pd.read_sql(con=_conn, sql="select * from connector")
-    gdf_poi = gpd.read_postgis(con=_conn, sql="select * from poi")
-    
-    return df_cs, df_cp, df_conn, gdf_poi
+def get_station_list(_pool): 
+    return _pool.run(dashboard_data.get_station_list)
+
+
+@st.experimental_memo(max_entries=1000)
+def get_single_cs(cs_id, _pool): 
+    return _pool.run(lambda conn: dashboard_data.get_station(conn, id_cs=cs_id))
+
+
+@st.experimental_memo(max_entries=1000)
+def get_cps(cs_id, _pool): 
+    return _pool.run(lambda conn: dashboard_data.get_charging_points(conn, id_cs=cs_id))
+
+
+@st.experimental_memo(max_entries=1000)
+def get_connectors(cp_id, _pool): 
+    return _pool.run(lambda conn: dashboard_data.get_connectors(conn, id_cp=cp_id))
+
+
+@st.experimental_memo(max_entries=1000)
+def get_pois(cs_id, _pool): 
+    return _pool.run(lambda conn: dashboard_data.get_pois_station(conn, id_cs=cs_id))
+
+
+# rollups are refreshed by the ETL, overview queries are cached for 10 minutes
+@st.experimental_memo(ttl=600)
+def get_station_utilization(window_days, _pool): 
+    end = pd.Timestamp.now(tz="UTC").ceil("h")
+    start = end - pd.Timedelta(days=window_days) if window_days is not None else None
+    return _pool.run(lambda conn: dashboard_data.get_station_utilization(conn, start=start, end=end))
+
+
+@st.experimental_memo(ttl=600)
+def get_city_utilization(window_days, resolution, cities, _pool): 
+    end = pd.Timestamp.now(tz="UTC").ceil("h")
+    start = end - pd.Timedelta(days=window_days) if window_days is not None else None
+    return _pool.run(lambda conn: dashboard_data.get_city_utilization(conn, 
+                                                                      start=start, 
+                                                                      end=end, 
+                                                                      resolution=resolution, 
+                                                                      cities=list(cities)))
+
+
+# latest status changes with every scrape, it is cached for a minute
+@st.experimental_memo(ttl=60)
+def get_latest_status(cs_id, latitude, longitude): 
+    try: 
+        return (dashboard_data.get_latest_status_station(cs_id), 
+                dashboard_data.get_nearest_available(latitude, longitude, k=N_NEAREST_STATIONS + 1))
+    except requests.RequestException: 
+        return None, None
+
 
 STATUS_NUMERICAL = {"AVAILABLE": 0, 
                     "RESERVED": 0.5,
@@ -40,108 +80,194 @@ STATUS_NUMERICAL = {"AVAILABLE": 0,
                     "OUTOFORDER": -1, 
                     "UNKNOWN": np.nan}
 
-@st.experimental_memo
-def get_status_data(_conn, id, query_cp=True):
-    table = "status_chargingpoints" if query_cp else "status_connectors"
-    col_id = "id_chargingpoint" if query_cp else "id_conn"
-    col_status = "status_cp" if query_cp else "status_connector"
-    sql = f"select query_time, {col_status} as status from {table} where {col_id} = '{id}'"
-    df_status = pd.read_sql(con=_conn, sql=sql)
+# time windows in days selectable in the sidebar, None for the whole history
+TIME_WINDOWS = {"Last day": 1, "Last 7 days": 7, "Last 30 days": 30, "Whole history": None}
+# resolutions in seconds selectable in the sidebar, None for every status record, "auto" chooses by time window
+RESOLUTIONS = {"Auto": "auto", "Every status": None, "Hourly": 3600, "Daily": 86400}
+DOWNSAMPLING_MODES = {"Status changes": downsampling.MODE_CHANGES, "LTTB": downsampling.MODE_LTTB}
+RESOLUTIONS_OVERVIEW = {"Hourly": 3600, "Daily": 86400}
+N_TOP_STATIONS = 10
+N_NEAREST_STATIONS = 5
+OCCUPANCY_MEASURES = {"Current occupancy": "occupancy_current", "Average occupancy": "occupancy_avg"}
+# center of Germany, the map is centered there if no station has coordinates
+MAP_CENTER_DEFAULT = (51.16, 10.45)
+
+
+def get_status_data(_pool, id, window_days=None, resolution=None, query_cp=True):
+    # end of time window is rounded up to the scraping interval of 10 minutes so repeated queries hit the cache
+    end = pd.Timestamp.now(tz="UTC").ceil("10min")
+    start = end - pd.Timedelta(days=window_days) if window_days is not None else None
+    if resolution == "auto": 
+        resolution = downsampling.auto_resolution(window_days * 86400 if window_days is not None else None)
+    df_status = _pool.run(lambda conn: dashboard_data.get_status_data(conn, 
+                                                                      id=id, 
+                                                                      start=start, 
+                                                                      end=end, 
+                                                                      resolution=resolution, 
+                                                                      query_cp=query_cp)).copy()
     
     df_status["status_num"] = df_status["status"].map(STATUS_NUMERICAL)
-    return df_status 
-
+    return df_status, resolution, end
 
-conn = get_db_connection()
 
-df_cs, df_cp, df_conn, gdf_poi = get_master_data(conn)
+def occupancy_color(occupancy): 
+    # green for free, red for occupied and gray for stations without known status
+    if pd.isna(occupancy): 
+        return [160, 160, 160, 160]
+    return [int(255 * occupancy), int(255 * (1 - occupancy)), 0, 200]
 
 
+def render_overview(pool): 
+    window = st.sidebar.selectbox('Time window:', list(TIME_WINDOWS), index=1)
+    measure = st.sidebar.selectbox('Color stations by:', list(OCCUPANCY_MEASURES))
+    resolution = st.sidebar.selectbox('Resolution:', list(RESOLUTIONS_OVERVIEW))
     
-# st.dataframe(df_cs)
-# st.dataframe(df_cp)
-# st.dataframe(df_conn)
-# st.dataframe(gdf_poi)
-
-@st.experimental_memo
-def get_single_cs(cs_id, df_cs): 
-    return df_cs.query(f"id_cs=={cs_id}")
-
-@st.experimental_memo
-def get_cps(cs_id, df_cp): 
-    return df_cp.query(f"id_cs=={cs_id}").reset_index(drop=True)
-
-@st.experimental_memo
-def get_connectors(cp_id, df_conn): 
-    return df_conn.query(f"id_cp=='{cp_id}'").reset_index(drop=True)
-
-
-st.sidebar.image("https://iconoir.com/source/icons/ev-plug-charging.svg")
-cs_id = st.sidebar.selectbox('Select charging station by id:', df_cs["id_cs"])
-df_cs_selected = get_single_cs(cs_id=cs_id, df_cs=df_cs)
-ser_cs = df_cs_selected.iloc[0]
-df_cp_selected = get_cps(cs_id=cs_id, df_cp=df_cp)
-cp_id = st.sidebar.selectbox('Select charging point by id:', df_cp_selected["id_cp"])
-
-df_connectors_selected = get_connectors(cp_id=cp_id, df_conn=df_conn)
-df_status = get_status_data(id=cp_id, _conn=conn)
-
-
-#st.dataframe(df_status)
-
-with st.container():
-    st.title("Charging station utilization")
-    st.header(f"Charging station {ser_cs.operator_name}: {ser_cs.address}, {ser_cs.postal_code} {ser_cs.city}.")
-    st.header(f"Charging point: {cp_id}")
-    #st.dataframe(df_connectors_selected)
-    #st.write("""See the code and plots for five libraries at once.""")
-
-col1, col2, col3 = st.columns(3)
-
-brush = alt.selection(type='interval',  encodings=['y'])
-
-c = (alt.Chart(df_status).mark_point().encode(
-     x='query_time', y='status_num', color=alt.condition(brush, 'status', alt.ColorValue('gray'))).add_selection(
-    brush
-)
-     .interactive()
-     .properties(
-    title="Utilization Data for Charging Point",
-    width=400,
-    height=300,
-)
-     )
-
-with col1:
-    df_plot = df_cs_selected
-    st.map(df_plot)
-
-with col2: 
-    #st.slider("Filter results", df_status.query_time.min(), df_status.query_time.max(), value, step)
-    st.altair_chart(c, use_container_width=True)
-    bar_chart_input = pd.DataFrame(df_status["status"].value_counts())
-    bar_chart_input["status_percentage"] = np.round(bar_chart_input["status"]/bar_chart_input["status"].sum() * 100)/100
-    bar_chart_input.drop(columns="status", inplace=True)
-    bar_chart_input.index.name = "status"
-    bar_chart_input.reset_index(drop=False, inplace=True)
-    #st.bar_chart(bar_chart_input)
+    df_util = get_station_utilization(window_days=TIME_WINDOWS[window], _pool=pool)
+    cities = st.sidebar.multiselect('Cities:', sorted(df_util["city"].dropna().unique()))
+    if cities: 
+        df_util = df_util[df_util["city"].isin(cities)]
+    
+    st.title("Charging network utilization")
+    
+    col_measure = OCCUPANCY_MEASURES[measure]
+    df_map = df_util.dropna(subset=["latitude", "longitude"]).copy()
+    df_map["color"] = df_map[col_measure].map(occupancy_color)
+    df_map["occupancy_pct"] = (df_map[col_measure] * 100).round(0)
+    layer = pdk.Layer("ScatterplotLayer", 
+                      data=df_map[["id_cs", "name", "city", "latitude", "longitude", "color", "occupancy_pct"]], 
+                      get_position=["longitude", "latitude"], 
+                      get_fill_color="color", 
+                      get_radius=80, 
+                      radius_min_pixels=3, 
+                      pickable=True)
+    latitude, longitude = ((df_map["latitude"].mean(), df_map["longitude"].mean()) if df_map.shape[0] > 0 
+                           else MAP_CENTER_DEFAULT)
+    view_state = pdk.ViewState(latitude=latitude, longitude=longitude, zoom=6)
+    st.pydeck_chart(pdk.Deck(layers=[layer], 
+                             initial_view_state=view_state, 
+                             tooltip={"text": "{name} ({city}): {occupancy_pct}% occupied"}))
+    
+    col1, col2 = st.columns(2)
+    with col1: 
+        df_city = get_city_utilization(window_days=TIME_WINDOWS[window], 
+                                       resolution=RESOLUTIONS_OVERVIEW[resolution], 
+                                       cities=tuple(cities), 
+                                       _pool=pool)
+        c = (alt.Chart(df_city).mark_line().encode(
+             x='query_time', y=alt.Y('occupancy', axis=alt.Axis(format='%')), color='city')
+             .interactive()
+             .properties(title="Occupancy by city", width=400, height=300))
+        st.altair_chart(c, use_container_width=True)
     
-    # inspired by: https://altair-viz.github.io/gallery/radial_chart.html
-    base = alt.Chart(bar_chart_input).encode(
-    theta=alt.Theta("status_percentage:Q", stack=True),
-    radius=alt.Radius("status_percentage", scale=alt.Scale(type="sqrt", zero=True, rangeMin=20)),
-    color="status:N",
-)
+    with col2: 
+        df_top = (df_util.nlargest(N_TOP_STATIONS, "occupancy_avg")
+                  [["id_cs", "name", "city", "occupancy_avg", "occupancy_current"]])
+        st.subheader(f"Top {N_TOP_STATIONS} busiest charging stations")
+        st.dataframe(df_top.style.format({"occupancy_avg": "{:.0%}", "occupancy_current": "{:.0%}"}))
+
+
+def render_station(pool): 
+    df_cs = get_station_list(pool)
+    cs_id = st.sidebar.selectbox('Select charging station by id:', df_cs["id_cs"])
+    df_cs_selected = get_single_cs(cs_id=cs_id, _pool=pool)
+    ser_cs = df_cs_selected.iloc[0]
+    df_cp_selected = get_cps(cs_id=cs_id, _pool=pool)
+    cp_id = st.sidebar.selectbox('Select charging point by id:', df_cp_selected["id_cp"])
+
+    df_connectors_selected = get_connectors(cp_id=cp_id, _pool=pool)
+    gdf_poi_selected = get_pois(cs_id=cs_id, _pool=pool)
+    window = st.sidebar.selectbox('Time window:', list(TIME_WINDOWS), index=2)
+    resolution = st.sidebar.selectbox('Resolution:', list(RESOLUTIONS))
+    mode_downsampling = st.sidebar.selectbox('Downsampling:', list(DOWNSAMPLING_MODES))
+    df_status, resolution_status, end = get_status_data(id=cp_id, 
+                                                        _pool=pool, 
+                                                        window_days=TIME_WINDOWS[window], 
+                                                        resolution=RESOLUTIONS[resolution])
+    # aggregated status history is already bounded by the number of buckets
+    df_plot_status = df_status
+    if resolution_status is None: 
+        df_plot_status = downsampling.downsample_status(df_status, mode=DOWNSAMPLING_MODES[mode_downsampling])
+
+
+    #st.dataframe(df_status)
+
+    with st.container():
+        st.title("Charging station utilization")
+        st.header(f"Charging station {ser_cs.operator_name}: {ser_cs.address}, {ser_cs.postal_code} {ser_cs.city}.")
+        st.header(f"Charging point: {cp_id}")
+        #st.dataframe(df_connectors_selected)
+        #st.write("""See the code and plots for five libraries at once.""")
+
+    col1, col2, col3 = st.columns(3)
+
+    df_latest, df_nearest = get_latest_status(cs_id, ser_cs.latitude, ser_cs.longitude)
+    with col3: 
+        if df_latest is None: 
+            st.info("Latest status is not available, start it with `python src/cli.py status-api`.")
+        else: 
+            st.subheader("Latest status")
+            st.dataframe(df_latest)
+            st.subheader("Nearest stations with a free charging point")
+            df_nearest = df_nearest[df_nearest["id_cs"] != cs_id].head(N_NEAREST_STATIONS)
+            st.dataframe(df_nearest[["name", "city", "n_available", "n_cps", "distance_m"]])
+
+    brush = alt.selection(type='interval',  encodings=['y'])
+
+    c = (alt.Chart(df_plot_status).mark_point().encode(
+         x='query_time', y='status_num', color=alt.condition(brush, 'status', alt.ColorValue('gray'))).add_selection(
+        brush
+    )
+         .interactive()
+         .properties(
+        title="Utilization Data for Charging Point",
+        width=400,
+        height=300,
+    )
+         )
+
+    with col1:
+        df_plot = pd.concat([df_cs_selected[["latitude", "longitude"]], 
+                             gdf_poi_selected[["latitude", "longitude"]]], ignore_index=True)
+        st.map(df_plot)
+
+    with col2: 
+        #st.slider("Filter results", df_status.query_time.min(), df_status.query_time.max(), value, step)
+        st.altair_chart(c, use_container_width=True)
+        # share of time spent in each status rather than share of status records
+        bar_chart_input = pd.DataFrame(downsampling.status_durations(df_status, 
+                                                                     resolution=resolution_status, 
+                                                                     end=end).rename("status"))
+        bar_chart_input["status_percentage"] = np.round(bar_chart_input["status"]/bar_chart_input["status"].sum() * 100)/100
+        bar_chart_input.drop(columns="status", inplace=True)
+        bar_chart_input.index.name = "status"
+        bar_chart_input.reset_index(drop=False, inplace=True)
+        #st.bar_chart(bar_chart_input)
+    
+        # inspired by: https://altair-viz.github.io/gallery/radial_chart.html
+        base = alt.Chart(bar_chart_input).encode(
+        theta=alt.Theta("status_percentage:Q", stack=True),
+        radius=alt.Radius("status_percentage", scale=alt.Scale(type="sqrt", zero=True, rangeMin=20)),
+        color="status:N",
+    )
 
-    c1 = base.mark_arc(innerRadius=20, stroke="#fff")
+        c1 = base.mark_arc(innerRadius=20, stroke="#fff")
 
-    c2 = base.mark_text(radiusOffset=10, ).encode(text=alt.Text("status_percentage:Q", format='.0%'))
+        c2 = base.mark_text(radiusOffset=10, ).encode(text=alt.Text("status_percentage:Q", format='.0%'))
  
-    c = (c1 + c2).properties(
-    title="Percentage of utilization",
-    width=400,
-    height=300,
-)
+        c = (c1 + c2).properties(
+        title="Percentage of utilization",
+        width=400,
+        height=300,
+    )
      
-    st.altair_chart(c, use_container_width=True)
+        st.altair_chart(c, use_container_width=True)
+
 
+pool = get_db_pool()
+
+st.sidebar.image("https://iconoir.com/source/icons/ev-plug-charging.svg")
+mode = st.sidebar.radio('View:', ["Network overview", "Charging station"])
+if mode == "Network overview": 
+    render_overview(pool)
+else: 
+    render_station(pool)
@@ -0,0 +1,392 @@
+import pandas as pd
+from pandas import DataFrame
+import geopandas as gpd
+from geopandas import GeoDataFrame
+from psycopg2.extensions import connection
+from collections import OrderedDict
+import datetime
+import requests
+import logging
+import threading
+import time
+import typing
+
+from settings import LATEST_STATUS_HOST, LATEST_STATUS_PORT
+from downsampling import MAX_GAP
+
+logger = logging.getLogger(__name__)
+
+
+# columns of master data shown in the dashboard
+COLS_STATION_LIST = ["id_cs", "name", "city"]
+COLS_STATION = ["id_cs", "name", "operator_name", "address", "postal_code", "city", "latitude", "longitude"]
+COLS_CHARGING_POINT = ["id_cp", "id_cs", "physical_reference", "vehicle_type"]
+COLS_CONNECTOR = ["id_connector", "id_cp", "standard", "power_type", "max_power"]
+COLS_POI = ["id_poi", "poi_category", "latitude", "longitude", "geom"]
+
+SQL_STATION_LIST = "select {cols} from charging_station order by id_cs"
+SQL_STATION = "select {cols} from charging_station where id_cs = %(id_cs)s"
+SQL_CHARGING_POINTS = "select {cols} from charging_point where id_cs = %(id_cs)s order by id_cp"
+SQL_CONNECTORS = "select {cols} from connector where id_cp = %(id_cp)s order by id_connector"
+SQL_POIS_STATION = """select {cols}
+                      from poi
+                      join mapping_poi_cs using (id_poi)
+                      where mapping_poi_cs.id_cs = %(id_cs)s"""
+SQL_POIS_BBOX = """select {cols}
+                   from poi
+                   where longitude between %(lon_min)s and %(lon_max)s
+                     and latitude between %(lat_min)s and %(lat_max)s"""
+
+
+# table, id column and status column of status queries for charging points (True) and connectors (False)
+STATUS_TABLES = {True: ("status_chargingpoints", "id_chargingpoint", "status_cp"), 
+                 False: ("status_connectors", "id_connector", "status_connector")}
+
+SQL_STATUS = """select query_time, {col_status} as status, 1 as n_samples
+                from {table}
+                where {col_id} = %(id)s
+                  and query_time >= %(start)s and query_time < %(end)s
+                order by query_time"""
+
+# buckets of `resolution` seconds, aggregated on the database server. A status lasts until the next record, at most 
+# `max_gap` seconds, and the last status until the end of the time window
+SQL_STATUS_AGGREGATED = """select timestamp 'epoch' + floor(extract(epoch from query_time) / %(resolution)s) 
+                                                      * %(resolution)s * interval '1 second' as query_time, 
+                                  status, 
+                                  count(*) as n_samples, 
+                                  sum(duration) as duration
+                           from (select query_time, 
+                                        {col_status} as status, 
+                                        least(greatest(extract(epoch from coalesce(lead(query_time) over (order by query_time), 
+                                                                                   cast(%(end)s as timestamptz))) 
+                                                       - extract(epoch from query_time), 0), %(max_gap)s) as duration
+                                 from {table}
+                                 where {col_id} = %(id)s
+                                   and query_time >= %(start)s and query_time < %(end)s) as s
+                           group by 1, 2
+                           order by 1, 2"""
+
+# network overview served from the rollups 'utilization_hourly_cs' and 'utilization_latest_cs'
+SQL_STATION_UTILIZATION = """select cs.id_cs, cs.name, cs.city, cs.latitude, cs.longitude, 
+                                    sum(u.seconds_occupied) / nullif(sum(u.seconds_known), 0) as occupancy_avg, 
+                                    l.occupancy as occupancy_current
+                             from charging_station cs
+                             left join utilization_hourly_cs u 
+                                 on u.id_cs = cs.id_cs 
+                                 and u."hour" >= %(start)s and u."hour" < %(end)s
+                             left join utilization_latest_cs l on l.id_cs = cs.id_cs
+                             group by cs.id_cs, cs.name, cs.city, cs.latitude, cs.longitude, l.occupancy"""
+
+SQL_CITY_UTILIZATION = """select timestamp 'epoch' + floor(extract(epoch from "hour") / %(resolution)s) 
+                                                    * %(resolution)s * interval '1 second' as query_time, 
+                                 city, 
+                                 sum(seconds_occupied) / nullif(sum(seconds_known), 0) as occupancy
+                          from utilization_hourly_cs
+                          where "hour" >= %(start)s and "hour" < %(end)s {filter_cities}
+                          group by 1, 2
+                          order by 1, 2"""
+
+SQL_DATA_VERSION = "select max(loaded_at) from etl_load_log"
+
+# resolution of the hourly rollup in seconds
+RESOLUTION_ROLLUP = 3600
+STATUS_CACHE_SIZE = 256
+DATA_VERSION_TTL = 60
+MIN_TIMESTAMP = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MAX_TIMESTAMP = datetime.datetime(2100, 1, 1, tzinfo=datetime.timezone.utc)
+
+# latest status is served by `latest_status.py` instead of the database
+LATEST_STATUS_URL = f"http://{LATEST_STATUS_HOST}:{LATEST_STATUS_PORT}"
+LATEST_STATUS_TIMEOUT = 2
+
+
+class StatusCache: 
+    """Bounded LRU cache of status queries which is cleared whenever a new ETL load is recorded in 'etl_load_log'. 
+    The load log is looked up at most every `version_ttl` seconds.
+    """
+    
+    def __init__(self, maxsize: int = STATUS_CACHE_SIZE, version_ttl: float = DATA_VERSION_TTL): 
+        self.maxsize = maxsize
+        self.version_ttl = version_ttl
+        self._entries = OrderedDict()
+        self._version = None
+        self._version_checked = float("-inf")
+        self._lock = threading.Lock()
+    
+    def _check_version(self, conn: connection): 
+        if time.monotonic() - self._version_checked < self.version_ttl: 
+            return
+        try: 
+            version = pd.read_sql(con=conn, sql=SQL_DATA_VERSION).iloc[0, 0]
+        except Exception as e: 
+            logger.warning(f"Could not look up version of data, status cache is not invalidated: {e}")
+            conn.rollback()
+            version = self._version
+        with self._lock: 
+            if version != self._version: 
+                logger.debug(f"New data version '{version}', clearing status cache.")
+                self._entries.clear()
+                self._version = version
+            self._version_checked = time.monotonic()
+    
+    def get(self, conn: connection, key: tuple) -> typing.Optional[DataFrame]: 
+        self._check_version(conn)
+        with self._lock: 
+            if key not in self._entries: 
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+    
+    def put(self, key: tuple, value: DataFrame): 
+        with self._lock: 
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize: 
+                self._entries.popitem(last=False)
+    
+    def clear(self): 
+        with self._lock: 
+            self._entries.clear()
+
+
+STATUS_CACHE = StatusCache()
+
+
+def _format_cols(cols: typing.List[str], table_alias: str = None) -> str:
+    """Format list of columns for select statement"""
+    prefix = table_alias + "." if table_alias else ""
+    return ", ".join(prefix + col for col in cols)
+
+
+def get_station_list(conn: connection, cols: typing.List[str] = COLS_STATION_LIST) -> DataFrame:
+    """Get list of all charging stations for selection in the dashboard
+
+    Args:
+        conn (connection): database connection object
+        cols (typing.List[str], optional): columns to load. Defaults to COLS_STATION_LIST.
+
+    Returns:
+        DataFrame: charging stations ordered by id
+    """
+    return pd.read_sql(con=conn, sql=SQL_STATION_LIST.format(cols=_format_cols(cols)))
+
+
+def get_station(conn: connection, id_cs: int, cols: typing.List[str] = COLS_STATION) -> DataFrame:
+    """Get master data of a single charging station by its primary key
+
+    Args:
+        conn (connection): database connection object
+        id_cs (int): id of charging station
+        cols (typing.List[str], optional): columns to load. Defaults to COLS_STATION.
+
+    Returns:
+        DataFrame: master data of charging station
+    """
+    return pd.read_sql(con=conn, sql=SQL_STATION.format(cols=_format_cols(cols)), params={"id_cs": int(id_cs)})
+
+
+def get_charging_points(conn: connection, id_cs: int, cols: typing.List[str] = COLS_CHARGING_POINT) -> DataFrame:
+    """Get charging points of a charging station
+
+    Args:
+        conn (connection): database connection object
+        id_cs (int): id of charging station
+        cols (typing.List[str], optional): columns to load. Defaults to COLS_CHARGING_POINT.
+
+    Returns:
+        DataFrame: master data of charging points
+    """
+    return pd.read_sql(con=conn, sql=SQL_CHARGING_POINTS.format(cols=_format_cols(cols)), params={"id_cs": int(id_cs)})
+
+
+def get_connectors(conn: connection, id_cp: str, cols: typing.List[str] = COLS_CONNECTOR) -> DataFrame:
+    """Get connectors of a charging point
+
+    Args:
+        conn (connection): database connection object
+        id_cp (str): id of charging point
+        cols (typing.List[str], optional): columns to load. Defaults to COLS_CONNECTOR.
+
+    Returns:
+        DataFrame: master data of connectors
+    """
+    return pd.read_sql(con=conn, sql=SQL_CONNECTORS.format(cols=_format_cols(cols)), params={"id_cp": str(id_cp)})
+
+
+def get_pois_station(conn: connection, id_cs: int, cols: typing.List[str] = COLS_POI) -> GeoDataFrame:
+    """Get POIs spatially matched to a charging station
+
+    Args:
+        conn (connection): database connection object
+        id_cs (int): id of charging station
+        cols (typing.List[str], optional): columns to load, must contain geometry column 'geom'. Defaults to COLS_POI.
+
+    Returns:
+        GeoDataFrame: POIs matched to charging station
+    """
+    return gpd.read_postgis(con=conn,
+                            sql=SQL_POIS_STATION.format(cols=_format_cols(cols, table_alias="poi")),
+                            params={"id_cs": int(id_cs)})
+
+
+def get_pois_bbox(conn: connection,
+                  bbox: typing.Tuple[float, float, float, float],
+                  cols: typing.List[str] = COLS_POI) -> GeoDataFrame:
+    """Get POIs within the bounding box of the map viewport
+
+    Args:
+        conn (connection): database connection object
+        bbox (typing.Tuple[float, float, float, float]): bounding box (lon_min, lat_min, lon_max, lat_max) in EPSG:4326
+        cols (typing.List[str], optional): columns to load, must contain geometry column 'geom'. Defaults to COLS_POI.
+
+    Returns:
+        GeoDataFrame: POIs within bounding box
+    """
+    lon_min, lat_min, lon_max, lat_max = bbox
+    return gpd.read_postgis(con=conn,
+                            sql=SQL_POIS_BBOX.format(cols=_format_cols(cols)),
+                            params={"lon_min": lon_min, "lat_min": lat_min, "lon_max": lon_max, "lat_max": lat_max})
+
+
+def get_status_data(conn: connection, 
+                    id: str, 
+                    start: datetime.datetime = None, 
+                    end: datetime.datetime = None, 
+                    resolution: int = None, 
+                    query_cp: bool = True, 
+                    cache: StatusCache = STATUS_CACHE) -> DataFrame: 
+    """Get status history of a charging point or connector within a time window
+
+    Args:
+        conn (connection): database connection object
+        id (str): id of charging point or connector
+        start (datetime.datetime, optional): start of time window (inclusive). If not specified the whole history up to end is returned. Defaults to None.
+        end (datetime.datetime, optional): end of time window (exclusive). If not specified the history from start on is returned. Defaults to None.
+        resolution (int, optional): length of time buckets in seconds which statuses are counted in on the database server. If not specified every status record is returned. Defaults to None.
+        query_cp (bool, optional): whether to query status of charging points (True) or connectors (False). Defaults to True.
+        cache (StatusCache, optional): cache of status queries. If None, the database is always queried. Defaults to STATUS_CACHE.
+
+    Returns:
+        DataFrame: status history with columns query_time, status and n_samples (number of status records of status per time bucket), if aggregated also duration (seconds spent in status per time bucket)
+    """    
+    key = (str(id), query_cp, start, end, resolution)
+    if cache is not None: 
+        df_status = cache.get(conn, key)
+        if df_status is not None: 
+            return df_status
+    
+    table, col_id, col_status = STATUS_TABLES[query_cp]
+    params = {"id": str(id), 
+              "start": start if start is not None else MIN_TIMESTAMP, 
+              "end": end if end is not None else MAX_TIMESTAMP}
+    if resolution is None: 
+        sql = SQL_STATUS.format(table=table, col_id=col_id, col_status=col_status)
+    else: 
+        sql = SQL_STATUS_AGGREGATED.format(table=table, col_id=col_id, col_status=col_status)
+        params["resolution"] = int(resolution)
+        params["max_gap"] = MAX_GAP
+    
+    df_status = pd.read_sql(con=conn, sql=sql, params=params)
+    df_status["query_time"] = pd.to_datetime(df_status["query_time"], utc=True)
+    
+    if cache is not None: 
+        cache.put(key, df_status)
+    return df_status
+
+
+def get_station_utilization(conn: connection, 
+                            start: datetime.datetime = None, 
+                            end: datetime.datetime = None) -> DataFrame: 
+    """Get average occupancy within a time window and current occupancy of all charging stations from the utilization rollups
+
+    Args:
+        conn (connection): database connection object
+        start (datetime.datetime, optional): start of time window (inclusive). Defaults to None.
+        end (datetime.datetime, optional): end of time window (exclusive). Defaults to None.
+
+    Returns:
+        DataFrame: charging stations with location, city, occupancy_avg and occupancy_current (share of known statuses which are occupied)
+    """    
+    params = {"start": start if start is not None else MIN_TIMESTAMP, 
+              "end": end if end is not None else MAX_TIMESTAMP}
+    return pd.read_sql(con=conn, sql=SQL_STATION_UTILIZATION, params=params)
+
+
+def get_city_utilization(conn: connection, 
+                         start: datetime.datetime = None, 
+                         end: datetime.datetime = None, 
+                         resolution: int = RESOLUTION_ROLLUP, 
+                         cities: typing.List[str] = None) -> DataFrame: 
+    """Get occupancy time series of cities from the hourly utilization rollup
+
+    Args:
+        conn (connection): database connection object
+        start (datetime.datetime, optional): start of time window (inclusive). Defaults to None.
+        end (datetime.datetime, optional): end of time window (exclusive). Defaults to None.
+        resolution (int, optional): length of time buckets in seconds, multiple of an hour. Defaults to RESOLUTION_ROLLUP.
+        cities (typing.List[str], optional): cities to load. If not specified all cities are loaded. Defaults to None.
+
+    Raises:
+        ValueError: Raised if resolution is finer than the rollup
+
+    Returns:
+        DataFrame: occupancy with columns query_time, city and occupancy
+    """    
+    if resolution < RESOLUTION_ROLLUP: 
+        raise ValueError(f"Resolution must be at least {RESOLUTION_ROLLUP}s, but is {resolution}s.")
+    params = {"start": start if start is not None else MIN_TIMESTAMP, 
+              "end": end if end is not None else MAX_TIMESTAMP, 
+              "resolution": int(resolution)}
+    filter_cities = ""
+    if cities: 
+        filter_cities = "and city in %(cities)s"
+        params["cities"] = tuple(cities)
+    
+    df_city = pd.read_sql(con=conn, sql=SQL_CITY_UTILIZATION.format(filter_cities=filter_cities), params=params)
+    df_city["query_time"] = pd.to_datetime(df_city["query_time"], utc=True)
+    return df_city
+
+
+def _get_latest_status(endpoint: str, params: dict = None, base_url: str = LATEST_STATUS_URL):
+    response = requests.get(f"{base_url}/{endpoint}", params=params, timeout=LATEST_STATUS_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_nearest_available(latitude: float, 
+                          longitude: float, 
+                          k: int = 5, 
+                          base_url: str = LATEST_STATUS_URL) -> DataFrame: 
+    """Get nearest charging stations with an available charging point from the latest status API
+
+    Args:
+        latitude (float): latitude of location
+        longitude (float): longitude of location
+        k (int, optional): number of charging stations. Defaults to 5.
+        base_url (str, optional): URL of latest status API. Defaults to LATEST_STATUS_URL.
+
+    Raises:
+        requests.RequestException: Raised if the latest status API is not reachable
+
+    Returns:
+        DataFrame: charging stations with columns id_cs, name, city, latitude, longitude, n_cps, n_available and distance_m
+    """    
+    stations = _get_latest_status("nearest", params={"lat": latitude, "lon": longitude, "k": k}, base_url=base_url)
+    return DataFrame(stations, columns=["id_cs", "name", "city", "latitude", "longitude", "n_cps", "n_available", "distance_m"])
+
+
+def get_latest_status_station(id_cs: int, base_url: str = LATEST_STATUS_URL) -> DataFrame: 
+    """Get latest status of the charging points of a charging station from the latest status API
+
+    Args:
+        id_cs (int): id of charging station
+        base_url (str, optional): URL of latest status API. Defaults to LATEST_STATUS_URL.
+
+    Raises:
+        requests.RequestException: Raised if the latest status API is not reachable or the station is unknown
+
+    Returns:
+        DataFrame: charging points with columns id, status and timestamp
+    """    
+    station = _get_latest_status(f"stations/{id_cs}", base_url=base_url)
+    return DataFrame(station["charging_points"], columns=["id", "status", "timestamp"])
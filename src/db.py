@@ -0,0 +1,193 @@
+import psycopg2
+from psycopg2.extensions import connection, cursor
+import configparser
+import contextlib
+import logging
+import os
+import queue
+import threading
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MAXCONN = 5
+DEFAULT_TIMEOUT = 30
+DEFAULT_CONNECT_TIMEOUT = 10
+# idle connections are checked with a round trip before reuse if they were idle for longer
+HEALTH_CHECK_INTERVAL = 30
+SLOW_QUERY_SECONDS = 1.0
+# connection string overriding the config file, e.g. to run against a local PostgreSQL instance
+ENV_DSN = "CHARGINGDATA_DSN"
+
+
+class PoolTimeout(Exception):
+    """Raised if no connection becomes available within the timeout of the pool"""
+
+
+class TimedCursor(cursor):
+    """Cursor logging the duration and row count of every executed query"""
+
+    def execute(self, query, vars=None):
+        t_start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            duration = time.perf_counter() - t_start
+            log = logger.info if duration >= SLOW_QUERY_SECONDS else logger.debug
+            log(f"Query took {duration:.3f}s, {self.rowcount} rows: {' '.join(str(query).split())[:200]}")
+
+
+def dsn_from_config(config_file: str, section: str = "CLUSTER") -> str:
+    """Build connection string from config file. The environment variable CHARGINGDATA_DSN takes precedence if set.
+
+    Args:
+        config_file (str): path of config file containing host, database name, user, password and port in this order
+        section (str, optional): section of config file. Defaults to "CLUSTER".
+
+    Returns:
+        str: connection string
+    """
+    if os.environ.get(ENV_DSN):
+        return os.environ[ENV_DSN]
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    return "host={} dbname={} user={} password={} port={}".format(*config[section].values())
+
+
+class ConnectionPool:
+    """Thread-safe pool of at most `maxconn` database connections. Idle connections are checked for liveness before
+    they are handed out and broken connections are replaced by new ones.
+
+    Args:
+        dsn (str): connection string, e.g. 'host=localhost dbname=test user=postgres password= port=5432'
+        minconn (int, optional): number of connections opened on creation. Defaults to 1.
+        maxconn (int, optional): maximum number of open connections. Defaults to DEFAULT_MAXCONN.
+        timeout (float, optional): seconds to wait for a free connection before raising PoolTimeout. Defaults to DEFAULT_TIMEOUT.
+        health_check_interval (float, optional): idle seconds after which a connection is checked before reuse. Defaults to HEALTH_CHECK_INTERVAL.
+        connect_kwargs (dict, optional): additional keyword arguments of `psycopg2.connect`. Defaults to None.
+    """
+
+    def __init__(self,
+                 dsn: str,
+                 minconn: int = 1,
+                 maxconn: int = DEFAULT_MAXCONN,
+                 timeout: float = DEFAULT_TIMEOUT,
+                 health_check_interval: float = HEALTH_CHECK_INTERVAL,
+                 connect_kwargs: dict = None):
+        if not 0 <= minconn <= maxconn:
+            raise ValueError(f"Pool size must satisfy 0 <= minconn <= maxconn, but is minconn={minconn}, maxconn={maxconn}.")
+        self.dsn = dsn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connect_kwargs = {"connect_timeout": DEFAULT_CONNECT_TIMEOUT, "cursor_factory": TimedCursor,
+                               **(connect_kwargs or {})}
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = queue.LifoQueue()
+        self._closed = False
+
+        for _ in range(minconn):
+            self._idle.put((self._connect(), time.monotonic()))
+
+    def _connect(self) -> connection:
+        logger.debug("Opening new database connection.")
+        return psycopg2.connect(self.dsn, **self.connect_kwargs)
+
+    @staticmethod
+    def _is_alive(conn: connection) -> bool:
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("select 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _discard(conn: connection):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _acquire(self) -> connection:
+        while True:
+            try:
+                conn, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if conn.closed:
+                continue
+            if time.monotonic() - idle_since < self.health_check_interval or self._is_alive(conn):
+                return conn
+            logger.warning("Discarding broken database connection.")
+            self._discard(conn)
+
+    @contextlib.contextmanager
+    def connection(self) -> typing.Iterator[connection]:
+        """Borrow a connection from the pool. Uncommitted transactions are rolled back when the connection is
+        returned, connections broken during use are discarded.
+
+        Raises:
+            PoolTimeout: Raised if no connection becomes available within the timeout of the pool
+
+        Yields:
+            typing.Iterator[connection]: database connection
+        """
+        if self._closed:
+            raise RuntimeError("Connection pool is closed.")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No database connection available within {self.timeout}s (maxconn={self.maxconn}).")
+        conn = None
+        try:
+            conn = self._acquire()
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            if conn is not None:
+                self._discard(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                if conn.closed or self._closed:
+                    self._discard(conn)
+                else:
+                    try:
+                        conn.rollback()
+                        self._idle.put((conn, time.monotonic()))
+                    except psycopg2.Error:
+                        self._discard(conn)
+            self._slots.release()
+
+    def run(self, func: typing.Callable[[connection], typing.Any], retries: int = 1) -> typing.Any:
+        """Run a function with a pooled connection and retry it on a new connection if the connection fails
+
+        Args:
+            func (typing.Callable[[connection], typing.Any]): function taking a connection as only argument
+            retries (int, optional): number of retries on connection failures. Defaults to 1.
+
+        Returns:
+            typing.Any: return value of function
+        """
+        for attempt in range(retries + 1):
+            try:
+                with self.connection() as conn:
+                    return func(conn)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if attempt == retries:
+                    raise
+                logger.warning(f"Database connection failed, reconnecting: {e}")
+
+    def close(self):
+        """Close all idle connections. Borrowed connections are closed when they are returned."""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
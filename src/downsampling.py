@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+import logging
+import typing
+
+logger = logging.getLogger(__name__)
+
+
+# interval of API calls in seconds, duration of a single status record
+POLLING_INTERVAL = 600
+# statuses are not carried over gaps in the data longer than this
+MAX_GAP = 3 * POLLING_INTERVAL
+# default number of points sent to the browser per chart, well below Altair's row limit of 5000
+MAX_POINTS = 2000
+# candidate resolutions in seconds ordered from fine to coarse, None for every status record
+RESOLUTIONS = [None, 3600, 6 * 3600, 86400]
+
+MODE_CHANGES = "changes"
+MODE_LTTB = "lttb"
+
+
+def auto_resolution(window_seconds: typing.Optional[float],
+                    max_points: int = MAX_POINTS,
+                    polling_interval: int = POLLING_INTERVAL) -> typing.Optional[int]:
+    """Select finest resolution whose number of time buckets in a time window does not exceed max_points
+
+    Args:
+        window_seconds (typing.Optional[float]): length of time window in seconds. If None (whole history) the coarsest resolution is returned.
+        max_points (int, optional): maximum number of time buckets. Defaults to MAX_POINTS.
+        polling_interval (int, optional): interval of status records in seconds. Defaults to POLLING_INTERVAL.
+
+    Returns:
+        typing.Optional[int]: resolution in seconds or None if every status record fits
+    """
+    if window_seconds is None:
+        return RESOLUTIONS[-1]
+    for resolution in RESOLUTIONS:
+        if window_seconds / (resolution or polling_interval) <= max_points:
+            return resolution
+    return RESOLUTIONS[-1]
+
+
+def status_change_points(df_status: DataFrame, col_time: str = "query_time", col_status: str = "status") -> DataFrame:
+    """Reduce status history to records where the status changes, plus first and last record
+
+    Args:
+        df_status (DataFrame): status history ordered by time
+        col_time (str, optional): name of time column. Defaults to "query_time".
+        col_status (str, optional): name of status column. Defaults to "status".
+
+    Returns:
+        DataFrame: records of status changes
+    """
+    if df_status.shape[0] <= 2:
+        return df_status
+    status = df_status[col_status].to_numpy()
+    mask = np.empty(status.shape[0], dtype=bool)
+    mask[0] = True
+    mask[1:] = status[1:] != status[:-1]
+    mask[-1] = True
+    return df_status[mask]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets downsampling
+
+    Args:
+        x (np.ndarray): monotonically increasing x values
+        y (np.ndarray): y values, NaN is treated as 0
+        n_out (int): number of points to keep, at least 3
+
+    Returns:
+        np.ndarray: indices of kept points
+    """
+    n = x.shape[0]
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = x.astype(np.float64)
+    y = np.nan_to_num(y.astype(np.float64))
+
+    # first and last point are kept, remaining points are split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx_out = np.empty(n_out, dtype=np.int64)
+    idx_out[0], idx_out[-1] = 0, n - 1
+
+    idx_prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # average of next bucket is the third point of the triangle
+        if i + 2 < n_out - 1:
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        x_avg, y_avg = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+
+        area = np.abs((x[idx_prev] - x_avg) * (y[start:end] - y[idx_prev])
+                      - (x[idx_prev] - x[start:end]) * (y_avg - y[idx_prev]))
+        idx_prev = start + int(np.argmax(area))
+        idx_out[i + 1] = idx_prev
+    return idx_out
+
+
+def downsample_status(df_status: DataFrame,
+                      mode: str = MODE_CHANGES,
+                      max_points: int = MAX_POINTS,
+                      col_time: str = "query_time",
+                      col_status: str = "status",
+                      col_value: str = "status_num") -> DataFrame:
+    """Downsample status history for plotting
+
+    Args:
+        df_status (DataFrame): status history ordered by time
+        mode (str, optional): 'changes' to keep status changes only or 'lttb' for Largest-Triangle-Three-Buckets on col_value. If more than max_points status changes remain, LTTB is applied on top. Defaults to MODE_CHANGES.
+        max_points (int, optional): maximum number of returned records. Defaults to MAX_POINTS.
+        col_time (str, optional): name of time column. Defaults to "query_time".
+        col_status (str, optional): name of status column. Defaults to "status".
+        col_value (str, optional): name of numerical status column used by LTTB. Defaults to "status_num".
+
+    Raises:
+        ValueError: Raised if mode is unknown
+
+    Returns:
+        DataFrame: downsampled status history
+    """
+    if mode not in (MODE_CHANGES, MODE_LTTB):
+        raise ValueError(f"Unknown downsampling mode '{mode}', use '{MODE_CHANGES}' or '{MODE_LTTB}'.")
+    n_in = df_status.shape[0]
+    if mode == MODE_CHANGES:
+        df_status = status_change_points(df_status, col_time=col_time, col_status=col_status)
+    if df_status.shape[0] > max_points:
+        x = df_status[col_time].to_numpy().astype("datetime64[ns]").astype(np.int64)
+        idx = lttb(x, df_status[col_value].to_numpy(), max_points)
+        df_status = df_status.iloc[idx]
+    logger.debug(f"Downsampled status history from {n_in} to {df_status.shape[0]} records.")
+    return df_status
+
+
+def status_durations(df_status: DataFrame,
+                     resolution: int = None,
+                     end: pd.Timestamp = None,
+                     max_gap: float = MAX_GAP,
+                     polling_interval: int = POLLING_INTERVAL,
+                     col_time: str = "query_time",
+                     col_status: str = "status") -> pd.Series:
+    """Compute time spent in each status
+
+    For every status record the status is assumed to last until the next record, at most max_gap seconds.
+    Status history aggregated in time buckets contains these durations summed per bucket on the database server.
+
+    Args:
+        df_status (DataFrame): status history ordered by time, if aggregated with column duration
+        resolution (int, optional): resolution of aggregated status history in seconds. None if df_status contains every status record. Defaults to None.
+        end (pd.Timestamp, optional): end of time window the last status lasts until. If not specified the last status lasts one polling interval. Defaults to None.
+        max_gap (float, optional): maximum duration of a single status record in seconds. Defaults to MAX_GAP.
+        polling_interval (int, optional): interval of status records in seconds. Defaults to POLLING_INTERVAL.
+        col_time (str, optional): name of time column. Defaults to "query_time".
+        col_status (str, optional): name of status column. Defaults to "status".
+
+    Returns:
+        pd.Series: duration in seconds per status
+    """
+    if df_status.shape[0] == 0:
+        return pd.Series(dtype=np.float64, name="duration")
+    if resolution is not None:
+        durations = df_status["duration"].to_numpy(dtype=np.float64)
+    else:
+        ts = df_status[col_time].to_numpy().astype("datetime64[ns]").astype(np.int64) / 1e9
+        ts_next = np.empty_like(ts)
+        ts_next[:-1] = ts[1:]
+        ts_next[-1] = end.timestamp() if end is not None else ts[-1] + polling_interval
+        durations = np.clip(ts_next - ts, 0, max_gap)
+    return pd.Series(durations, index=df_status[col_status].to_numpy(), name="duration").groupby(level=0).sum()
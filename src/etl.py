@@ -1,22 +1,32 @@
 import pandas as pd
 import logging 
 import configparser
-import psycopg2
+import datetime
 from psycopg2.extensions import cursor, connection
 import typing
 
 import logging.config
-from settings import LOGGING_CONFIG
+from settings import LOGGING_CONFIG, METRICS_FILENAME, CONFIG_FILE
+import metrics
+from db import ConnectionPool, dsn_from_config
 
 from sql import (DataTestCase,
                  DataIngester,
                  data_ingestions_main, 
                  data_ingestions_staging,
-                 SQL_CONSTRAINTS)
+                 SQL_CONSTRAINTS, 
+                 SWAP_TABLE, 
+                 CREATE_TABLE_ETL_CHECKPOINT, 
+                 INSERT_ETL_CHECKPOINT, 
+                 SELECT_LAST_RUN_CHECKPOINTS, 
+                 CHECKPOINT_RUN_COMPLETED)
 
 
 logger = logging.getLogger(__name__)
-CONFIG_FILE = "../config.cfg"
+
+
+FMT_RUN_ID = "%Y%m%d%H%M%S"
+SUFFIX_SHADOW_TABLE = "_shadow_"
 
 
 def _execute_query(query_template: str, 
@@ -30,6 +40,9 @@ def _execute_query(query_template: str,
         mapping_fmt_query (typing.List[DataTestCase]): mapping containing values for SQL query template placeholders.
         cur (cursor): Redshift cursor object
         conn (connection, optional): Redshift connection object. If not specified transaction is not committed. Defaults to None.
+
+    Returns:
+        int: number of rows affected by the query, -1 if not applicable
     """       
     query = query_template.format(**mapping_fmt_query)
     logger.debug(f" Executing query '{query:}'")
@@ -37,6 +50,7 @@ def _execute_query(query_template: str,
     
     if conn: 
         conn.commit()
+    return cur.rowcount
 
 
 def _run_data_unit_test(data_test_cases: typing.List[DataTestCase], 
@@ -80,56 +94,168 @@ def _run_data_unit_test(data_test_cases: typing.List[DataTestCase],
     logger.info(f"All data quality checks passed for table '{table_name}'.")
 
 
-def ingest_data(data_obj: DataIngester, cur: cursor, conn: connection, mapping_fmt_queries: typing.Dict[str, str]): 
+def _swap_in_table(data_obj: DataIngester, 
+                   cur: cursor, 
+                   conn: connection, 
+                   mapping_fmt_queries: typing.Dict[str, str], 
+                   shadow_table_name: str): 
+    """Build table into shadow table, run data unit tests on shadow table and replace table by shadow table. 
+    Readers keep seeing the previous table until the transaction is committed.
+
+    Args:
+        data_obj (DataIngester): data object specifying ingestion process, templates of table use placeholder 'TABLE_NAME'
+        cur (cursor): Redshift cursor object
+        conn (connection): Redshift connection object
+        mapping_fmt_queries (typing.Dict[str, str]): mapping containing values for SQL query template placeholders.
+        shadow_table_name (str): name of shadow table
+    """    
+    mapping_fmt_shadow = {**mapping_fmt_queries, "TABLE_NAME": shadow_table_name}
+    
+    logger.info(f"Creating shadow table '{shadow_table_name}' of table '{data_obj.table_name}'.") 
+    with metrics.timer("etl_query", table=data_obj.table_name, step="create_table"): 
+        _execute_query(data_obj.create_table, cur=cur, mapping_fmt_query=mapping_fmt_shadow)
+    
+    logger.info(f"Populating shadow table '{shadow_table_name}' with records.") 
+    with metrics.timer("etl_query", table=data_obj.table_name, step="populate_table") as t: 
+        t.rows = _execute_query(data_obj.populate_table, cur=cur, mapping_fmt_query=mapping_fmt_shadow)
+    
+    if data_obj.data_test_cases: 
+        with metrics.timer("etl_query", table=data_obj.table_name, step="data_test_cases"): 
+            _run_data_unit_test(data_obj.data_test_cases, 
+                                conn=conn,
+                                table_name=shadow_table_name, 
+                                mapping_fmt_query=mapping_fmt_queries)
+    
+    logger.info(f"Replacing table '{data_obj.table_name}' by shadow table '{shadow_table_name}'.") 
+    with metrics.timer("etl_query", table=data_obj.table_name, step="swap_table"): 
+        _execute_query(data_obj.drop_table, cur=cur, mapping_fmt_query=mapping_fmt_queries)
+        _execute_query(SWAP_TABLE, 
+                       cur=cur, 
+                       mapping_fmt_query={**mapping_fmt_queries, 
+                                          "SHADOW_TABLE_NAME": shadow_table_name, 
+                                          "TABLE_NAME": data_obj.table_name})
+
+
+def ingest_data(data_obj: DataIngester, 
+                cur: cursor, 
+                conn: connection, 
+                mapping_fmt_queries: typing.Dict[str, str], 
+                run_id: str = None): 
     """Ingest data model into redshift by dropping table and constraints, creating table, populating table with data and running data unit tests.  
+    Tables with `swap` are built into a shadow table instead, which replaces the table after its data unit tests passed. 
+    
+    All steps run in one transaction, which is committed together with the checkpoint of the table and rolled back 
+    if any step fails. A failing table therefore never leaves an empty or partially loaded table behind.
 
     Args:
         data_obj (DataIngester): data object specifying ingestion process
         cur (cursor): Redshift cursor object
         conn (connection): Redshift connection object
         mapping_fmt_query (typing.Dict[str, str]): mapping containing values for SQL query template placeholders.
+        run_id (str, optional): run to record checkpoint of table for. If not specified no checkpoint is recorded. Defaults to None.
     """      
-    # dropping table 
-    if data_obj.drop_table: 
-        logger.info(f"Dropping table '{data_obj.table_name}'.") 
-        _execute_query(data_obj.drop_table, cur=cur, mapping_fmt_query=mapping_fmt_queries)
-    # dropping constraints 
-    if data_obj.drop_constraints: 
-        schema = mapping_fmt_queries["SCHEMA"]
-        existing_constraints = (pd.read_sql(con=conn, sql=SQL_CONSTRAINTS)
-                                .query(f"constraint_schema=='{schema}'")
-                                ["constraint_name"]
-                                )
-        constraint_name = data_obj.drop_constraints.split("CONSTRAINT")[1].strip()
+    mapping_fmt_queries = {**mapping_fmt_queries, "TABLE_NAME": data_obj.table_name}
+    try: 
+        if data_obj.swap: 
+            shadow_table_name = f"{data_obj.table_name}{SUFFIX_SHADOW_TABLE}{run_id or datetime.datetime.utcnow().strftime(FMT_RUN_ID)}"
+            _swap_in_table(data_obj, 
+                           cur=cur, 
+                           conn=conn, 
+                           mapping_fmt_queries=mapping_fmt_queries, 
+                           shadow_table_name=shadow_table_name)
+        else: 
+            # dropping table 
+            if data_obj.drop_table: 
+                logger.info(f"Dropping table '{data_obj.table_name}'.") 
+                with metrics.timer("etl_query", table=data_obj.table_name, step="drop_table"): 
+                    _execute_query(data_obj.drop_table, cur=cur, mapping_fmt_query=mapping_fmt_queries)
+            # dropping constraints 
+            if data_obj.drop_constraints: 
+                schema = mapping_fmt_queries["SCHEMA"]
+                existing_constraints = (pd.read_sql(con=conn, sql=SQL_CONSTRAINTS)
+                                        .query(f"constraint_schema=='{schema}'")
+                                        ["constraint_name"]
+                                        )
+                constraint_name = data_obj.drop_constraints.split("CONSTRAINT")[1].strip()
+                
+                if constraint_name in set(existing_constraints): 
+                    logger.info(f"Dropping constraints in table '{data_obj.table_name}'.") 
+                    with metrics.timer("etl_query", table=data_obj.table_name, step="drop_constraints"): 
+                        _execute_query(data_obj.drop_constraints, cur=cur, mapping_fmt_query=mapping_fmt_queries)
+
+            # creating table 
+            if data_obj.create_table:
+                logger.info(f"Creating table '{data_obj.table_name}'.") 
+                with metrics.timer("etl_query", table=data_obj.table_name, step="create_table"): 
+                    _execute_query(data_obj.create_table, cur=cur, mapping_fmt_query=mapping_fmt_queries)
+
+            # populating table 
+            if data_obj.populate_table: 
+                logger.info(f"Populating table '{data_obj.table_name}' with records.") 
+                with metrics.timer("etl_query", table=data_obj.table_name, step="populate_table") as t: 
+                    t.rows = _execute_query(data_obj.populate_table, cur=cur, mapping_fmt_query=mapping_fmt_queries)
+            
+            # data quality checks, uncommitted records of the transaction are visible to them
+            if data_obj.data_test_cases: 
+                with metrics.timer("etl_query", table=data_obj.table_name, step="data_test_cases"): 
+                    _run_data_unit_test(data_obj.data_test_cases, 
+                                        conn=conn,
+                                        table_name=data_obj.table_name, 
+                                        mapping_fmt_query=mapping_fmt_queries)
         
-        if constraint_name in set(existing_constraints): 
-            logger.info(f"Dropping constraints in table '{data_obj.table_name}'.") 
-            _execute_query(data_obj.drop_constraints, cur=cur, conn=conn, mapping_fmt_query=mapping_fmt_queries)
+        if run_id is not None: 
+            _execute_query(INSERT_ETL_CHECKPOINT, cur=cur, mapping_fmt_query={**mapping_fmt_queries, "RUN_ID": run_id})
+        conn.commit()
+    except Exception: 
+        logger.error(f"Ingesting data into table '{data_obj.table_name}' failed, rolling back.")
+        conn.rollback()
+        raise
+    
 
-    # creating table 
-    if data_obj.create_table:
-        logger.info(f"Creating table '{data_obj.table_name}'.") 
-        _execute_query(data_obj.create_table, cur=cur, conn=conn, mapping_fmt_query=mapping_fmt_queries)
+def _start_run(cur: cursor, 
+               conn: connection, 
+               mapping_fmt_queries: typing.Dict[str, str], 
+               resume: bool = False) -> typing.Tuple[str, typing.Set[str]]: 
+    """Start new ETL run or resume last run if it did not complete
 
-    # populating table 
-    if data_obj.populate_table: 
-        logger.info(f"Populating table '{data_obj.table_name}' with records.") 
-        _execute_query(data_obj.populate_table, cur=cur, conn=conn, mapping_fmt_query=mapping_fmt_queries)
+    A resumed run skips the staging tables it already loaded, so the staging data of the failed run is reused instead 
+    of the data preprocessed since. Runs are therefore only resumed on request.
 
-    conn.commit()
+    Args:
+        cur (cursor): Redshift cursor object
+        conn (connection): Redshift connection object
+        mapping_fmt_queries (typing.Dict[str, str]): mapping containing values for SQL query template placeholders.
+        resume (bool, optional): whether to resume the last run if it did not complete. Defaults to False.
+
+    Returns:
+        typing.Tuple[str, typing.Set[str]]: id of run, tables already loaded by run
+    """    
+    _execute_query(CREATE_TABLE_ETL_CHECKPOINT, cur=cur, conn=conn, mapping_fmt_query=mapping_fmt_queries)
     
-    # data quality checks
-    if data_obj.data_test_cases: 
-        _run_data_unit_test(data_obj.data_test_cases, 
-                            conn=conn,
-                            table_name=data_obj.table_name, 
-                            mapping_fmt_query=mapping_fmt_queries)
+    if resume: 
+        checkpoints = pd.read_sql(con=conn, sql=SELECT_LAST_RUN_CHECKPOINTS.format(**mapping_fmt_queries))
+        conn.commit()
+        completed = set(checkpoints["table_name"])
+        if completed and CHECKPOINT_RUN_COMPLETED not in completed: 
+            run_id = checkpoints["run_id"].iloc[0]
+            completed_at = pd.to_datetime(checkpoints["completed_at"], utc=True)
+            age = pd.Timestamp.now(tz="UTC") - completed_at.min()
+            logger.info(f"Resuming run '{run_id}', skipping {len(completed)} tables already loaded.")
+            logger.warning(f"Reusing tables loaded by run '{run_id}' {age.total_seconds() / 3600:.1f} hours ago, "
+                           f"data preprocessed since is not loaded into the staging tables.")
+            return run_id, completed
     
+    run_id = datetime.datetime.utcnow().strftime(FMT_RUN_ID)
+    logger.info(f"Starting run '{run_id}'.")
+    return run_id, set()
+
 
 def _create_data_model(cur: cursor,
                        conn: connection,
                        data_objs: typing.List[DataIngester], 
-                       mapping_fmt_queries: typing.Dict[str, str]): 
+                       mapping_fmt_queries: typing.Dict[str, str], 
+                       run_id: str = None, 
+                       completed: typing.Set[str] = None): 
     """Create Redshift data model, populating tables with records and running data quality checks
 
     Args:
@@ -137,22 +263,37 @@ def _create_data_model(cur: cursor,
         conn (connection): Redshift connection objects
         data_objs (typing.List[DataIngester]): sequence of data object specifying ingestion process
         mapping_fmt_query (typing.Dict[str, str]): mapping containing values for SQL query template placeholders.
+        run_id (str, optional): run to record checkpoints of tables for. Defaults to None.
+        completed (typing.Set[str], optional): tables already loaded by run, which are skipped. Defaults to None.
     """    
+    completed = completed or set()
     for dobj in data_objs: 
+        if dobj.table_name in completed: 
+            logger.info(f"Skipping table '{dobj.table_name}' already loaded by run '{run_id}'.")
+            continue
         logger.info(f"Ingesting data into table '{dobj.table_name}'")
-        ingest_data(dobj, cur=cur, conn=conn, mapping_fmt_queries=mapping_fmt_queries)
+        ingest_data(dobj, cur=cur, conn=conn, mapping_fmt_queries=mapping_fmt_queries, run_id=run_id)
 
 
 def main(config_file: str, 
-         data_ingestions: typing.List[typing.List[DataIngester]] = [data_ingestions_staging, data_ingestions_main]):
+         data_ingestions: typing.List[typing.List[DataIngester]] = [data_ingestions_staging, data_ingestions_main], 
+         resume: bool = False):
+    """Ingest data into Redshift. Every table is loaded in its own transaction and checkpointed in table 
+    'etl_checkpoint', a failed run can be resumed at the table that failed.
+
+    Args:
+        config_file (str): config file
+        data_ingestions (typing.List[typing.List[DataIngester]], optional): sequences of tables to load. Defaults to [data_ingestions_staging, data_ingestions_main].
+        resume (bool, optional): whether to resume the last run if it did not complete, otherwise all tables are loaded. Defaults to False.
+    """    
     logging.config.dictConfig(LOGGING_CONFIG)
 
     config = configparser.ConfigParser()
     config.read(config_file)
 
     logger.info("Connecting to redshift database...")
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
-    cur = conn.cursor()
+    # the load runs sequentially in one transaction context, a single connection is sufficient
+    pool = ConnectionPool(dsn_from_config(config_file), minconn=1, maxconn=1)
     logger.info("Successfully connected to redshift database...")
 
 
@@ -165,22 +306,45 @@ def main(config_file: str,
                            "MASTER_DATA_CONNECTORS":  config["S3"]["MASTER_DATA_CONNECTORS"], 
                            "MASTER_DATA_CONNECTORS":  config["S3"]["MASTER_DATA_CONNECTORS"], 
                            "MAPPING_POI_CS": config["S3"]["MAPPING_POI_CS"], 
+                           "SNAPSHOTS": config["S3"]["SNAPSHOTS"], 
+                           "IDS_CHARGING_POINTS": config["S3"]["IDS_CHARGING_POINTS"], 
+                           "IDS_CONNECTORS": config["S3"]["IDS_CONNECTORS"], 
+                           "CHARGING_SESSIONS": config["S3"]["CHARGING_SESSIONS"], 
+                           "TIME_DATA": config["S3"]["TIME_DATA"], 
                            "SHAPEFILE_POI_POINTS": config["S3"]["SHAPEFILE_POI_POINTS"], 
                            "SHAPEFILE_POI_POLYGONS": config["S3"]["SHAPEFILE_POI_POLYGONS"], 
                            "SHAPEFILE_POI_MULTIPOLYGONS": config["S3"]["SHAPEFILE_POI_MULTIPOLYGONS"]
                            }
     
-    logger.info("Create schema if it does not exist")
-    query_create_schema = 'CREATE SCHEMA IF NOT EXISTS {SCHEMA}'
-    _execute_query(query_create_schema, cur=cur, conn=conn, mapping_fmt_query=mapping_fmt_queries)
+    try: 
+        with pool.connection() as conn: 
+            cur = conn.cursor()
+            logger.info("Create schema if it does not exist")
+            query_create_schema = 'CREATE SCHEMA IF NOT EXISTS {SCHEMA}'
+            _execute_query(query_create_schema, cur=cur, conn=conn, mapping_fmt_query=mapping_fmt_queries)
 
-    logger.info(f"Ingesting data into tables.")
-    for di in data_ingestions:
-        _create_data_model(cur=cur, conn=conn, data_objs=di, mapping_fmt_queries=mapping_fmt_queries)
-    
-    conn.close()
+            run_id, completed = _start_run(cur=cur, conn=conn, mapping_fmt_queries=mapping_fmt_queries, resume=resume)
+
+            logger.info(f"Ingesting data into tables.")
+            for di in data_ingestions:
+                _create_data_model(cur=cur, 
+                                   conn=conn, 
+                                   data_objs=di, 
+                                   mapping_fmt_queries=mapping_fmt_queries, 
+                                   run_id=run_id, 
+                                   completed=completed)
+            
+            _execute_query(INSERT_ETL_CHECKPOINT, 
+                           cur=cur, 
+                           conn=conn, 
+                           mapping_fmt_query={**mapping_fmt_queries, "RUN_ID": run_id, "TABLE_NAME": CHECKPOINT_RUN_COMPLETED})
+            logger.info(f"Run '{run_id}' completed.")
+    finally: 
+        pool.close()
+    metrics.METRICS.log_summary()
     
 
 if __name__ == '__main__': 
     logging.config.dictConfig(LOGGING_CONFIG)
+    metrics.configure(METRICS_FILENAME)
     main(config_file=CONFIG_FILE)
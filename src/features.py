@@ -0,0 +1,398 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+import logging
+import typing
+import glob
+import json
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from settings import DIR_DATA, DIR_SAVE_OSM, DIR_FEATURES
+from downsampling import POLLING_INTERVAL, MAX_GAP
+from sessions import SESSION_STATUSES, UNKNOWN_STATUSES
+from resampling import resample_status
+from status_tables import read_status_table, read_status_time_range, ENTITY_CP
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# hour of day and day of week of availability depend on local time
+TIMEZONE = "Europe/Berlin"
+HOURS_PER_WEEK = 7 * 24
+
+# rolling occupancy over the preceding hours, including the current hour
+ROLLING_WINDOWS = {"occupancy_24h": 24, "occupancy_7d": HOURS_PER_WEEK}
+
+DIR_HOURLY = "hourly"
+FNAME_PROFILE = "profile_hour_of_week.parquet"
+FNAME_POI = "poi_features.parquet"
+FNAME_PART = "part-0.parquet"
+
+COLS_HOURLY = ["id", "hour", "hour_of_week", "n_known", "n_occupied", "occupancy"] + list(ROLLING_WINDOWS)
+COLS_PROFILE = ["id", "hour_of_week", "n_known", "n_occupied", "occupancy"]
+# key of the dates counted in the profile in the metadata of its parquet file
+KEY_PROFILE_DATES = b"profile_dates"
+
+
+def _occupancy(n_occupied: np.ndarray, n_known: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n_known > 0, n_occupied / n_known, np.nan)
+
+
+def _to_local_day(timestamp: typing.Union[str, pd.Timestamp], timezone: str = TIMEZONE) -> pd.Timestamp:
+    """Local midnight of a timestamp, naive timestamps are interpreted as local time"""
+    timestamp = pd.Timestamp(timestamp)
+    timestamp = timestamp.tz_localize(timezone) if timestamp.tzinfo is None else timestamp.tz_convert(timezone)
+    return timestamp.normalize()
+
+
+def hour_of_week(hours: pd.DatetimeIndex, timezone: str = TIMEZONE) -> np.ndarray:
+    """Hour of week in local time, 0 for Monday 0-1h to 167 for Sunday 23-24h"""
+    hours_local = hours.tz_convert(timezone)
+    return (hours_local.dayofweek * 24 + hours_local.hour).to_numpy(dtype=np.int16)
+
+
+def aggregate_hourly(df_status: DataFrame,
+                     start: pd.Timestamp,
+                     end: pd.Timestamp,
+                     freq: int = POLLING_INTERVAL,
+                     max_gap: float = MAX_GAP,
+                     statuses: typing.List[str] = SESSION_STATUSES,
+                     unknown_statuses: typing.List[str] = UNKNOWN_STATUSES) -> DataFrame:
+    """Count known and occupied status buckets per id and hour
+
+    The status records are resampled onto a grid of freq seconds, so every hour has the same weight regardless of
+    the polling frequency. Records up to max_gap before start forward-fill the first buckets.
+
+    Args:
+        df_status (DataFrame): status records with columns id, status and timestamp, e.g. status_cps.csv
+        start (pd.Timestamp): first hour (tz-aware, full hour)
+        end (pd.Timestamp): end of last hour, exclusive (tz-aware, full hour)
+        freq (int, optional): length of status buckets in seconds, must divide an hour. Defaults to POLLING_INTERVAL.
+        max_gap (float, optional): maximum time in seconds a status is carried forward. Defaults to MAX_GAP.
+        statuses (typing.List[str], optional): occupied statuses. Defaults to SESSION_STATUSES.
+        unknown_statuses (typing.List[str], optional): statuses counted like missing buckets. Defaults to UNKNOWN_STATUSES.
+
+    Raises:
+        ValueError: Raised if freq does not divide an hour
+
+    Returns:
+        DataFrame: columns id, hour (UTC), n_known and n_occupied for every hour with a known bucket
+    """
+    if 3600 % freq != 0:
+        raise ValueError(f"Length of status buckets must divide an hour, got {freq} seconds.")
+    buckets_per_hour = 3600 // freq
+    # the grid starts early enough for the last status before start to be forward-filled
+    n_pad = int(-(-max_gap // 3600))
+    grid_start = start - pd.Timedelta(hours=n_pad)
+    grid = resample_status(df_status, freq=freq, start=grid_start, end=end, max_gap=max_gap)
+    n_hours = grid.codes.shape[1] // buckets_per_hour - n_pad
+    shape = (len(grid.ids), n_hours + n_pad, buckets_per_hour)
+
+    known = grid.known(unknown_statuses).reshape(shape)[:, n_pad:].sum(axis=2, dtype=np.int16)
+    occupied = grid.mask(statuses).reshape(shape)[:, n_pad:].sum(axis=2, dtype=np.int16)
+    idx_id, idx_hour = np.nonzero(known)
+    hours = pd.date_range(start.tz_convert("UTC"), periods=n_hours, freq="H")
+    return DataFrame({"id": grid.ids.to_numpy()[idx_id],
+                      "hour": hours[idx_hour],
+                      "n_known": known[idx_id, idx_hour],
+                      "n_occupied": occupied[idx_id, idx_hour]})
+
+
+def _rolling_sum(values: np.ndarray, window: int) -> np.ndarray:
+    """Sum over the preceding window columns including the current column of every row"""
+    cumsum = np.cumsum(values, axis=1, dtype=np.int64)
+    cumsum[:, window:] -= cumsum[:, :-window].copy()
+    return cumsum
+
+
+def add_rolling_features(df_hourly: DataFrame,
+                         start: pd.Timestamp,
+                         windows: typing.Dict[str, int] = ROLLING_WINDOWS,
+                         timezone: str = TIMEZONE) -> DataFrame:
+    """Add occupancy of the current hour, rolling occupancy and hour of week to hourly counts
+
+    Rolling occupancy is the share of occupied buckets of all known buckets in a window of preceding hours, so hours
+    without data do not count as available.
+
+    Args:
+        df_hourly (DataFrame): hourly counts of aggregate_hourly, including hours before start as history of the windows
+        start (pd.Timestamp): first hour features are returned for
+        windows (typing.Dict[str, int], optional): name of feature as key and length of window in hours as value. Defaults to ROLLING_WINDOWS.
+        timezone (str, optional): time zone of hour of week. Defaults to TIMEZONE.
+
+    Returns:
+        DataFrame: features of hours from start on
+    """
+    start = start.tz_convert("UTC")
+    if df_hourly.shape[0] == 0:
+        return DataFrame(columns=COLS_HOURLY)
+
+    # dense matrices of ids x contiguous hours, the windows are differences of cumulative sums
+    id_codes, ids = pd.factorize(df_hourly["id"])
+    hours = pd.DatetimeIndex(df_hourly["hour"])
+    first_hour = hours.min()
+    hour_codes = np.asarray((hours - first_hour) // pd.Timedelta(hours=1))
+    n_hours = hour_codes.max() + 1
+    known = np.zeros((len(ids), n_hours), dtype=np.int16)
+    occupied = np.zeros((len(ids), n_hours), dtype=np.int16)
+    known[id_codes, hour_codes] = df_hourly["n_known"].to_numpy()
+    occupied[id_codes, hour_codes] = df_hourly["n_occupied"].to_numpy()
+
+    is_new = np.asarray(hours >= start)
+    idx_id, idx_hour = id_codes[is_new], hour_codes[is_new]
+    df_features = DataFrame({"id": ids.to_numpy()[idx_id],
+                             "hour": hours[is_new],
+                             "hour_of_week": hour_of_week(hours[is_new], timezone=timezone),
+                             "n_known": known[idx_id, idx_hour],
+                             "n_occupied": occupied[idx_id, idx_hour]})
+    df_features["occupancy"] = _occupancy(df_features["n_occupied"].to_numpy(), df_features["n_known"].to_numpy())
+    for name, window in windows.items():
+        known_window = _rolling_sum(known, window)[idx_id, idx_hour]
+        occupied_window = _rolling_sum(occupied, window)[idx_id, idx_hour]
+        df_features[name] = _occupancy(occupied_window, known_window)
+    return df_features.sort_values(["hour", "id"], ignore_index=True)
+
+
+def profile_hour_of_week(df_features: DataFrame, df_profile: DataFrame = None) -> DataFrame:
+    """Occupancy per id and hour of week, optionally added to a previous profile
+
+    Args:
+        df_features (DataFrame): hourly features with columns id, hour_of_week, n_known and n_occupied
+        df_profile (DataFrame, optional): profile of previous hours. Defaults to None.
+
+    Returns:
+        DataFrame: columns id, hour_of_week, n_known, n_occupied and occupancy
+    """
+    counts = [df_features[["id", "hour_of_week", "n_known", "n_occupied"]]]
+    if df_profile is not None:
+        counts.append(df_profile[["id", "hour_of_week", "n_known", "n_occupied"]])
+    df_profile = (pd.concat(counts, ignore_index=True)
+                  .groupby(["id", "hour_of_week"], as_index=False, sort=True)
+                  [["n_known", "n_occupied"]].sum())
+    df_profile["occupancy"] = _occupancy(df_profile["n_occupied"].to_numpy(), df_profile["n_known"].to_numpy())
+    return df_profile[COLS_PROFILE]
+
+
+def poi_features(df_cps: DataFrame, mapping_poi_cs: DataFrame, df_poi: DataFrame = None) -> DataFrame:
+    """Number of nearby POIs per charging point and POI category
+
+    Args:
+        df_cps (DataFrame): charging points with columns id and id_cs, e.g. charging_points.csv
+        mapping_poi_cs (DataFrame): mapping table with columns id_poi and id_cs, output of `match_cs_to_poi`
+        df_poi (DataFrame, optional): POIs with columns id_poi and poi_cat. If not specified only the total number of POIs is counted. Defaults to None.
+
+    Returns:
+        DataFrame: columns id, n_poi and n_poi_<category> per category
+    """
+    mapping = mapping_poi_cs[["id_poi", "id_cs"]].drop_duplicates()
+    if df_poi is not None:
+        mapping = mapping.merge(df_poi[["id_poi", "poi_cat"]].drop_duplicates("id_poi"), on="id_poi", how="left")
+        mapping["poi_cat"] = "n_poi_" + mapping["poi_cat"].fillna("other")
+        counts_cs = pd.crosstab(mapping["id_cs"], mapping["poi_cat"])
+    else:
+        counts_cs = DataFrame(index=pd.Index(mapping["id_cs"].unique(), name="id_cs"))
+    counts_cs.insert(0, "n_poi", mapping.groupby("id_cs").size())
+
+    df_poi_features = (df_cps[["id", "id_cs"]]
+                       .merge(counts_cs, left_on="id_cs", right_index=True, how="left")
+                       .drop(columns="id_cs"))
+    cols_counts = df_poi_features.columns.drop("id")
+    df_poi_features[cols_counts] = df_poi_features[cols_counts].fillna(0).astype(np.int32)
+    df_poi_features.columns.name = None
+    return df_poi_features.reset_index(drop=True)
+
+
+def _read_poi_categories(dir_osm_poi: str) -> typing.Optional[DataFrame]:
+    """Read id and category of OSM POIs from shapefiles without geometries"""
+    fullpaths_osm_poi = glob.glob(dir_osm_poi + "/**/*.shp", recursive=True)
+    if not fullpaths_osm_poi:
+        logger.warning(f"No POI shapefiles found in '{dir_osm_poi}', POI features are not split by category.")
+        return None
+    # geopandas is only needed for reading shapefiles and slow to import
+    import geopandas as gpd
+
+    return pd.concat([DataFrame(gpd.read_file(path, ignore_geometry=True))[["id_poi", "poi_cat"]]
+                      for path in fullpaths_osm_poi], ignore_index=True)
+
+
+def _path_partition(dir_features: str, date: pd.Timestamp) -> str:
+    return os.path.join(dir_features, DIR_HOURLY, f"date={date:%Y-%m-%d}", FNAME_PART)
+
+
+def materialized_dates(dir_features: str = DIR_FEATURES) -> typing.List[str]:
+    """Dates of hourly feature partitions in the feature store"""
+    paths = glob.glob(os.path.join(dir_features, DIR_HOURLY, "date=*", FNAME_PART))
+    return sorted(os.path.basename(os.path.dirname(path)).split("=", 1)[1] for path in paths)
+
+
+def read_hourly_features(dir_features: str = DIR_FEATURES,
+                         start: typing.Union[str, pd.Timestamp] = None,
+                         end: typing.Union[str, pd.Timestamp] = None,
+                         columns: typing.List[str] = None) -> DataFrame:
+    """Read hourly features of local dates from the feature store
+
+    Args:
+        dir_features (str, optional): directory of feature store. Defaults to DIR_FEATURES.
+        start (typing.Union[str, pd.Timestamp], optional): first date. Defaults to first materialized date.
+        end (typing.Union[str, pd.Timestamp], optional): end date (exclusive). Defaults to after last materialized date.
+        columns (typing.List[str], optional): columns to read, only these are loaded from the columnar files. Defaults to all columns.
+
+    Returns:
+        DataFrame: hourly features ordered by hour
+    """
+    dates = materialized_dates(dir_features)
+    if start is not None:
+        dates = [date for date in dates if date >= f"{pd.Timestamp(start):%Y-%m-%d}"]
+    if end is not None:
+        dates = [date for date in dates if date < f"{pd.Timestamp(end):%Y-%m-%d}"]
+    if not dates:
+        return DataFrame(columns=columns or COLS_HOURLY)
+    return pd.concat([pd.read_parquet(_path_partition(dir_features, pd.Timestamp(date)), columns=columns)
+                      for date in dates], ignore_index=True)
+
+
+def _write_parquet(df: DataFrame, fullpath: str, metadata: typing.Dict[bytes, bytes] = None):
+    """Write DataFrame to parquet file, replacing an existing file only once the new file is complete"""
+    os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+    fullpath_tmp = fullpath + ".tmp"
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if metadata:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+    pq.write_table(table, fullpath_tmp)
+    os.replace(fullpath_tmp, fullpath)
+
+
+def _read_profile_dates(fullpath_profile: str) -> typing.Optional[typing.Set[str]]:
+    """Dates counted in the hour of week profile, None if the profile or its dates are missing"""
+    if not os.path.exists(fullpath_profile):
+        return None
+    metadata = pq.read_schema(fullpath_profile).metadata or {}
+    if KEY_PROFILE_DATES not in metadata:
+        return None
+    return set(json.loads(metadata[KEY_PROFILE_DATES]))
+
+
+def _update_profile(df_features: DataFrame, computed: typing.List[str], dir_features: str):
+    """Add the counts of the computed dates to the hour of week profile
+
+    The profile stores the dates it counts. If these are not exactly the materialized dates besides the computed ones,
+    e.g. after an interrupted run or when dates are recomputed, the profile is rebuilt from all partitions.
+    """
+    fullpath_profile = os.path.join(dir_features, FNAME_PROFILE)
+    dates_profile = _read_profile_dates(fullpath_profile)
+    dates_materialized = set(materialized_dates(dir_features))
+    if not dates_materialized or (dates_profile == dates_materialized and not computed):
+        return
+    if dates_profile is not None and dates_profile == dates_materialized.difference(computed):
+        df_profile = profile_hour_of_week(df_features, pd.read_parquet(fullpath_profile))
+    else:
+        logger.info(f"Rebuilding hour of week profile from {len(dates_materialized)} dates.")
+        df_profile = profile_hour_of_week(read_hourly_features(dir_features,
+                                                               columns=["id", "hour_of_week", "n_known", "n_occupied"]))
+    _write_parquet(df_profile, fullpath_profile,
+                   metadata={KEY_PROFILE_DATES: json.dumps(sorted(dates_materialized)).encode()})
+
+
+def build_features(dir_status: str = DIR_DATA,
+                   dir_master_data: str = DIR_DATA,
+                   dir_osm_poi: str = DIR_SAVE_OSM,
+                   dir_features: str = DIR_FEATURES,
+                   start: typing.Union[str, pd.Timestamp] = None,
+                   end: typing.Union[str, pd.Timestamp] = None,
+                   overwrite: bool = False,
+                   timezone: str = TIMEZONE) -> typing.List[str]:
+    """Incrementally materialize occupancy features of charging points in a columnar feature store
+
+    Hourly features are written as one parquet file per local date to `<dir_features>/hourly/date=YYYY-MM-DD/`.
+    Dates already materialized are skipped, so a daily run only computes the new days. Only status records of the
+    dates to compute, and up to MAX_GAP before, are read. The rolling windows of new days are continued from the
+    counts of previous partitions instead of older status records. Dates without status records are not materialized.
+    The hour of week profile is updated with the counts of the new days and the POI features are recomputed from the
+    mapping table.
+
+    Args:
+        dir_status (str, optional): directory of status_cps.csv, its id dictionary and snapshot table. Defaults to DIR_DATA.
+        dir_master_data (str, optional): directory of charging_points.csv and mapping_poi_cs.csv. Defaults to DIR_DATA.
+        dir_osm_poi (str, optional): directory of OSM POI shapefiles with POI categories. Defaults to DIR_SAVE_OSM.
+        dir_features (str, optional): directory of feature store. Defaults to DIR_FEATURES.
+        start (typing.Union[str, pd.Timestamp], optional): first local date to materialize. Defaults to date of first record of the status table.
+        end (typing.Union[str, pd.Timestamp], optional): local date to stop at (exclusive). Defaults to date of last status record, i.e. only completed days.
+        overwrite (bool, optional): whether to recompute dates already materialized. Defaults to False.
+        timezone (str, optional): time zone of dates and hour of week. Defaults to TIMEZONE.
+
+    Returns:
+        typing.List[str]: materialized dates
+    """
+    time_range = read_status_time_range(ENTITY_CP, dir_status=dir_status)
+    if time_range is None:
+        logger.warning("No status records found, no features are materialized.")
+        return []
+    start = _to_local_day(start if start is not None else time_range[0], timezone)
+    end = _to_local_day(end if end is not None else time_range[1], timezone)
+
+    materialized = set(materialized_dates(dir_features))
+    days = pd.date_range(start, end, freq="D")
+    dates = [day for day in days if day < end and (overwrite or f"{day:%Y-%m-%d}" not in materialized)]
+    computed = []
+    df_features = DataFrame(columns=COLS_HOURLY)
+    if not dates:
+        logger.info("All dates are already materialized.")
+    else:
+        # dates are computed together, the history of the windows comes from partitions before the first date
+        first_day, end_day = dates[0], dates[-1] + pd.Timedelta(days=1)
+        logger.info(f"Reading status data of {first_day:%Y-%m-%d} to {end_day:%Y-%m-%d} from '{dir_status}'.")
+        # records up to MAX_GAP before the first date forward-fill its first buckets
+        df_status = read_status_table(ENTITY_CP,
+                                      dir_status=dir_status,
+                                      start=first_day - pd.Timedelta(seconds=MAX_GAP),
+                                      end=end_day)[["id", "status", "timestamp"]]
+
+        if df_status.shape[0] > 0:
+            max_window = max(ROLLING_WINDOWS.values())
+            df_history = read_hourly_features(dir_features,
+                                              start=(first_day - pd.Timedelta(hours=max_window)).tz_localize(None),
+                                              end=first_day.tz_localize(None),
+                                              columns=["id", "hour", "n_known", "n_occupied"])
+            logger.info(f"Computing hourly features of {len(dates)} dates from {first_day:%Y-%m-%d}.")
+            with metrics.timer("features_step", track_memory=True, step="hourly") as t:
+                df_hourly = aggregate_hourly(df_status, start=first_day, end=end_day)
+                if df_history.shape[0] > 0:
+                    df_hourly = pd.concat([df_history, df_hourly], ignore_index=True)
+                df_features = add_rolling_features(df_hourly,
+                                                   start=first_day,
+                                                   timezone=timezone)
+                t.rows = df_features.shape[0]
+
+        if df_features.shape[0] > 0:
+            dates_local = pd.DatetimeIndex(df_features["hour"]).tz_convert(timezone).strftime("%Y-%m-%d")
+            # features also cover materialized dates between the dates to compute, which are not rewritten
+            computed = sorted(set(f"{day:%Y-%m-%d}" for day in dates).intersection(dates_local))
+            for date in computed:
+                _write_parquet(df_features[dates_local == date].reset_index(drop=True),
+                               _path_partition(dir_features, pd.Timestamp(date)))
+            df_features = df_features[np.isin(dates_local, computed)]
+        if len(computed) < len(dates):
+            # dates without status records are not materialized, they are computed again once records are available
+            logger.warning(f"No status records found for {len(dates) - len(computed)} of {len(dates)} dates, "
+                           f"these are not materialized.")
+        logger.info(f"Materialized hourly features of {len(computed)} dates in '{dir_features}'.")
+
+    # the profile is also brought up to date with the partitions if a previous run was interrupted
+    with metrics.timer("features_step", step="profile"):
+        _update_profile(df_features, computed, dir_features)
+
+    fullpath_cp = os.path.join(dir_master_data, "charging_points.csv")
+    fullpath_mapping = os.path.join(dir_master_data, "mapping_poi_cs.csv")
+    if os.path.exists(fullpath_mapping):
+        with metrics.timer("features_step", step="poi"):
+            df_poi_features = poi_features(df_cps=pd.read_csv(fullpath_cp, sep=";", usecols=["id", "id_cs"]),
+                                           mapping_poi_cs=pd.read_csv(fullpath_mapping, sep=";"),
+                                           df_poi=_read_poi_categories(dir_osm_poi))
+            _write_parquet(df_poi_features, os.path.join(dir_features, FNAME_POI))
+    else:
+        logger.warning(f"Mapping table '{fullpath_mapping}' not found, POI features are not updated.")
+    return computed
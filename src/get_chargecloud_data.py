@@ -1,4 +1,3 @@
-import pandas as pd 
 import typing 
 import requests
 import datetime
@@ -6,14 +5,45 @@ import logging
 import logging.config
 import time 
 import json 
+import pickle
+import hashlib
+import queue
+import random
+import signal
+import threading
 import os
+if typing.TYPE_CHECKING: 
+    from partitioning import CityPartitioner
 
 logger = logging.getLogger(__name__)
-from settings import LOGGING_CONFIG
+from settings import (LOGGING_CONFIG, 
+                      METRICS_FILENAME, 
+                      DIR_SAVE_API_RESULTS, 
+                      BASE_URL_CHARGECLOUD, 
+                      SCRAPING_INTERVAL, 
+                      REQUEST_TIMEOUT, 
+                      MAX_RETRIES)
+import metrics
+from status_log import append_status_log, DIR_STATUS_LOG
+from transitions import TransitionTracker
 
 
-BASE_URL_CHARGECLOUD = "https://new-poi.chargecloud.de"
-SCRAPING_INTERVAL = 10
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# share of the scraping interval requests and retries of a tick may take
+TICK_BUDGET = 0.8
+# maximum number of snapshots waiting to be written
+WRITE_QUEUE_SIZE = 4
+# keys of API results starting with PREFIX_META are metadata of the scraper, not cities
+PREFIX_META = "_"
+KEY_SCRAPE_STATUS = "_scrape_status"
+# API results of cities whose payload did not change since the last tick are saved as marker referencing the last 
+# snapshot containing the full payload, e.g. {"unchanged": true, "ref": "20220111_215824_cp_data_cities.json", ...}
+DIFF_PAYLOADS = True
+KEY_UNCHANGED = "unchanged"
+# number of consecutive unchanged ticks of a city after which its full payload is saved again
+KEYFRAME_INTERVAL = 36
 CITIES_CC = ['koeln','dortmund','bonn','muenster','kiel',
             'chemnitz','krefeld','leverkusen','heidelberg',
             'solingen','ingolstadt','pforzheim','goettingen',
@@ -24,69 +54,554 @@ CITIES_CC = ['koeln','dortmund','bonn','muenster','kiel',
             'kitzingen','lichtenfels']
 
 
-DIR_SAVE_API_RESULTS =  "../data/scraped_data"
 SAVE_RAW = True
 
+# file names of API results are prefixed with the query time, e.g. '20220111_215824_cp_data_cities.json'
+FMT_QUERY_TIME = "%Y%m%d_%H%M%S"
+SUFFIX_API_RESULTS = "_cp_data_cities"
+SHARD_BY_CITY = False
+# layout of sharded API results relative to save directory, e.g. 'city=koeln/date=2022-01-11'
+FMT_SHARD_DIR = os.path.join("city={city}", "date={date}")
+
+
+def _get_shard_dir(dir_save: str, city: str, query_time: str) -> str: 
+    """Get directory of a city shard of API results
+
+    Args:
+        dir_save (str): directory for saving scraped cities
+        city (str): name of city
+        query_time (str): query time formatted as FMT_QUERY_TIME
+
+    Returns:
+        str: directory of city shard
+    """    
+    date = datetime.datetime.strptime(query_time, FMT_QUERY_TIME).strftime("%Y-%m-%d")
+    return os.path.join(dir_save, FMT_SHARD_DIR.format(city=city, date=date))
+
+
+def _get_api_results_path(dir_save: str, query_time: str, save_raw: bool = False) -> str: 
+    """Get path of API results of a query time"""
+    return os.path.join(dir_save, query_time + SUFFIX_API_RESULTS + (".json" if save_raw else ".pkl"))
+
+
+def _save_api_results(data_cities: dict, 
+                      dir_save: str, 
+                      query_time: str, 
+                      save_raw: bool = False) -> str: 
+    """Atomically save API results by writing to a temporary file and renaming it afterwards
+
+    Args:
+        data_cities (dict): mapping containing city as key and chargecloud API result for city as value
+        dir_save (str): directory for saving API results
+        query_time (str): query time formatted as FMT_QUERY_TIME
+        save_raw (bool, optional): whether to save API result as raw json (True) or pickle file (False). Defaults to False.
+
+    Returns:
+        str: path of saved API results
+    """    
+    os.makedirs(dir_save, exist_ok=True)
+    path_save = _get_api_results_path(dir_save, query_time=query_time, save_raw=save_raw)
+    path_tmp = path_save + ".tmp"
+    
+    if save_raw: 
+        with open(path_tmp, 'w', encoding='utf-8') as f:
+            json.dump(data_cities, f)
+    else: 
+        # plain pickle, readable with pd.read_pickle
+        with open(path_tmp, 'wb') as f: 
+            pickle.dump(data_cities, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path_tmp, path_save)
+    return path_save
+
+
+def _backoff_seconds(attempt: int, base: float = BACKOFF_BASE, maximum: float = BACKOFF_MAX) -> float: 
+    """Exponential backoff with full jitter before retry `attempt` (starting at 1)"""
+    return random.uniform(0, min(maximum, base * 2 ** (attempt - 1)))
+
+
+def _fetch_city(session: requests.Session, 
+                city: str, 
+                base_url: str = BASE_URL_CHARGECLOUD, 
+                timeout: typing.Tuple[float, float] = REQUEST_TIMEOUT, 
+                max_retries: int = MAX_RETRIES, 
+                deadline: float = None, 
+                headers: dict = None) -> typing.Tuple[typing.Optional[dict], dict]: 
+    """Fetch API result of a city with timeouts and retries with exponential backoff
+
+    If the API answers a conditional request with '304 Not Modified', the fetch succeeds without API result and the 
+    scrape status is flagged with 'not_modified'.
+
+    Args:
+        session (requests.Session): HTTP session reusing connections
+        city (str): name of city
+        base_url (str, optional): base URL of chargecloud API. Defaults to BASE_URL_CHARGECLOUD.
+        timeout (typing.Tuple[float, float], optional): connect and read timeout of a request in seconds. Defaults to REQUEST_TIMEOUT.
+        max_retries (int, optional): number of retries after the first attempt. Defaults to MAX_RETRIES.
+        deadline (float, optional): time.monotonic() value no request or backoff may exceed. Defaults to None.
+        headers (dict, optional): additional request headers, e.g. 'If-None-Match'. Defaults to None.
+
+    Returns:
+        typing.Tuple[typing.Optional[dict], dict]: API result or None if all attempts failed or the API result was not modified and scrape status of city
+    """    
+    status = {"ok": False, "attempts": 0, "status_code": None, "bytes": 0, "seconds": 0.0, "error": None}
+    t_start = time.monotonic()
+    
+    for attempt in range(max_retries + 1): 
+        if attempt > 0: 
+            backoff = _backoff_seconds(attempt)
+            if deadline is not None and time.monotonic() + backoff >= deadline: 
+                status["error"] = f"deadline exceeded after {attempt} attempts, last error: {status['error']}"
+                break
+            metrics.count("scrape_retries", city=city)
+            time.sleep(backoff)
+        
+        _timeout = timeout
+        if deadline is not None: 
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: 
+                status["error"] = f"deadline exceeded after {attempt} attempts, last error: {status['error']}"
+                break
+            _timeout = tuple(min(t, remaining) for t in timeout)
+        
+        status["attempts"] = attempt + 1
+        try: 
+            with metrics.timer("scrape_city", city=city): 
+                r = session.get(base_url + "/" + city, timeout=_timeout, headers=headers)
+            status["status_code"] = r.status_code
+            status["bytes"] = len(r.content)
+            metrics.count("scrape_bytes", len(r.content), city=city)
+            if r.status_code == 304: 
+                status.update(ok=True, error=None, not_modified=True, seconds=round(time.monotonic() - t_start, 3))
+                return None, status
+            # client errors except rate limiting are not retried
+            if r.status_code in RETRY_STATUS_CODES: 
+                status["error"] = f"HTTP {r.status_code}"
+                continue
+            r.raise_for_status()
+            data = r.json()
+            status["etag"] = r.headers.get("ETag")
+            status["last_modified"] = r.headers.get("Last-Modified")
+        except requests.HTTPError as e: 
+            status["error"] = f"{type(e).__name__}: {e}"
+            break
+        except (requests.RequestException, ValueError) as e: 
+            # timeouts, connection errors and truncated responses
+            status["error"] = f"{type(e).__name__}: {e}"
+            continue
+        
+        status.update(ok=True, error=None, seconds=round(time.monotonic() - t_start, 3))
+        return data, status
+    
+    status["seconds"] = round(time.monotonic() - t_start, 3)
+    metrics.count("scrape_errors", city=city)
+    return None, status
+
+
+def _payload_digest(data: dict) -> str: 
+    """Hash of an API result of a city ignoring its timestamp"""
+    payload = {key: val for key, val in data.items() if key != "timestamp"}
+    return hashlib.blake2b(json.dumps(payload, separators=(",", ":")).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class PayloadCache: 
+    """Last full API result per city, used for conditional requests and for saving unchanged API results as markers
+
+    The API's support of ETag and Last-Modified is detected per response. Cities without validators are compared by 
+    a hash of their payload. 
+
+    Args:
+        keyframe_interval (int, optional): number of consecutive unchanged ticks after which the full API result of a city is saved again. Defaults to KEYFRAME_INTERVAL.
+    """
+    
+    def __init__(self, keyframe_interval: int = KEYFRAME_INTERVAL): 
+        self.keyframe_interval = keyframe_interval
+        self._entries = {}
+    
+    def request_headers(self, city: str) -> dict: 
+        """Headers of a conditional request for a city"""
+        entry = self._entries.get(city)
+        headers = {}
+        if entry is None: 
+            return headers
+        if entry["etag"] is not None: 
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"] is not None: 
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+    
+    def resolve(self, 
+                city: str, 
+                data: typing.Optional[dict], 
+                status: dict, 
+                path_snapshot: str = None) -> typing.Tuple[dict, dict]: 
+        """Compare a successfully fetched API result of a city with its last full API result
+
+        Args:
+            city (str): name of city
+            data (typing.Optional[dict]): API result or None if the API answered '304 Not Modified'
+            status (dict): scrape status of city, flagged with 'unchanged' if the API result is saved as marker
+            path_snapshot (str, optional): path the API result of the city is saved to. If None, no markers are created. Defaults to None.
+
+        Returns:
+            typing.Tuple[dict, dict]: API result or marker to save and full API result
+        """
+        entry = self._entries.get(city)
+        if status.get("not_modified"): 
+            # the API does not send a new timestamp with '304 Not Modified'
+            data = {**entry["data"], "timestamp": datetime.datetime.now().astimezone().isoformat(timespec="seconds")}
+            digest = entry["digest"]
+        else: 
+            digest = _payload_digest(data)
+        
+        unchanged = entry is not None and entry["digest"] == digest
+        if (unchanged 
+                and path_snapshot is not None 
+                and entry["path"] is not None 
+                and entry["n_unchanged"] < self.keyframe_interval): 
+            entry["n_unchanged"] += 1
+            for key in ("etag", "last_modified"): 
+                if status.get(key) is not None: 
+                    entry[key] = status[key]
+            status["unchanged"] = True
+            metrics.count("scrape_unchanged", city=city)
+            marker = {KEY_UNCHANGED: True, 
+                      "ref": os.path.relpath(entry["path"], os.path.dirname(path_snapshot)), 
+                      "timestamp": data.get("timestamp")}
+            return marker, data
+        
+        # responses without validators, e.g. '304 Not Modified', keep the validators of an unchanged payload
+        validators = {key: status[key] if status.get(key) is not None else (entry[key] if unchanged else None) 
+                      for key in ("etag", "last_modified")}
+        self._entries[city] = {"data": data, 
+                               "digest": digest, 
+                               "path": path_snapshot, 
+                               "n_unchanged": 0, 
+                               **validators}
+        return data, data
+
+
+class SnapshotWriter: 
+    """Writes snapshots in a background thread. The queue is bounded, so fetching blocks if writing falls behind.
+
+    Args:
+        maxsize (int, optional): maximum number of pending writes. Defaults to WRITE_QUEUE_SIZE.
+    """
+    
+    def __init__(self, maxsize: int = WRITE_QUEUE_SIZE): 
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+        self._thread.start()
+    
+    def _run(self): 
+        while True: 
+            task = self._queue.get()
+            if task is None: 
+                self._queue.task_done()
+                return
+            func, kwargs = task
+            try: 
+                func(**kwargs)
+            except Exception: 
+                metrics.count("write_errors")
+                logger.exception(f"Error occurred while writing snapshot with '{func.__name__}'.")
+            finally: 
+                self._queue.task_done()
+    
+    def submit(self, func: typing.Callable, **kwargs): 
+        """Queue a write, blocks while the queue is full"""
+        if self._queue.full(): 
+            logger.warning("Write queue is full, waiting for pending writes.")
+        metrics.gauge("write_queue_size", self._queue.qsize())
+        self._queue.put((func, kwargs))
+    
+    def close(self): 
+        """Wait for pending writes and stop writer thread"""
+        self._queue.put(None)
+        self._thread.join()
+
+
+def _write_snapshot(data_cities: dict, 
+                    dir_save: str, 
+                    query_time: str, 
+                    save_raw: bool, 
+                    dir_status_log: str, 
+                    shard_by_city: bool, 
+                    data_save: dict = None, 
+                    transition_tracker: TransitionTracker = None): 
+    """Write API results of all cities of one query interval to the status log, the transition sinks and a single 
+    file. If given, `data_save` containing markers of unchanged cities is saved instead of the full API results."""
+    if dir_status_log is not None: 
+        with metrics.timer("append_status_log") as t: 
+            t.rows = append_status_log(data_cities, dir_log=dir_status_log)
+    
+    if transition_tracker is not None: 
+        with metrics.timer("track_transitions") as t: 
+            t.rows = len(transition_tracker.update(data_cities))
+    
+    if dir_save is None or shard_by_city: 
+        return
+    
+    with metrics.timer("save_api_results"): 
+        _save_api_results(data_cities if data_save is None else data_save, 
+                          dir_save=dir_save, 
+                          query_time=query_time, 
+                          save_raw=save_raw)
+
 
 def scrape_cp_cities(cities: typing.List[str], 
                      dir_save: str, 
-                     save_raw: bool = False): 
+                     save_raw: bool = False, 
+                     dir_status_log: str = None, 
+                     shard_by_city: bool = False, 
+                     session: requests.Session = None, 
+                     base_url: str = BASE_URL_CHARGECLOUD, 
+                     timeout: typing.Tuple[float, float] = REQUEST_TIMEOUT, 
+                     max_retries: int = MAX_RETRIES, 
+                     deadline: float = None, 
+                     writer: SnapshotWriter = None, 
+                     payload_cache: PayloadCache = None, 
+                     transition_tracker: TransitionTracker = None, 
+                     query_time: str = None) -> dict: 
     """Scrape charging point information for a given list of cities
 
+    The scrape status of every city (success, attempts, error) is saved with the API results under key '_scrape_status'.
+    With a payload cache, cities are requested conditionally and cities whose payload did not change since the last 
+    call are saved as marker referencing the snapshot containing their full API result.
+
     Args:
         cities (typing.List[str], optional): list of cities to scrape.
-        dir_save (str): directory for saving scraped cities. 
+        dir_save (str): directory for saving scraped cities. If None, API results are not saved as file.
         save_raw (bool, optional): whether to save API result as raw json (True) or pickle file (False). Defaults to False.
+        dir_status_log (str, optional): directory of binary status log. If not specified status of charging points is not appended to status log. Defaults to None.
+        shard_by_city (bool, optional): whether to save each city to its own file in directory 'city=<city>/date=<YYYY-MM-DD>' as soon as it is scraped (True) or all cities to a single file (False). Defaults to False.
+        session (requests.Session, optional): HTTP session reusing connections across calls. If not specified a new session is used. Defaults to None.
+        base_url (str, optional): base URL of chargecloud API, e.g. of a local stub. Defaults to BASE_URL_CHARGECLOUD.
+        timeout (typing.Tuple[float, float], optional): connect and read timeout of a request in seconds. Defaults to REQUEST_TIMEOUT.
+        max_retries (int, optional): number of retries of a city after the first attempt. Defaults to MAX_RETRIES.
+        deadline (float, optional): time.monotonic() value requests and retries may not exceed. Cities not scraped until then are marked as failed. Defaults to None.
+        writer (SnapshotWriter, optional): background writer of snapshots. If not specified snapshots are written synchronously. Defaults to None.
+        payload_cache (PayloadCache, optional): last full API results of cities kept across calls. If not specified full API results of all cities are saved. Defaults to None.
+        transition_tracker (TransitionTracker, optional): tracker emitting status transitions of charging points and connectors to its sinks after every call. Defaults to None.
+        query_time (str, optional): query time formatted as FMT_QUERY_TIME the API results are saved with, e.g. the start of a tick shared by several scraper nodes. Defaults to the current time.
+
+    Returns:
+        dict: scrape status per city
     """    
     data_cities = {}
-    now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")        
+    data_save = {}
+    scrape_status = {}
+    now = query_time or datetime.datetime.now().strftime(FMT_QUERY_TIME)
+    _session = session or requests.Session()
+    submit = writer.submit if writer is not None else lambda func, **kwargs: func(**kwargs)
 
     for city in cities: 
-        r = requests.get(BASE_URL_CHARGECLOUD + "/" + city)
-        try: 
-            data = json.loads(r.text)
+        data, status = _fetch_city(_session, 
+                                   city, 
+                                   base_url=base_url, 
+                                   timeout=timeout, 
+                                   max_retries=max_retries, 
+                                   deadline=deadline, 
+                                   headers=payload_cache.request_headers(city) if payload_cache is not None else None)
+        scrape_status[city] = status
+        
+        dir_snapshot = None
+        if dir_save is not None: 
+            dir_snapshot = _get_shard_dir(dir_save, city=city, query_time=now) if shard_by_city else dir_save
+        
+        if not status["ok"]: 
+            logger.error(f"Error occurred while scraping '{city}' at {now}: {status['error']}")
+        else: 
+            data_save[city] = data
+            if payload_cache is not None: 
+                path_snapshot = None
+                if dir_snapshot is not None: 
+                    path_snapshot = _get_api_results_path(dir_snapshot, query_time=now, save_raw=save_raw)
+                data_save[city], data = payload_cache.resolve(city, data, status, path_snapshot=path_snapshot)
             data_cities[city] = data
-            logger.debug(f"Successfully scraped '{city}' at {now}.")
-        except: 
-            logger.error(f"Error occurred while scraping '{city}' at {now}.")
+            logger.debug(f"Successfully scraped '{city}' at {now}{' (unchanged)' if status.get('unchanged') else ''}.")
+        
+        if shard_by_city and dir_snapshot is not None: 
+            shard = {KEY_SCRAPE_STATUS: {city: status}}
+            if city in data_save: 
+                shard[city] = data_save[city]
+            submit(_save_api_results, 
+                   data_cities=shard, 
+                   dir_save=dir_snapshot, 
+                   query_time=now, 
+                   save_raw=save_raw)
+    
+    if session is None: 
+        _session.close()
+    
+    n_failed = sum(not status["ok"] for status in scrape_status.values())
+    if n_failed: 
+        logger.warning(f"Scraping failed for {n_failed} of {len(cities)} cities at {now}.")
+    n_unchanged = sum(bool(status.get("unchanged")) for status in scrape_status.values())
+    if n_unchanged: 
+        logger.info(f"Payload of {n_unchanged} of {len(cities)} cities unchanged at {now}.")
+    
+    data_cities[KEY_SCRAPE_STATUS] = scrape_status
+    data_save[KEY_SCRAPE_STATUS] = scrape_status
+    submit(_write_snapshot, 
+           data_cities=data_cities, 
+           dir_save=dir_save, 
+           query_time=now, 
+           save_raw=save_raw, 
+           dir_status_log=dir_status_log, 
+           shard_by_city=shard_by_city, 
+           data_save=data_save if payload_cache is not None else None, 
+           transition_tracker=transition_tracker)
+    return scrape_status
+
+
+def _scrape_partitioned_tick(partitioner: "CityPartitioner", 
+                             cities: typing.List[str], 
+                             stop_event: threading.Event, 
+                             **scrape_kwargs) -> int: 
+    """Scrape the cities of the current tick owned by this node, first the cities assigned to it, then cities left 
+    unclaimed by other nodes
+
+    Args:
+        partitioner (CityPartitioner): partitioner of cities between scraper nodes
+        cities (typing.List[str]): all cities to scrape
+        stop_event (threading.Event): event stopping the daemon when set
+        scrape_kwargs: keyword arguments of `scrape_cp_cities`
+
+    Returns:
+        int: index of scraped tick
+    """    
+    interval = partitioner.interval
+    tick = partitioner.tick_of()
+    t_tick = partitioner.tick_start(tick)
+    query_time = partitioner.query_time(tick)
+    # the tick budget ends at a point in wall clock time shared by all nodes
+    deadline = time.monotonic() + t_tick + TICK_BUDGET * interval - time.time()
+    
+    owned = partitioner.claim_assigned(tick, cities)
+    logger.info(f"Scraping {len(owned)} of {len(cities)} cities of tick {tick} as node '{partitioner.node_id}'.")
+    if owned: 
+        with metrics.timer("scrape_cities"): 
+            scrape_cp_cities(cities=owned, query_time=query_time, deadline=deadline, **scrape_kwargs)
+    
+    stop_event.wait(max(t_tick + partitioner.steal_after * interval - time.time(), 0))
+    stolen = partitioner.claim_unclaimed(tick, cities, owned=owned)
+    if stolen: 
+        with metrics.timer("scrape_cities"): 
+            scrape_cp_cities(cities=stolen, query_time=query_time, deadline=deadline, **scrape_kwargs)
+    return tick
 
-    if save_raw: 
-        fname = now + "_cp_data_cities.json"
-        path_save = os.path.join(dir_save, fname)
-        with open(path_save, 'w', encoding='utf-8') as f:
-            json.dump(data_cities, f)
-    else: 
-        fname = now + "_cp_data_cities.pkl"
-        path_save = os.path.join(dir_save, fname)
-        pd.to_pickle(data_cities, path_save)
-	
 
 def call_chargecloud_api(scraping_interval: typing.Union[int, float] = SCRAPING_INTERVAL, 
                          cities: typing.List[str] = CITIES_CC, 
                          dir_save_api_results: str = DIR_SAVE_API_RESULTS, 
-                         save_raw: str = SAVE_RAW): 
+                         save_raw: str = SAVE_RAW, 
+                         dir_status_log: str = DIR_STATUS_LOG, 
+                         shard_by_city: bool = SHARD_BY_CITY, 
+                         base_url: str = BASE_URL_CHARGECLOUD, 
+                         timeout: typing.Tuple[float, float] = REQUEST_TIMEOUT, 
+                         max_retries: int = MAX_RETRIES, 
+                         max_ticks: int = None, 
+                         stop_event: threading.Event = None, 
+                         diff_payloads: bool = DIFF_PAYLOADS, 
+                         transition_tracker: TransitionTracker = None, 
+                         partitioner: "CityPartitioner" = None): 
     """Scrape a given list of cities from chargecloud API in a given interval.
 
+    Ticks are scheduled on a monotonic clock at multiples of the interval, independent of how long a tick takes. 
+    Requests and retries of a tick must finish within TICK_BUDGET of the interval, writing happens in a background 
+    thread. Ticks missed because a tick overran are skipped. SIGTERM and SIGINT stop the daemon after the current tick.
+    Cities are requested conditionally and unchanged cities are saved as markers unless diff_payloads is False.
+    
+    With a partitioner, several daemons share the cities: ticks are aligned to the wall clock, every daemon only 
+    scrapes the cities it claimed for a tick and saves them sharded by city with the query time of the tick. The 
+    shards are assembled to one snapshot per tick by `partitioning.merge_ticks`. Every daemon appends to its own 
+    status log in directory 'node=<node_id>' of dir_status_log. Status transitions of partitioned daemons are derived
+    from the merged snapshots, as a daemon only knows the last status of the cities it scraped itself.
+
     Args:
         scraping_interval (typing.Union[int, float], optional): interval in minutes between API lookups. Defaults to SCRAPING_INTERVAL.
         cities (typing.List[str], optional): list of cities to scrape
-        dir_save (str, optional): directory for saving scraped cities. Defaults to "../data/scraped_data".
+        dir_save (str, optional): directory for saving scraped cities. Defaults to DIR_SAVE_API_RESULTS.
         save_raw (bool, optional): whether to save API result as raw json (True) or pickle file (False). Defaults to False.
+        dir_status_log (str, optional): directory of binary status log. If None, no status log is written. Defaults to DIR_STATUS_LOG.
+        shard_by_city (bool, optional): whether to save API results sharded by city and date. Defaults to SHARD_BY_CITY.
+        base_url (str, optional): base URL of chargecloud API, e.g. of a local stub. Defaults to BASE_URL_CHARGECLOUD.
+        timeout (typing.Tuple[float, float], optional): connect and read timeout of a request in seconds. Defaults to REQUEST_TIMEOUT.
+        max_retries (int, optional): number of retries of a city after the first attempt. Defaults to MAX_RETRIES.
+        max_ticks (int, optional): number of ticks after which the daemon stops. If not specified the daemon runs until it is stopped. Defaults to None.
+        stop_event (threading.Event, optional): event stopping the daemon when set. If not specified SIGTERM and SIGINT stop the daemon. Defaults to None.
+        diff_payloads (bool, optional): whether to save API results of cities whose payload did not change as markers referencing the last full API result. Defaults to DIFF_PAYLOADS.
+        transition_tracker (TransitionTracker, optional): tracker emitting status transitions of charging points and connectors to its sinks once per tick. Defaults to None.
+        partitioner (CityPartitioner, optional): partitioner of cities between several scraper daemons. If not specified all cities are scraped. Defaults to None.
 
+    Raises:
+        ValueError: Raised if both a partitioner and a transition tracker are specified
     """    
-    while True: 
-        
-        now = datetime.datetime.now().strftime("%Y/%m/%d_%H:%M:%S")
-        info_msg = f"Scraping cities: {now}"
-        logger.info(info_msg)
-        
-        scrape_cp_cities(cities=cities, dir_save=dir_save_api_results, save_raw=save_raw)
-        
-        # API call of all cities takes approx. 15 seconds, therefore subtract it from specified interval
-        sleep = max(scraping_interval*60 - 15, 0)
-        time.sleep(sleep)
+    interval = scraping_interval * 60
+    if partitioner is not None: 
+        if transition_tracker is not None: 
+            raise ValueError("Status transitions of partitioned scrapers are derived when merging their shards, see `partitioning.merge_ticks`.")
+        shard_by_city = True
+        if dir_status_log is not None: 
+            dir_status_log = os.path.join(dir_status_log, f"node={partitioner.node_id}")
+    if stop_event is None: 
+        stop_event = threading.Event()
+        if threading.current_thread() is threading.main_thread(): 
+            for sig in (signal.SIGTERM, signal.SIGINT): 
+                signal.signal(sig, lambda signum, frame: stop_event.set())
+    
+    writer = SnapshotWriter()
+    payload_cache = PayloadCache() if diff_payloads else None
+    t_first_tick = time.monotonic()
+    # index of current tick on the grid of intervals since the first tick
+    tick = 0
+    n_ticks = 0
+    
+    with requests.Session() as session: 
+        scrape_kwargs = {"dir_save": dir_save_api_results, 
+                         "save_raw": save_raw, 
+                         "dir_status_log": dir_status_log, 
+                         "shard_by_city": shard_by_city, 
+                         "session": session, 
+                         "base_url": base_url, 
+                         "timeout": timeout, 
+                         "max_retries": max_retries, 
+                         "writer": writer, 
+                         "payload_cache": payload_cache, 
+                         "transition_tracker": transition_tracker}
+        try: 
+            if partitioner is not None: 
+                # start at the next tick on the wall clock grid shared by all nodes
+                stop_event.wait(max(partitioner.tick_start(partitioner.tick_of() + 1) - time.time(), 0))
+            while not stop_event.is_set() and (max_ticks is None or n_ticks < max_ticks): 
+                if partitioner is not None: 
+                    tick_scraped = _scrape_partitioned_tick(partitioner, cities, stop_event, **scrape_kwargs)
+                    n_ticks += 1
+                    tick = partitioner.tick_of() + 1
+                    if tick > tick_scraped + 1: 
+                        logger.warning(f"Scraping took longer than the interval, skipping {tick - tick_scraped - 1} ticks.")
+                    stop_event.wait(max(partitioner.tick_start(tick) - time.time(), 0))
+                    continue
+                
+                t_tick = t_first_tick + tick * interval
+                now = datetime.datetime.now().strftime("%Y/%m/%d_%H:%M:%S")
+                logger.info(f"Scraping cities: {now}")
+                
+                with metrics.timer("scrape_cities"): 
+                    scrape_cp_cities(cities=cities, deadline=t_tick + TICK_BUDGET * interval, **scrape_kwargs)
+                n_ticks += 1
+                
+                next_tick = int((time.monotonic() - t_first_tick) // interval) + 1
+                if next_tick > tick + 1: 
+                    logger.warning(f"Scraping took longer than the interval, skipping {next_tick - tick - 1} ticks.")
+                tick = next_tick
+                stop_event.wait(max(t_first_tick + tick * interval - time.monotonic(), 0))
+        finally: 
+            writer.close()
+    logger.info("Stopped scraping.")
 
 
 if __name__ == '__main__':
     logging.config.dictConfig(LOGGING_CONFIG)
+    metrics.configure(METRICS_FILENAME)
     call_chargecloud_api()
\ No newline at end of file
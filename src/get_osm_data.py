@@ -7,8 +7,7 @@ from geopandas import GeoDataFrame
 
 
 import logging.config
-from settings import LOGGING_CONFIG
-logging.config.dictConfig(LOGGING_CONFIG)
+from settings import LOGGING_CONFIG, DIR_SAVE_OSM
 
 
 logger = logging.getLogger(__name__)
@@ -33,9 +32,6 @@ TAGS = {"amenity": ["supermarket", "fast_food", "highway_services", "fuel"],
         "shop": ["mall", "doityourself"]}
 
 
-DIR_SAVE_OSM = "../data/osm"
-
-
 def _append_poi_category(gdf_poi: GeoDataFrame,
                          tags: typing.Dict[str, list], 
                          col_poi_id: str = "id_poi"
@@ -111,7 +107,7 @@ def get_poi_osm_data(tags: dict = TAGS,
     Args:
         tags (dict, optional): tags (OSM key-value combinations) to . Defaults to TAGS.
         cities (typing.List[str], optional):  list of cities. Defaults to CITIES_OSM.
-        dir_save (str, optional): directory for saving poi data. Defaults to "../data/osm".
+        dir_save (str, optional): directory for saving poi data. Defaults to DIR_SAVE_OSM.
         cols_relevant (list, optiona): list of relevant columns to save. Defaults to ["poi_id", "geometry", "poi_cat"]
         
     """    
@@ -139,4 +135,9 @@ def get_poi_osm_data(tags: dict = TAGS,
     # shapefile can only consist one geometry type (Point, Polygon)
     for geom_type, gdf_geom_type in gdf_pois_combined.groupby("geom_type"): 
         logger.info(f"Saving combined POI to GeoJSON to '{fullpath_shp_file.format(geom_type=geom_type.lower())}'.")
-        gdf_geom_type[cols_relevant].to_file(fullpath_shp_file.format(geom_type=geom_type.lower()))
\ No newline at end of file
+        gdf_geom_type[cols_relevant].to_file(fullpath_shp_file.format(geom_type=geom_type.lower()))
+
+
+if __name__ == '__main__': 
+    logging.config.dictConfig(LOGGING_CONFIG)
+    get_poi_osm_data()
@@ -0,0 +1,417 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+from scipy.spatial import cKDTree
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+import datetime
+import threading
+import logging
+import typing
+import glob
+import json
+import os
+
+from settings import DIR_DATA, DIR_STATUS_LOG, LATEST_STATUS_HOST, LATEST_STATUS_PORT, LATEST_STATUS_POLL_INTERVAL
+from status_log import (RECORD_DTYPE,
+                        FNAME_STATUS_LOG,
+                        read_status_log,
+                        _read_dictionary)
+
+logger = logging.getLogger(__name__)
+
+
+# status logs of scraper nodes sharing the cities, see `get_chargecloud_data.call_chargecloud_api`
+PATTERN_NODE_LOGS = "node=*"
+# statuses of a charging point free to charge
+AVAILABLE_STATUSES = ["AVAILABLE"]
+EARTH_RADIUS = 6371008.8
+# status records of this many seconds before the last record seed the index on start
+SEED_WINDOW = 86400
+DEFAULT_K = 5
+MAX_K = 100
+
+
+def _to_unit_vectors(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """Cartesian coordinates on the unit sphere, so euclidean nearest neighbours are nearest on the earth"""
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def _chord_to_metres(chord: np.ndarray) -> np.ndarray:
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+def _format_timestamp(epoch: int) -> typing.Optional[str]:
+    if epoch < 0:
+        return None
+    return datetime.datetime.fromtimestamp(epoch, tz=datetime.timezone.utc).isoformat()
+
+
+class LatestStatusIndex:
+    """Latest status of every charging point with a spatial index over charging stations
+
+    Statuses are kept in arrays aligned to the charging points, and the number of available charging points per
+    station is maintained on every update, so queries do not scan the status history.
+
+    Args:
+        df_cs (DataFrame): charging stations with columns id, name, city, latitude and longitude, e.g. charging_stations.csv
+        df_cp (DataFrame): charging points with columns id and id_cs, e.g. charging_points.csv
+        available_statuses (typing.List[str], optional): statuses of a free charging point. Defaults to AVAILABLE_STATUSES.
+    """
+
+    def __init__(self, df_cs: DataFrame, df_cp: DataFrame, available_statuses: typing.List[str] = AVAILABLE_STATUSES):
+        df_cs = df_cs.dropna(subset=["latitude", "longitude"]).drop_duplicates("id").reset_index(drop=True)
+        # attributes of stations are converted to JSON serializable records once
+        df_records = df_cs[["id", "name", "city", "latitude", "longitude"]].rename(columns={"id": "id_cs"})
+        self._station_records = df_records.astype(object).where(df_records.notna(), None).to_dict("records")
+        self._idx_cs = {id_cs: idx for idx, id_cs in enumerate(df_cs["id"].tolist())}
+        self._tree = cKDTree(_to_unit_vectors(df_cs["latitude"].to_numpy(), df_cs["longitude"].to_numpy()))
+        # stations ordered by latitude, bbox queries only scan the latitude band
+        self._order_lat = np.argsort(df_cs["latitude"].to_numpy(), kind="stable")
+        self._lat_sorted = df_cs["latitude"].to_numpy()[self._order_lat]
+        self._lon = df_cs["longitude"].to_numpy()
+
+        df_cp = df_cp[df_cp["id_cs"].isin(self._idx_cs)].drop_duplicates("id")
+        self.ids_cp = df_cp["id"].astype(str).tolist()
+        self._idx_cp = {id_cp: idx for idx, id_cp in enumerate(self.ids_cp)}
+        self._cs_of_cp = df_cp["id_cs"].map(self._idx_cs).to_numpy(dtype=np.int64)
+        self._cps_of_cs = [[] for _ in range(len(self._idx_cs))]
+        for idx_cp, idx_cs in enumerate(self._cs_of_cp):
+            self._cps_of_cs[idx_cs].append(idx_cp)
+        self._n_cps = np.bincount(self._cs_of_cp, minlength=len(self._idx_cs))
+
+        self.available_statuses = set(available_statuses)
+        self._status = [None] * len(self.ids_cp)
+        self._timestamp = np.full(len(self.ids_cp), -1, dtype=np.int64)
+        self._n_available = np.zeros(len(self._idx_cs), dtype=np.int64)
+        self._lock = threading.RLock()
+        self.last_update = None
+        logger.info(f"Indexed {len(self._idx_cs)} charging stations with {len(self.ids_cp)} charging points.")
+
+    def update(self, ids: typing.Iterable[str], statuses: typing.Iterable[str], timestamps: typing.Iterable[int]) -> int:
+        """Set status of charging points, records older than the current status of a charging point are ignored
+
+        Args:
+            ids (typing.Iterable[str]): ids of charging points
+            statuses (typing.Iterable[str]): statuses
+            timestamps (typing.Iterable[int]): time of statuses in epoch seconds
+
+        Returns:
+            int: number of charging points whose status changed
+        """
+        n_changed = 0
+        with self._lock:
+            for id_cp, status, ts in zip(ids, statuses, timestamps):
+                idx = self._idx_cp.get(id_cp)
+                if idx is None or ts < self._timestamp[idx]:
+                    continue
+                self._timestamp[idx] = ts
+                old = self._status[idx]
+                if old == status:
+                    continue
+                self._status[idx] = status
+                delta = (status in self.available_statuses) - (old in self.available_statuses)
+                self._n_available[self._cs_of_cp[idx]] += delta
+                n_changed += 1
+            self.last_update = datetime.datetime.now(tz=datetime.timezone.utc)
+        return n_changed
+
+    def _station(self, idx_cs: int, distance: float = None, with_cps: bool = False) -> dict:
+        station = {**self._station_records[idx_cs],
+                   "n_cps": int(self._n_cps[idx_cs]),
+                   "n_available": int(self._n_available[idx_cs])}
+        if distance is not None:
+            station["distance_m"] = round(float(distance), 1)
+        if with_cps:
+            station["charging_points"] = [self._charging_point(idx_cp) for idx_cp in self._cps_of_cs[idx_cs]]
+        return station
+
+    def _charging_point(self, idx_cp: int) -> dict:
+        return {"id": self.ids_cp[idx_cp],
+                "status": self._status[idx_cp],
+                "timestamp": _format_timestamp(self._timestamp[idx_cp])}
+
+    def charging_point(self, id_cp: str) -> typing.Optional[dict]:
+        """Latest status of a charging point, None if it is unknown"""
+        idx = self._idx_cp.get(id_cp)
+        if idx is None:
+            return None
+        with self._lock:
+            return self._charging_point(idx)
+
+    def station(self, id_cs) -> typing.Optional[dict]:
+        """Charging station with latest status of its charging points, None if it is unknown"""
+        idx = self._idx_cs.get(id_cs)
+        if idx is None:
+            return None
+        with self._lock:
+            return self._station(idx, with_cps=True)
+
+    def nearest(self,
+                latitude: float,
+                longitude: float,
+                k: int = DEFAULT_K,
+                available: bool = True,
+                max_distance: float = None) -> typing.List[dict]:
+        """Nearest charging stations to a location
+
+        Args:
+            latitude (float): latitude of location
+            longitude (float): longitude of location
+            k (int, optional): number of charging stations. Defaults to DEFAULT_K.
+            available (bool, optional): whether to only return stations with an available charging point. Defaults to True.
+            max_distance (float, optional): maximum distance in metres. Defaults to None.
+
+        Returns:
+            typing.List[dict]: charging stations ordered by distance
+        """
+        n_stations = len(self._idx_cs)
+        k = min(k, n_stations)
+        if k <= 0:
+            return []
+        point = _to_unit_vectors(np.array([latitude]), np.array([longitude]))[0]
+        upper_bound = 2 * np.sin(max_distance / (2 * EARTH_RADIUS)) if max_distance is not None else np.inf
+        # stations are looked up in growing batches until k stations with an available charging point are found
+        n_query = k if not available else min(4 * k, n_stations)
+        with self._lock:
+            while True:
+                chords, idx = self._tree.query(point, k=n_query, distance_upper_bound=upper_bound)
+                chords, idx = np.atleast_1d(chords), np.atleast_1d(idx)
+                found = idx < n_stations
+                chords, idx = chords[found], idx[found]
+                if available:
+                    is_available = self._n_available[idx] > 0
+                    chords, idx = chords[is_available], idx[is_available]
+                if idx.size >= k or n_query >= n_stations or found.sum() < n_query:
+                    break
+                n_query = min(4 * n_query, n_stations)
+            return [self._station(i, distance=d) for i, d in zip(idx[:k], _chord_to_metres(chords[:k]))]
+
+    def bbox(self,
+             lat_min: float,
+             lat_max: float,
+             lon_min: float,
+             lon_max: float,
+             available: bool = False) -> typing.List[dict]:
+        """Charging stations within a bounding box
+
+        Args:
+            lat_min (float): minimum latitude
+            lat_max (float): maximum latitude
+            lon_min (float): minimum longitude
+            lon_max (float): maximum longitude
+            available (bool, optional): whether to only return stations with an available charging point. Defaults to False.
+
+        Returns:
+            typing.List[dict]: charging stations ordered by latitude
+        """
+        i_start = np.searchsorted(self._lat_sorted, lat_min, side="left")
+        i_end = np.searchsorted(self._lat_sorted, lat_max, side="right")
+        idx = self._order_lat[i_start:i_end]
+        idx = idx[(self._lon[idx] >= lon_min) & (self._lon[idx] <= lon_max)]
+        with self._lock:
+            if available:
+                idx = idx[self._n_available[idx] > 0]
+            return [self._station(i) for i in idx]
+
+    def summary(self) -> dict:
+        with self._lock:
+            n_known = int((self._timestamp >= 0).sum())
+            return {"n_stations": len(self._idx_cs),
+                    "n_cps": len(self.ids_cp),
+                    "n_cps_known": n_known,
+                    "n_cps_available": int(self._n_available.sum()),
+                    "last_status": _format_timestamp(int(self._timestamp.max())) if n_known else None,
+                    "last_update": self.last_update.isoformat() if self.last_update else None}
+
+
+class StatusLogFollower:
+    """Feeds new records of the binary status log appended by the scraper into a LatestStatusIndex
+
+    Only records appended since the last poll are read, starting from the byte offset of the previous poll. The status
+    logs of partitioned scraper nodes in directories 'node=<node_id>' of dir_log are followed as well, with an offset
+    per log.
+
+    Args:
+        index (LatestStatusIndex): index to update
+        dir_log (str, optional): directory of status log. Defaults to DIR_STATUS_LOG.
+        seed_window (float, optional): seconds of records before the last record read on the first poll of a log. Defaults to SEED_WINDOW.
+    """
+
+    def __init__(self, index: LatestStatusIndex, dir_log: str = DIR_STATUS_LOG, seed_window: float = SEED_WINDOW):
+        self.index = index
+        self.dir_log = dir_log
+        self.seed_window = seed_window
+        # byte offset and id dictionary per directory of a status log
+        self._offsets: typing.Dict[str, int] = {}
+        self._dictionaries: typing.Dict[str, typing.Dict[str, typing.List[str]]] = {}
+
+    def _decode(self, records: np.ndarray, dir_log: str) -> int:
+        if records.shape[0] == 0:
+            return 0
+        # codes are appended to the dictionary before records using them are written
+        dictionary = self._dictionaries.get(dir_log)
+        if (dictionary is None
+                or records["id_cp"].max() >= len(dictionary["id_cp"])
+                or records["status"].max() >= len(dictionary["status"])):
+            dictionary = self._dictionaries[dir_log] = _read_dictionary(dir_log)
+        # records are ordered by time, only the last record of every charging point is applied
+        _, idx_last_reversed = np.unique(records["id_cp"][::-1], return_index=True)
+        records = records[records.shape[0] - 1 - idx_last_reversed]
+        ids = np.asarray(dictionary["id_cp"], dtype=object)[records["id_cp"]]
+        statuses = np.asarray(dictionary["status"], dtype=object)[records["status"]]
+        return self.index.update(ids, statuses, records["timestamp"].tolist())
+
+    def _poll_log(self, dir_log: str) -> int:
+        fullpath_log = os.path.join(dir_log, FNAME_STATUS_LOG)
+        if not os.path.exists(fullpath_log):
+            return 0
+        if dir_log not in self._offsets:
+            log = read_status_log(dir_log)
+            if log.shape[0] == 0:
+                return 0
+            idx_seed = np.searchsorted(log["timestamp"], log["timestamp"][-1] - self.seed_window, side="left")
+            self._offsets[dir_log] = log.shape[0] * RECORD_DTYPE.itemsize
+            return self._decode(np.array(log[idx_seed:]), dir_log)
+
+        # trailing partial record of a write in progress is read by the next poll
+        n_records = (os.path.getsize(fullpath_log) - self._offsets[dir_log]) // RECORD_DTYPE.itemsize
+        if n_records <= 0:
+            return 0
+        with open(fullpath_log, 'rb') as f:
+            f.seek(self._offsets[dir_log])
+            records = np.fromfile(f, dtype=RECORD_DTYPE, count=n_records)
+        self._offsets[dir_log] += records.shape[0] * RECORD_DTYPE.itemsize
+        return self._decode(records, dir_log)
+
+    def poll(self) -> int:
+        """Read records appended to the status log and the logs of scraper nodes since the last poll
+
+        Returns:
+            int: number of charging points whose status changed
+        """
+        # logs of nodes started after the last poll are picked up as well, records older than the status of a
+        # charging point in the index are ignored by the index
+        dirs_log = [self.dir_log] + sorted(glob.glob(os.path.join(self.dir_log, PATTERN_NODE_LOGS)))
+        return sum(self._poll_log(dir_log) for dir_log in dirs_log)
+
+    def run(self, stop: threading.Event, poll_interval: float = LATEST_STATUS_POLL_INTERVAL):
+        """Poll the status log until stop is set"""
+        while not stop.is_set():
+            try:
+                n_changed = self.poll()
+                if n_changed:
+                    logger.debug(f"Status of {n_changed} charging points changed.")
+            except Exception:
+                logger.exception("Error occurred while reading status log.")
+            stop.wait(poll_interval)
+
+
+def _parse_float(params: dict, name: str, default: float = None) -> float:
+    if name not in params:
+        if default is None:
+            raise ValueError(f"Missing query parameter '{name}'.")
+        return default
+    return float(params[name][0])
+
+
+def _parse_bool(params: dict, name: str, default: bool) -> bool:
+    if name not in params:
+        return default
+    return params[name][0].lower() in ("1", "true", "yes")
+
+
+class LatestStatusHandler(BaseHTTPRequestHandler):
+    """JSON API of a LatestStatusIndex, set as attribute `index` of the server
+
+    Endpoints:
+        GET /health: summary of the index
+        GET /charging_points/<id>: latest status of a charging point
+        GET /stations/<id_cs>: charging station with latest status of its charging points
+        GET /nearest?lat=..&lon=..[&k=5][&available=1][&max_distance=..]: nearest charging stations
+        GET /bbox?lat_min=..&lat_max=..&lon_min=..&lon_max=..[&available=0]: charging stations within bounding box
+    """
+
+    def _send_json(self, payload, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        index: LatestStatusIndex = self.server.index
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        parts = [unquote(part) for part in url.path.split("/") if part]
+        try:
+            if parts == ["health"]:
+                return self._send_json(index.summary())
+            if len(parts) == 2 and parts[0] == "charging_points":
+                result = index.charging_point(parts[1])
+            elif len(parts) == 2 and parts[0] == "stations":
+                result = index.station(int(parts[1]) if parts[1].isdigit() else parts[1])
+            elif parts == ["nearest"]:
+                k = min(int(_parse_float(params, "k", DEFAULT_K)), MAX_K)
+                max_distance = _parse_float(params, "max_distance") if "max_distance" in params else None
+                result = index.nearest(_parse_float(params, "lat"),
+                                       _parse_float(params, "lon"),
+                                       k=k,
+                                       available=_parse_bool(params, "available", True),
+                                       max_distance=max_distance)
+            elif parts == ["bbox"]:
+                result = index.bbox(*(_parse_float(params, name) for name in ["lat_min", "lat_max", "lon_min", "lon_max"]),
+                                    available=_parse_bool(params, "available", False))
+            else:
+                return self._send_json({"error": f"Unknown endpoint '{url.path}'."}, status=404)
+        except ValueError as e:
+            return self._send_json({"error": str(e)}, status=400)
+        if result is None:
+            return self._send_json({"error": f"'{parts[1]}' not found."}, status=404)
+        self._send_json(result)
+
+    def log_message(self, format: str, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def build_index(dir_master_data: str = DIR_DATA) -> LatestStatusIndex:
+    """Build index from charging_stations.csv and charging_points.csv"""
+    df_cs = pd.read_csv(os.path.join(dir_master_data, "charging_stations.csv"), sep=";",
+                        usecols=["id", "name", "city", "latitude", "longitude"])
+    df_cp = pd.read_csv(os.path.join(dir_master_data, "charging_points.csv"), sep=";", usecols=["id", "id_cs"])
+    return LatestStatusIndex(df_cs, df_cp)
+
+
+def serve(index: LatestStatusIndex,
+          host: str = LATEST_STATUS_HOST,
+          port: int = LATEST_STATUS_PORT,
+          dir_status_log: str = DIR_STATUS_LOG,
+          poll_interval: float = LATEST_STATUS_POLL_INTERVAL):
+    """Serve the JSON API of the index and keep it up to date with the status log until interrupted
+
+    Args:
+        index (LatestStatusIndex): index to serve
+        host (str, optional): host to bind to. Defaults to LATEST_STATUS_HOST.
+        port (int, optional): port to bind to. Defaults to LATEST_STATUS_PORT.
+        dir_status_log (str, optional): directory of status log written by the scraper, None to not follow it. Defaults to DIR_STATUS_LOG.
+        poll_interval (float, optional): seconds between polls of the status log. Defaults to LATEST_STATUS_POLL_INTERVAL.
+    """
+    stop = threading.Event()
+    if dir_status_log is not None:
+        follower = StatusLogFollower(index, dir_log=dir_status_log)
+        follower.poll()
+        threading.Thread(target=follower.run, args=(stop, poll_interval), name="status-log-follower", daemon=True).start()
+
+    server = ThreadingHTTPServer((host, port), LatestStatusHandler)
+    server.daemon_threads = True
+    server.index = index
+    logger.info(f"Serving latest status of {len(index.ids_cp)} charging points on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping latest status API.")
+    finally:
+        stop.set()
+        server.server_close()
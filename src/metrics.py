@@ -0,0 +1,255 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import defaultdict
+import contextlib
+import functools
+import datetime
+import logging
+import threading
+import tracemalloc
+import typing
+import json
+import time
+import re
+
+from settings import PROMETHEUS_PORT
+
+logger = logging.getLogger(__name__)
+
+
+PROMETHEUS_PREFIX = "chargingdata_"
+
+
+class Timer:
+    """Measurement of a single timed block. Set `rows` inside the block to record throughput."""
+
+    def __init__(self, name: str, labels: dict, track_memory: bool = False):
+        self.name = name
+        self.labels = labels
+        self.track_memory = track_memory
+        self.rows = None
+        self.seconds = None
+        self.peak_memory_bytes = None
+
+    def to_dict(self) -> dict:
+        event = {"name": self.name, "type": "timer", "labels": self.labels, "seconds": round(self.seconds, 6)}
+        if self.rows is not None and self.rows >= 0:
+            event["rows"] = int(self.rows)
+            event["rows_per_second"] = round(self.rows / self.seconds, 1) if self.seconds > 0 else None
+        if self.peak_memory_bytes is not None:
+            event["peak_memory_bytes"] = int(self.peak_memory_bytes)
+        return event
+
+
+class MetricsRegistry:
+    """Thread-safe registry of timers, counters and gauges
+
+    Every measurement is appended as JSON line to the metrics file if configured and aggregated in memory for
+    rendering in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file = None
+        self._timers = defaultdict(lambda: {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "rows": 0})
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._memory = threading.local()
+        self._tracemalloc_started = False
+
+    def configure(self, path_jsonl: str = None):
+        """Set file metrics are appended to as JSON lines
+
+        Args:
+            path_jsonl (str, optional): path of metrics file. If None, metrics are only kept in memory. Defaults to None.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(path_jsonl, 'a', encoding='utf-8') if path_jsonl is not None else None
+
+    def _emit(self, event: dict):
+        if self._file is None:
+            return
+        event = {"timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(), **event}
+        with self._lock:
+            self._file.write(json.dumps(event) + "\n")
+            self._file.flush()
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return (name, tuple(sorted(labels.items())))
+
+    def _memory_stack(self) -> list:
+        if not hasattr(self._memory, "stack"):
+            self._memory.stack = []
+        return self._memory.stack
+
+    def _start_memory(self, t: Timer):
+        stack = self._memory_stack()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracemalloc_started = True
+        elif stack:
+            # peak of enclosing block up to here, the peak is reset for the nested block
+            stack[-1].peak_memory_bytes = max(stack[-1].peak_memory_bytes, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        t.peak_memory_bytes = 0
+        stack.append(t)
+
+    def _stop_memory(self, t: Timer):
+        stack = self._memory_stack()
+        t.peak_memory_bytes = max(t.peak_memory_bytes, tracemalloc.get_traced_memory()[1])
+        stack.pop()
+        if stack:
+            stack[-1].peak_memory_bytes = max(stack[-1].peak_memory_bytes, t.peak_memory_bytes)
+            tracemalloc.reset_peak()
+        elif self._tracemalloc_started:
+            tracemalloc.stop()
+            self._tracemalloc_started = False
+
+    @contextlib.contextmanager
+    def timer(self, name: str, track_memory: bool = False, **labels) -> typing.Iterator[Timer]:
+        """Time a block of code
+
+        Args:
+            name (str): name of metric, e.g. 'scrape_city'
+            track_memory (bool, optional): whether to record peak traced memory of the block with tracemalloc, which slows down allocations. Defaults to False.
+            **labels: labels of metric, e.g. city='koeln'
+
+        Yields:
+            typing.Iterator[Timer]: measurement, set attribute `rows` to record throughput
+        """
+        t = Timer(name, labels, track_memory=track_memory)
+        if track_memory:
+            self._start_memory(t)
+        t_start = time.perf_counter()
+        try:
+            yield t
+        finally:
+            t.seconds = time.perf_counter() - t_start
+            if track_memory:
+                self._stop_memory(t)
+            with self._lock:
+                agg = self._timers[self._key(name, labels)]
+                agg["count"] += 1
+                agg["seconds"] += t.seconds
+                agg["max_seconds"] = max(agg["max_seconds"], t.seconds)
+                agg["rows"] += max(t.rows or 0, 0)
+            self._emit(t.to_dict())
+
+    def timed(self, name: str = None, track_memory: bool = False, **labels) -> typing.Callable:
+        """Decorator timing every call of a function
+
+        Args:
+            name (str, optional): name of metric. Defaults to name of function.
+            track_memory (bool, optional): whether to record peak traced memory. Defaults to False.
+            **labels: labels of metric
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name or func.__name__, track_memory=track_memory, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name: str, value: float = 1, **labels):
+        """Increase counter, e.g. number of bytes or errors"""
+        with self._lock:
+            self._counters[self._key(name, labels)] += value
+        self._emit({"name": name, "type": "counter", "labels": labels, "value": value})
+
+    def gauge(self, name: str, value: float, **labels):
+        """Set gauge to current value"""
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+        self._emit({"name": name, "type": "gauge", "labels": labels, "value": value})
+
+    def summary(self, top_n: int = None) -> typing.List[dict]:
+        """Aggregated timers sorted by total time, slowest first
+
+        Args:
+            top_n (int, optional): number of timers to return. If not specified all timers are returned. Defaults to None.
+
+        Returns:
+            typing.List[dict]: aggregated timers with name, labels, count, seconds, max_seconds and rows
+        """
+        with self._lock:
+            timers = [{"name": name, "labels": dict(labels), **agg} for (name, labels), agg in self._timers.items()]
+        return sorted(timers, key=lambda t: t["seconds"], reverse=True)[:top_n]
+
+    def log_summary(self, top_n: int = 10):
+        """Log slowest timers"""
+        for t in self.summary(top_n):
+            labels = ",".join(f"{k}={v}" for k, v in t["labels"].items())
+            logger.info(f"{t['name']}[{labels}]: {t['seconds']:.2f}s total, {t['count']} calls, max {t['max_seconds']:.2f}s")
+
+    def render_prometheus(self, prefix: str = PROMETHEUS_PREFIX) -> str:
+        """Render aggregated metrics in the Prometheus text exposition format
+
+        Args:
+            prefix (str, optional): prefix of metric names. Defaults to PROMETHEUS_PREFIX.
+
+        Returns:
+            str: metrics in Prometheus text format
+        """
+        def fmt(name, labels, value):
+            name = prefix + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+            str_labels = ",".join(f'{k}="{str(v)}"' for k, v in labels)
+            return f"{name}{{{str_labels}}} {value}" if str_labels else f"{name} {value}"
+
+        lines = []
+        with self._lock:
+            for (name, labels), agg in sorted(self._timers.items()):
+                lines.append(fmt(name + "_seconds_total", labels, agg["seconds"]))
+                lines.append(fmt(name + "_count", labels, agg["count"]))
+                lines.append(fmt(name + "_seconds_max", labels, agg["max_seconds"]))
+                if agg["rows"]:
+                    lines.append(fmt(name + "_rows_total", labels, agg["rows"]))
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(fmt(name + "_total", labels, value))
+            for (name, labels), value in sorted(self._gauges.items()):
+                lines.append(fmt(name, labels, value))
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port: int = PROMETHEUS_PORT, host: str = "") -> ThreadingHTTPServer:
+        """Serve metrics in the Prometheus text format on '/metrics' in a daemon thread
+
+        Args:
+            port (int, optional): port of HTTP server. Defaults to PROMETHEUS_PORT.
+            host (str, optional): host of HTTP server. Defaults to all interfaces.
+
+        Returns:
+            ThreadingHTTPServer: running server, stop it with `shutdown()`
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on port {port}.")
+        return server
+
+
+METRICS = MetricsRegistry()
+
+configure = METRICS.configure
+timer = METRICS.timer
+timed = METRICS.timed
+count = METRICS.count
+gauge = METRICS.gauge
+serve_prometheus = METRICS.serve_prometheus
@@ -0,0 +1,387 @@
+import bisect
+import datetime
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import typing
+
+from settings import DIR_SAVE_API_RESULTS, DIR_MERGED_API_RESULTS, FNAME_LEASE_DB, MERGE_MIN_AGE
+import metrics
+from get_chargecloud_data import (CITIES_CC,
+                                  FMT_QUERY_TIME,
+                                  KEY_SCRAPE_STATUS,
+                                  KEY_UNCHANGED,
+                                  _get_api_results_path,
+                                  _get_shard_dir,
+                                  _save_api_results)
+
+if typing.TYPE_CHECKING:
+    from transitions import TransitionTracker
+
+logger = logging.getLogger(__name__)
+
+
+# virtual nodes per scraper node on the hash ring, more virtual nodes spread cities more evenly
+VNODES = 64
+# nodes without heartbeat for this number of intervals are removed from the hash ring
+NODE_TIMEOUT_TICKS = 3
+# share of the interval after which cities not claimed by their node are claimed by any node
+STEAL_AFTER = 0.3
+# seconds leases of merged ticks are kept, claims of merged ticks are rejected in the meantime
+LEASE_RETENTION = 86400
+
+
+def _hash(key: str) -> int:
+    """Position of a key on the hash ring, stable across processes unlike `hash`"""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of cities to scraper nodes. Adding or removing a node only moves the cities of its
+    neighbours on the ring.
+
+    Args:
+        nodes (typing.Iterable[str]): ids of nodes
+        vnodes (int, optional): virtual nodes per node. Defaults to VNODES.
+    """
+
+    def __init__(self, nodes: typing.Iterable[str], vnodes: int = VNODES):
+        ring = sorted((_hash(f"{node}#{i}"), node) for node in set(nodes) for i in range(vnodes))
+        if not ring:
+            raise ValueError("Hash ring requires at least one node.")
+        self._positions = [position for position, _ in ring]
+        self._nodes = [node for _, node in ring]
+
+    def node(self, key: str) -> str:
+        """Node a key is assigned to, i.e. first virtual node clockwise of the key"""
+        idx = bisect.bisect(self._positions, _hash(key)) % len(self._positions)
+        return self._nodes[idx]
+
+    def partition(self, keys: typing.Iterable[str]) -> typing.Dict[str, typing.List[str]]:
+        """Keys per node"""
+        partitions = {}
+        for key in keys:
+            partitions.setdefault(self.node(key), []).append(key)
+        return partitions
+
+
+class LeaseTable:
+    """Leases of cities per tick and heartbeats of scraper nodes in a SQLite database shared by all nodes, e.g. on a
+    network file system. The primary key (tick, city) makes the first node inserting a lease the only owner of a city
+    within a tick.
+
+    Args:
+        path (str, optional): path of database. Defaults to FNAME_LEASE_DB in DIR_SAVE_API_RESULTS.
+        timeout (float, optional): seconds to wait for locks held by other nodes. Defaults to 30.
+    """
+
+    def __init__(self, path: str = os.path.join(DIR_SAVE_API_RESULTS, FNAME_LEASE_DB), timeout: float = 30):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS node (node TEXT PRIMARY KEY,
+                                                                   last_seen REAL NOT NULL)""")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS city_lease (tick INTEGER NOT NULL,
+                                                                         city TEXT NOT NULL,
+                                                                         node TEXT NOT NULL,
+                                                                         query_time TEXT NOT NULL,
+                                                                         claimed_at REAL NOT NULL,
+                                                                         tick_end REAL NOT NULL,
+                                                                         PRIMARY KEY (tick, city))""")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS merged_tick (tick INTEGER PRIMARY KEY,
+                                                                          query_time TEXT NOT NULL,
+                                                                          path TEXT NOT NULL,
+                                                                          n_missing INTEGER NOT NULL,
+                                                                          merged_at REAL NOT NULL)""")
+
+    def heartbeat(self, node: str, now: float = None):
+        """Record that a node is alive"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO node VALUES (?, ?)", (node, now or time.time()))
+
+    def live_nodes(self, max_age: float, now: float = None) -> typing.List[str]:
+        """Nodes with a heartbeat within the last max_age seconds"""
+        with self._lock:
+            rows = self._conn.execute("SELECT node FROM node WHERE last_seen >= ? ORDER BY node",
+                                      ((now or time.time()) - max_age,)).fetchall()
+        return [node for node, in rows]
+
+    def claim(self,
+              tick: int,
+              query_time: str,
+              cities: typing.List[str],
+              node: str,
+              tick_end: float) -> typing.List[str]:
+        """Claim cities of a tick for a node. Cities already claimed by another node are left to it, cities of merged
+        ticks are not claimed.
+
+        Args:
+            tick (int): index of tick
+            query_time (str): query time of tick formatted as FMT_QUERY_TIME
+            cities (typing.List[str]): cities to claim
+            node (str): id of claiming node
+            tick_end (float): unix time of end of tick, by which all cities of the tick are scraped
+
+        Returns:
+            typing.List[str]: cities of a tick owned by the node, including cities claimed before
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("""INSERT OR IGNORE INTO city_lease
+                                      SELECT ?, ?, ?, ?, ?, ?
+                                      WHERE NOT EXISTS (SELECT 1 FROM merged_tick WHERE tick = ?)""",
+                                   [(tick, city, node, query_time, now, tick_end, tick) for city in cities])
+            rows = self._conn.execute("SELECT city FROM city_lease WHERE tick = ? AND node = ?", (tick, node)).fetchall()
+        owned = {city for city, in rows}
+        return [city for city in cities if city in owned]
+
+    def claims(self, tick: int) -> typing.Dict[str, str]:
+        """Owning node per claimed city of a tick"""
+        with self._lock:
+            rows = self._conn.execute("SELECT city, node FROM city_lease WHERE tick = ?", (tick,)).fetchall()
+        return dict(rows)
+
+    def unmerged_ticks(self, ended_before: float) -> typing.List[typing.Tuple[int, str]]:
+        """Ticks and their query times which ended before a point in time and are not merged yet"""
+        with self._lock:
+            rows = self._conn.execute("""SELECT tick, min(query_time) FROM city_lease
+                                         WHERE tick NOT IN (SELECT tick FROM merged_tick)
+                                         GROUP BY tick HAVING max(tick_end) < ?
+                                         ORDER BY tick""", (ended_before,)).fetchall()
+        return rows
+
+    def is_merged(self, tick: int) -> bool:
+        """Whether the shards of a tick are merged"""
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM merged_tick WHERE tick = ?", (tick,)).fetchone()
+        return row is not None
+
+    def mark_merged(self, tick: int, query_time: str, path: str, n_missing: int, retention: float = LEASE_RETENTION):
+        """Record merged snapshot of a tick. Leases of the tick are kept for retention seconds, so no node claims its
+        cities again, leases of ticks merged before are removed."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO merged_tick VALUES (?, ?, ?, ?, ?)",
+                               (tick, query_time, path, n_missing, now))
+            self._conn.execute("""DELETE FROM city_lease
+                                  WHERE tick IN (SELECT tick FROM merged_tick WHERE merged_at < ?)""",
+                               (now - retention,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CityPartitioner:
+    """Splits the cities of every tick between scraper nodes sharing a lease table
+
+    Ticks are aligned to the wall clock, so all nodes agree on the index and query time of a tick. At the start of a
+    tick every node claims the cities the hash ring of live nodes assigns to it. Cities left unclaimed, e.g. by a
+    node that stopped, are claimed by any node after STEAL_AFTER of the interval. Leases guarantee that every city
+    is scraped by at most one node per tick.
+
+    Args:
+        node_id (str): id of this node
+        lease_table (LeaseTable): lease table shared by all nodes
+        interval (float): scraping interval in seconds
+        vnodes (int, optional): virtual nodes per node on the hash ring. Defaults to VNODES.
+        node_timeout (int, optional): number of intervals without heartbeat after which a node is considered stopped. Defaults to NODE_TIMEOUT_TICKS.
+        steal_after (float, optional): share of the interval after which unclaimed cities are claimed by any node. Defaults to STEAL_AFTER.
+    """
+
+    def __init__(self,
+                 node_id: str,
+                 lease_table: LeaseTable,
+                 interval: float,
+                 vnodes: int = VNODES,
+                 node_timeout: int = NODE_TIMEOUT_TICKS,
+                 steal_after: float = STEAL_AFTER):
+        self.node_id = node_id
+        self.lease_table = lease_table
+        self.interval = interval
+        self.vnodes = vnodes
+        self.node_timeout = node_timeout
+        self.steal_after = steal_after
+
+    def tick_of(self, t: float = None) -> int:
+        """Index of tick containing a unix time"""
+        return int((time.time() if t is None else t) // self.interval)
+
+    def tick_start(self, tick: int) -> float:
+        """Unix time of start of a tick"""
+        return tick * self.interval
+
+    def query_time(self, tick: int) -> str:
+        """Query time of a tick in local time, shared by the shards of all nodes"""
+        return datetime.datetime.fromtimestamp(self.tick_start(tick)).strftime(FMT_QUERY_TIME)
+
+    def claim_assigned(self, tick: int, cities: typing.List[str]) -> typing.List[str]:
+        """Send heartbeat and claim the cities assigned to this node by the hash ring of live nodes
+
+        Args:
+            tick (int): index of tick
+            cities (typing.List[str]): all cities to scrape
+
+        Returns:
+            typing.List[str]: cities owned by this node
+        """
+        self.lease_table.heartbeat(self.node_id)
+        nodes = set(self.lease_table.live_nodes(self.node_timeout * self.interval)) | {self.node_id}
+        assigned = HashRing(nodes, vnodes=self.vnodes).partition(cities).get(self.node_id, [])
+        owned = self.lease_table.claim(tick, self.query_time(tick), assigned, node=self.node_id,
+                                       tick_end=self.tick_start(tick + 1))
+        logger.debug(f"Node '{self.node_id}' claimed {len(owned)} of {len(assigned)} assigned cities of tick {tick} "
+                     f"({len(nodes)} live nodes).")
+        return owned
+
+    def claim_unclaimed(self, tick: int, cities: typing.List[str], owned: typing.List[str] = None) -> typing.List[str]:
+        """Claim cities of a tick no node has claimed yet
+
+        Args:
+            tick (int): index of tick
+            cities (typing.List[str]): all cities to scrape
+            owned (typing.List[str], optional): cities already owned by this node, which are not returned again. Defaults to None.
+
+        Returns:
+            typing.List[str]: newly claimed cities
+        """
+        if self.lease_table.is_merged(tick):
+            logger.warning(f"Tick {tick} is already merged, no unclaimed cities are claimed.")
+            return []
+        claims = self.lease_table.claims(tick)
+        unclaimed = [city for city in cities if city not in claims]
+        if not unclaimed:
+            return []
+        _owned = set(owned or [])
+        stolen = [city for city in self.lease_table.claim(tick, self.query_time(tick), unclaimed, node=self.node_id,
+                                                          tick_end=self.tick_start(tick + 1))
+                  if city not in _owned]
+        if stolen:
+            metrics.count("cities_stolen", len(stolen))
+            logger.info(f"Node '{self.node_id}' claimed {len(stolen)} unclaimed cities of tick {tick}: {stolen}")
+        return stolen
+
+
+def _load_shard(path: str) -> dict:
+    if path.endswith(".json"):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def merge_tick(query_time: str,
+               cities: typing.List[str],
+               claims: typing.Dict[str, str],
+               dir_shards: str = DIR_SAVE_API_RESULTS,
+               dir_merged: str = DIR_MERGED_API_RESULTS,
+               save_raw: bool = True,
+               transition_tracker: "TransitionTracker" = None) -> typing.Tuple[str, int]:
+    """Assemble the city shards of one tick into a single snapshot, as written by a single scraper
+
+    Markers of unchanged cities are kept and their references rewritten relative to dir_merged. Cities without shard
+    are recorded as failed in the scrape status of the snapshot.
+
+    Args:
+        query_time (str): query time of tick formatted as FMT_QUERY_TIME
+        cities (typing.List[str]): cities expected in every tick
+        claims (typing.Dict[str, str]): owning node per claimed city
+        dir_shards (str, optional): directory of API results sharded by city. Defaults to DIR_SAVE_API_RESULTS.
+        dir_merged (str, optional): directory to save snapshot to. Defaults to DIR_MERGED_API_RESULTS.
+        save_raw (bool, optional): whether shards and snapshot are raw json (True) or pickle files (False). Defaults to True.
+        transition_tracker (TransitionTracker, optional): tracker emitting status transitions of the snapshot to its sinks. Defaults to None.
+
+    Returns:
+        typing.Tuple[str, int]: path of snapshot, number of cities without shard
+    """
+    data = {}
+    data_transitions = {}
+    scrape_status = {}
+    n_missing = 0
+    for city in list(cities) + sorted(set(claims) - set(cities)):
+        dir_shard = _get_shard_dir(dir_shards, city=city, query_time=query_time)
+        path_shard = _get_api_results_path(dir_shard, query_time=query_time, save_raw=save_raw)
+        if not os.path.exists(path_shard):
+            error = f"shard of node '{claims[city]}' missing" if city in claims else "not claimed by any node"
+            scrape_status[city] = {"ok": False, "attempts": 0, "error": error, "node": claims.get(city)}
+            n_missing += 1
+            continue
+
+        shard = _load_shard(path_shard)
+        scrape_status[city] = {**shard[KEY_SCRAPE_STATUS][city], "node": claims.get(city)}
+        if city not in shard:
+            continue
+        result = shard[city]
+        data_transitions[city] = result
+        if result.get(KEY_UNCHANGED):
+            fullpath_ref = os.path.normpath(os.path.join(dir_shard, result["ref"]))
+            result = {**result, "ref": os.path.relpath(fullpath_ref, dir_merged)}
+            if transition_tracker is not None:
+                # a marker is unchanged since the last full API result of the node, not since the previous tick, as
+                # cities move between nodes
+                shard_ref = _load_shard(fullpath_ref) if os.path.exists(fullpath_ref) else {}
+                if city in shard_ref:
+                    data_transitions[city] = {**shard_ref[city], "timestamp": result["timestamp"]}
+                else:
+                    logger.warning(f"Full API result of unchanged city '{city}' referenced by '{path_shard}' not found.")
+                    del data_transitions[city]
+        data[city] = result
+
+    if transition_tracker is not None:
+        transition_tracker.update(data_transitions)
+    data[KEY_SCRAPE_STATUS] = scrape_status
+    path_merged = _save_api_results(data, dir_save=dir_merged, query_time=query_time, save_raw=save_raw)
+    return path_merged, n_missing
+
+
+def merge_ticks(lease_table: LeaseTable,
+                cities: typing.List[str] = CITIES_CC,
+                dir_shards: str = DIR_SAVE_API_RESULTS,
+                dir_merged: str = DIR_MERGED_API_RESULTS,
+                save_raw: bool = True,
+                min_age: float = MERGE_MIN_AGE,
+                transition_tracker: "TransitionTracker" = None) -> typing.List[str]:
+    """Merge the city shards of all ticks, which ended at least min_age ago, into one snapshot per tick. Nodes scrape
+    the cities of a tick, including cities claimed from other nodes, before the tick ends. The
+    snapshots can be preprocessed like API results of a single scraper.
+
+    Status transitions are derived from the merged snapshots in the order of the ticks, so a city moving between
+    nodes does not lose or invent transitions.
+
+    Args:
+        lease_table (LeaseTable): lease table shared by the scraper nodes
+        cities (typing.List[str], optional): cities expected in every tick. Defaults to CITIES_CC.
+        dir_shards (str, optional): directory of API results sharded by city. Defaults to DIR_SAVE_API_RESULTS.
+        dir_merged (str, optional): directory to save snapshots to. Defaults to DIR_MERGED_API_RESULTS.
+        save_raw (bool, optional): whether shards and snapshots are raw json (True) or pickle files (False). Defaults to True.
+        min_age (float, optional): seconds after the end of a tick until its shards are expected to be written. Defaults to MERGE_MIN_AGE.
+        transition_tracker (TransitionTracker, optional): tracker emitting status transitions of charging points and connectors to its sinks once per tick. Defaults to None.
+
+    Returns:
+        typing.List[str]: paths of merged snapshots
+    """
+    paths = []
+    for tick, query_time in lease_table.unmerged_ticks(ended_before=time.time() - min_age):
+        with metrics.timer("merge_tick") as t:
+            path, n_missing = merge_tick(query_time,
+                                         cities=cities,
+                                         claims=lease_table.claims(tick),
+                                         dir_shards=dir_shards,
+                                         dir_merged=dir_merged,
+                                         save_raw=save_raw,
+                                         transition_tracker=transition_tracker)
+            t.rows = len(cities)
+        if n_missing:
+            metrics.count("merge_missing_cities", n_missing)
+            logger.warning(f"{n_missing} of {len(cities)} cities missing in tick {tick} ({query_time}).")
+        lease_table.mark_merged(tick, query_time=query_time, path=path, n_missing=n_missing)
+        paths.append(path)
+    logger.info(f"Merged {len(paths)} ticks to '{dir_merged}'.")
+    return paths
@@ -1,32 +1,48 @@
-from geopandas import GeoDataFrame
 import pandas as pd
 from pandas import DataFrame
 import numpy as np
-import geopandas as gpd
-from functools import reduce
+from functools import reduce, lru_cache
 import logging
 import glob
 import os 
+import posixpath
 from os.path import basename
 import json
 import typing 
-import zipfile
-from zipfile import ZipFile
+import datetime
 import logging.config
+if typing.TYPE_CHECKING: 
+    from geopandas import GeoDataFrame
 logger = logging.getLogger(__name__)
 
-from get_chargecloud_data import DIR_SAVE_API_RESULTS
-from get_osm_data import DIR_SAVE_OSM
+from get_chargecloud_data import CITIES_CC, DIR_SAVE_API_RESULTS, FMT_QUERY_TIME, SUFFIX_API_RESULTS, FMT_SHARD_DIR, PREFIX_META, KEY_UNCHANGED
+from archive import (archive_raw_results, 
+                     DEFAULT_CODEC, 
+                     EXTENSIONS_TAR, 
+                     PREFIX_ARCHIVE, 
+                     SEP_ARCHIVE_MEMBER, 
+                     get_archive_references, 
+                     is_archive, 
+                     iter_archived_results, 
+                     list_archive_members, 
+                     read_archived_result, 
+                     split_archive_reference)
 
-from settings import LOGGING_CONFIG
+from settings import LOGGING_CONFIG, METRICS_FILENAME, DIR_DATA, DIR_SAVE_OSM
+import metrics
+import profiling
+import sessions
+import status_tables
+import validation
 
 
-DIR_SAVE_RESULTS = "../data"
+DIR_SAVE_RESULTS = DIR_DATA
 
 DISTANCES_BUFFER = {"supermarket": 40, "fast_food": 30, "highway_services": 30, "fuel": 30, 
                     "mall": 40, "doityourself": 40}
 
 
+@profiling.profiled()
 def expand_df_dicts(df: DataFrame, 
                     *, 
                     index_col: str, 
@@ -82,6 +98,10 @@ def expand_df_dicts(df: DataFrame,
     else: 
         _cols_return = df_expanded.columns
     
+    # keys missing in every dictionary, e.g. 'parkingsensor_status' for cities without parking sensors
+    for col in set(_cols_return).difference(df_expanded.columns): 
+        df_expanded[col] = fill_value[col] if isinstance(fill_value, dict) else fill_value
+    
     df_result = df_expanded[_cols_return]
     
     return df_result
@@ -150,40 +170,382 @@ def extract_master_data_cs(data: dict) -> DataFrame:
     return df_cs
 
 
-def _read_api_results(fullpath_query_result: str) -> dict:
-    """Read chargecloud API result of one query interval
+def _parse_query_time(fullpath_query_result: str) -> datetime.datetime: 
+    """Parse query time from file name of chargecloud API result, e.g. '20220111_215824_cp_data_cities.json'
 
     Args:
-        fullpath_query_result (str): path to file of chargecloud API result
+        fullpath_query_result (str): path to file of chargecloud API result or reference 'archive::member' to archived API result
 
     Returns:
-        dict: dictionary containing cities as keys and chargecloud API results as values
-    """        
+        datetime.datetime: query time (local time) of API result
+    """    
+    name = fullpath_query_result.split(SEP_ARCHIVE_MEMBER)[-1]
+    query_time = basename(name).split(SUFFIX_API_RESULTS, maxsplit=1)[0]
+    return datetime.datetime.strptime(query_time, FMT_QUERY_TIME)
+
+
+def _to_local_datetime(ts: typing.Union[str, datetime.datetime, pd.Timestamp]) -> datetime.datetime: 
+    """Convert timestamp to naive local datetime as used in file names of API results
+
+    Args:
+        ts (typing.Union[str, datetime.datetime, pd.Timestamp]): timestamp. Timezone-aware timestamps are converted to local time.
+
+    Returns:
+        datetime.datetime: naive local datetime
+    """    
+    ts = pd.Timestamp(ts).to_pydatetime()
+    if ts.tzinfo is not None: 
+        ts = ts.astimezone().replace(tzinfo=None)
+    return ts
+
+
+def _parse_shard_city(fullpath_query_result: str) -> typing.Optional[str]: 
+    """Parse city from path of API result sharded by city, e.g. '.../city=koeln/date=2022-01-11/...'. Returns None if 
+    API result is not sharded.
+    """    
+    name = fullpath_query_result.split(SEP_ARCHIVE_MEMBER)[-1]
+    for part in name.replace(os.sep, "/").split("/"): 
+        if part.startswith("city="): 
+            return part.split("=", maxsplit=1)[1]
+    return None
+
+
+def _select_archived_results(dir_archives: str, 
+                             start: datetime.datetime = None, 
+                             end: datetime.datetime = None, 
+                             cities: typing.List[str] = None
+                             ) -> typing.List[str]: 
+    """Select archived API results within time range using the indexes of the archives without decompressing them
+
+    Args:
+        dir_archives (str): directory containing archives of API results
+        start (datetime.datetime, optional): start of time range (inclusive). Defaults to None.
+        end (datetime.datetime, optional): end of time range (exclusive). Defaults to None.
+        cities (typing.List[str], optional): cities to select shards for. Defaults to None.
+
+    Returns:
+        typing.List[str]: references 'archive::member' of archived API results
+    """    
+    _start = start.strftime(FMT_QUERY_TIME) if start is not None else None
+    _end = end.strftime(FMT_QUERY_TIME) if end is not None else None
+    
+    references = []
+    for fullpath_archive in sorted(glob.glob(os.path.join(dir_archives, PREFIX_ARCHIVE + "*"))): 
+        if not is_archive(fullpath_archive): 
+            continue
+        # archives are named by their last query time, skip archives ending before start
+        last_query_time = basename(fullpath_archive)[len(PREFIX_ARCHIVE):].split(".", maxsplit=1)[0]
+        if _start is not None and len(last_query_time) == len(_start) and last_query_time < _start: 
+            continue
+        for reference in get_archive_references(fullpath_archive, start=_start, end=_end): 
+            city = _parse_shard_city(split_archive_reference(reference)[1])
+            if cities is not None and city is not None and city not in cities: 
+                continue
+            references.append(reference)
+    return references
+
+
+def _select_shard_dirs(dir_api_results: str, 
+                       start: datetime.datetime = None, 
+                       end: datetime.datetime = None, 
+                       cities: typing.List[str] = None
+                       ) -> typing.List[str]: 
+    """Select directories of API results sharded by city and date by their directory names
+
+    Args:
+        dir_api_results (str): directory containing API results
+        start (datetime.datetime, optional): start of time range (inclusive). Defaults to None.
+        end (datetime.datetime, optional): end of time range (exclusive). Defaults to None.
+        cities (typing.List[str], optional): cities to select. If not specified all cities are selected. Defaults to None.
+
+    Returns:
+        typing.List[str]: directories of selected city shards
+    """    
+    shard_dirs = glob.glob(os.path.join(dir_api_results, FMT_SHARD_DIR.format(city="*", date="*")))
+    
+    selected_dirs = []
+    for shard_dir in shard_dirs: 
+        dir_city, dir_date = os.path.split(shard_dir)
+        city = basename(dir_city).split("=", maxsplit=1)[1]
+        date = datetime.datetime.strptime(dir_date.split("=", maxsplit=1)[1], "%Y-%m-%d").date()
+        
+        if cities is not None and city not in cities: 
+            continue
+        if start is not None and date < start.date(): 
+            continue
+        if end is not None and date > end.date(): 
+            continue
+        selected_dirs.append(shard_dir)
+    return selected_dirs
+
+
+def _select_result_files(dir_api_results: str, 
+                         start: typing.Union[str, datetime.datetime, pd.Timestamp] = None, 
+                         end: typing.Union[str, datetime.datetime, pd.Timestamp] = None, 
+                         cities: typing.List[str] = None, 
+                         dir_archives: str = None
+                         ) -> typing.List[typing.Union[str, typing.List[str]]]: 
+    """Select files of chargecloud API results within time range by their file name without opening them. API results 
+    sharded by city and date are pruned by their directory names and grouped by query time. 
+
+    Args:
+        dir_api_results (str): directory containing API results
+        start (typing.Union[str, datetime.datetime, pd.Timestamp], optional): start of time range (inclusive). Defaults to None.
+        end (typing.Union[str, datetime.datetime, pd.Timestamp], optional): end of time range (exclusive). Defaults to None.
+        cities (typing.List[str], optional): cities to select shards for. Defaults to None.
+        dir_archives (str, optional): directory containing archives of API results. Archived API results are selected by the archive index and read without extraction. API results available both as file and archived are read from file. If not specified archives are not read. Defaults to None.
+
+    Returns:
+        typing.List[typing.Union[str, typing.List[str]]]: path or list of paths of API results per query interval sorted by query time
+    """    
+    _start = _to_local_datetime(start) if start is not None else None
+    _end = _to_local_datetime(end) if end is not None else None
+    pattern_files = "*" + SUFFIX_API_RESULTS + ".json"
+    
+    files_results = glob.glob(os.path.join(dir_api_results, pattern_files))
+    for shard_dir in _select_shard_dirs(dir_api_results, start=_start, end=_end, cities=cities): 
+        files_results.extend(glob.glob(os.path.join(shard_dir, pattern_files)))
+    
+    if _start is not None: 
+        files_results = [f for f in files_results if _parse_query_time(f) >= _start]
+    if _end is not None: 
+        files_results = [f for f in files_results if _parse_query_time(f) < _end]
+    
+    if dir_archives is not None: 
+        # API results contained in several archives or additionally available as file are read only once
+        keys_files = {(_parse_query_time(f), _parse_shard_city(f)) for f in files_results}
+        for reference in _select_archived_results(dir_archives, start=_start, end=_end, cities=cities): 
+            key = (_parse_query_time(reference), _parse_shard_city(reference))
+            if key not in keys_files: 
+                keys_files.add(key)
+                files_results.append(reference)
+    
+    files_query_time = {}
+    for f in files_results: 
+        files_query_time.setdefault(_parse_query_time(f), []).append(f)
+        
+    return [sorted(files) if len(files) > 1 else files[0] 
+            for _, files in sorted(files_query_time.items())]
+
+
+def _load_api_results(fullpath_query_result: str) -> dict: 
+    """Load a single file or archive member of chargecloud API results as is"""
     _, file_extension = os.path.splitext(fullpath_query_result)
     
-    if file_extension == ".pkl": 
+    if SEP_ARCHIVE_MEMBER in fullpath_query_result: 
+        fullpath_archive, name = split_archive_reference(fullpath_query_result)
+        return read_archived_result(fullpath_archive, name)
+    elif file_extension == ".pkl": 
         return pd.read_pickle(fullpath_query_result)
     elif file_extension == ".json": 
         with open(fullpath_query_result, 'r') as f: 
             return json.load(f)
+    raise ValueError(f"Unknown file extension '{file_extension}' of API result '{fullpath_query_result}', "
+                     "expected '.json' or '.pkl'.")
+
+
+@lru_cache(maxsize=8)
+def _load_referenced_api_results(reference: str) -> dict: 
+    """Load API results referenced by unchanged cities. Consecutive API results mostly reference the same snapshot."""
+    return _load_api_results(reference)
+
+
+def _iter_loaded_api_results(files_results: typing.List[typing.Union[str, typing.List[str]]]
+                             ) -> typing.Iterator[typing.Tuple[typing.Union[str, typing.List[str]], dict]]: 
+    """Load API results of query intervals in order. Members of compressed tar archives are read in a single 
+    sequential pass per archive, instead of decompressing all preceding members for every member. Other files and 
+    archive members are loaded when they are read.
+
+    Args:
+        files_results (typing.List[typing.Union[str, typing.List[str]]]): paths of API results per query interval, output of `_select_result_files`
+
+    Raises:
+        KeyError: Raised if a tar archive does not contain a referenced member
+
+    Yields:
+        typing.Iterator[typing.Tuple[typing.Union[str, typing.List[str]], dict]]: path or list of paths of query interval and its loaded API results keyed by path
+    """    
+    names_remaining = {}
+    for f in files_results: 
+        for path in (f if isinstance(f, list) else [f]): 
+            if SEP_ARCHIVE_MEMBER in path: 
+                fullpath_archive, name = split_archive_reference(path)
+                if fullpath_archive.endswith(EXTENSIONS_TAR): 
+                    names_remaining.setdefault(fullpath_archive, set()).add(name)
+    
+    readers = {}
+    # members read ahead of their query interval, archives are mostly ordered like the query intervals
+    read_ahead = {}
+    for f in files_results: 
+        loaded = {}
+        for path in (f if isinstance(f, list) else [f]): 
+            if SEP_ARCHIVE_MEMBER not in path: 
+                continue
+            fullpath_archive, name = split_archive_reference(path)
+            if fullpath_archive not in names_remaining: 
+                continue
+            if fullpath_archive not in readers: 
+                readers[fullpath_archive] = iter_archived_results(fullpath_archive, names=names_remaining[fullpath_archive])
+            while (fullpath_archive, name) not in read_ahead: 
+                member = next(readers[fullpath_archive], None)
+                if member is None: 
+                    raise KeyError(f"Member '{name}' not found in archive '{fullpath_archive}'.")
+                read_ahead[(fullpath_archive, member[0])] = member[1]
+            loaded[path] = read_ahead.pop((fullpath_archive, name))
+            names_remaining[fullpath_archive].discard(name)
+            if not names_remaining[fullpath_archive]: 
+                readers.pop(fullpath_archive).close()
+        yield f, loaded
+
+
+def _list_archives(dir_archives: str) -> typing.List[str]: 
+    """Paths of archives in a directory, latest archive first"""
+    return [f for f in sorted(glob.glob(os.path.join(dir_archives, PREFIX_ARCHIVE + "*")), reverse=True) if is_archive(f)]
+
+
+@lru_cache(maxsize=64)
+def _index_archive_members(fullpath_archive: str, mtime: float) -> typing.Dict[str, typing.List[str]]: 
+    """Names of archive members by their file name. Cached per archive and modification time, so the members of an 
+    archive are only listed once for all markers referencing it."""
+    names = {}
+    for member in list_archive_members(fullpath_archive): 
+        names.setdefault(posixpath.basename(member["name"]), []).append(member["name"])
+    return names
+
+
+def _resolve_unchanged_reference(fullpath_query_result: str, 
+                                 ref: str, 
+                                 dir_archives: str = None) -> typing.Optional[str]: 
+    """Resolve reference of an unchanged city to the file or archive member containing its full API result
+
+    References are relative to the directory of the referencing API result. Snapshots archived since they were 
+    referenced are looked up by member name in the archive of the referencing API result and in dir_archives.
+
+    Args:
+        fullpath_query_result (str): path or reference 'archive::member' of API result containing the marker
+        ref (str): reference of marker
+        dir_archives (str, optional): directory of archives to search for referenced snapshots. Defaults to None.
+
+    Returns:
+        typing.Optional[str]: path or reference 'archive::member' of referenced API result or None if not found
+    """
+    if SEP_ARCHIVE_MEMBER in fullpath_query_result: 
+        fullpath_archive, name = split_archive_reference(fullpath_query_result)
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(name), ref.replace(os.sep, "/")))
+        fullpaths_archives = [fullpath_archive] + _list_archives(os.path.dirname(fullpath_archive))
+        is_target = lambda member_name: member_name == target
+    else: 
+        target = os.path.normpath(os.path.join(os.path.dirname(fullpath_query_result), ref))
+        if os.path.exists(target): 
+            return target
+        # member names of archives are relative to the common directory of the archived files
+        target = "/" + target.replace(os.sep, "/")
+        fullpaths_archives = []
+        is_target = lambda member_name: target.endswith("/" + member_name)
+    
+    if dir_archives is not None: 
+        fullpaths_archives += _list_archives(dir_archives)
+    for fullpath_archive in fullpaths_archives: 
+        names = _index_archive_members(fullpath_archive, os.path.getmtime(fullpath_archive))
+        for name in names.get(posixpath.basename(target), []): 
+            if is_target(name): 
+                return fullpath_archive + SEP_ARCHIVE_MEMBER + name
+    return None
+
+
+@profiling.profiled()
+def _read_api_results(fullpath_query_result: typing.Union[str, typing.List[str]], 
+                      cities: typing.List[str] = None, 
+                      dir_archives: str = None, 
+                      loaded: dict = None) -> dict:
+    """Read chargecloud API result of one query interval. Unchanged cities saved as marker by the scraper are 
+    replaced by the full API result of the referenced snapshot with the timestamp of the marker.
+
+    Args:
+        fullpath_query_result (typing.Union[str, typing.List[str]]): path to file of chargecloud API result, reference 'archive::member' to archived API result or list of paths to city shards of one query interval
+        cities (typing.List[str], optional): cities to keep. If not specified all cities are returned. Defaults to None.
+        dir_archives (str, optional): directory of archives to search for snapshots referenced by unchanged cities, which have been archived and removed. Defaults to None.
+        loaded (dict, optional): API results already loaded keyed by path, e.g. by `_iter_loaded_api_results`. Other API results are loaded from their file or archive. Defaults to None.
+
+    Returns:
+        dict: dictionary containing cities as keys and chargecloud API results as values
+    """        
+    if isinstance(fullpath_query_result, list): 
+        data = {}
+        for f in fullpath_query_result: 
+            data.update(_read_api_results(f, cities=cities, dir_archives=dir_archives, loaded=loaded))
+        return data
+    
+    if loaded is not None and fullpath_query_result in loaded: 
+        data = loaded[fullpath_query_result]
+    else: 
+        data = _load_api_results(fullpath_query_result)
+    
+    # metadata of the scraper, e.g. scrape status of cities, is not an API result
+    data = {key: val for key, val in data.items() if not key.startswith(PREFIX_META)}
+    if cities is not None: 
+        data = {city: data[city] for city in cities if city in data}
+    
+    for city, result in list(data.items()): 
+        if not result.get(KEY_UNCHANGED): 
+            continue
+        reference = _resolve_unchanged_reference(fullpath_query_result, result["ref"], dir_archives=dir_archives)
+        data_ref = _load_referenced_api_results(reference) if reference is not None else {}
+        if city not in data_ref or data_ref[city].get(KEY_UNCHANGED): 
+            logger.warning(f"Full API result of unchanged city '{city}' referenced by '{fullpath_query_result}' not found.")
+            del data[city]
+            continue
+        data[city] = {**data_ref[city], "timestamp": result["timestamp"]}
+    return data
         
 
-def extract_master_data(fullpath_query_result: str, 
-                        drop_col_status: bool = True,
-                        flatten_results: bool = True
-                        ) -> typing.Tuple[DataFrame, DataFrame, DataFrame]: 
-    """Extract charging station, charging point and connector master data from API result
+def _read_latest_api_results(files_results: typing.List[typing.Union[str, typing.List[str]]], 
+                             cities: typing.List[str] = None, 
+                             dir_archives: str = None) -> dict: 
+    """Read the newest API result of every city, going back from the latest query interval until all cities are found. 
+    Cities missing in the latest query interval, e.g. as their scrape failed, are taken from earlier ones.
 
     Args:
-        fullpath_query_result (str): path to file of chargecloud API result
-        drop_col_status (bool, optional): whether to drop status column from API result. Defaults to True.
-        flatten_results (bool, optional): whether to drop columns containing non-flat datastructures (list, dicts). Defaults to True.
+        files_results (typing.List[typing.Union[str, typing.List[str]]]): paths of API results per query interval sorted by query time
+        cities (typing.List[str], optional): cities to read. If not specified the scraped cities CITIES_CC, the cities of all city shards and of the latest query interval are read. Defaults to None.
+        dir_archives (str, optional): directory of archives to search for snapshots referenced by unchanged cities. Defaults to None.
 
     Returns:
-        typing.Tuple[DataFrame, DataFrame, DataFrame]: charging station master data, charging point master data, connector master data
+        dict: dictionary containing cities as keys and their newest chargecloud API results as values
     """    
-    data = _read_api_results(fullpath_query_result=fullpath_query_result)
+    remaining = set(cities) if cities is not None else None
+    if remaining is None: 
+        cities_expected = {_parse_shard_city(f) 
+                           for files in files_results for f in (files if isinstance(files, list) else [files])}
+        cities_expected.discard(None)
+        cities_expected.update(CITIES_CC)
+    
+    data = {}
+    for files in reversed(files_results): 
+        if remaining is not None and isinstance(files, list): 
+            # shards of cities already found are not read again
+            files = [f for f in files if _parse_shard_city(f) is None or _parse_shard_city(f) in remaining]
+        data_interval = _read_api_results(files, 
+                                          cities=sorted(remaining) if remaining is not None else None, 
+                                          dir_archives=dir_archives)
+        if remaining is None: 
+            remaining = cities_expected.union(data_interval)
+        for city, result in data_interval.items(): 
+            data.setdefault(city, result)
+        remaining.difference_update(data_interval)
+        if not remaining: 
+            break
+    
+    if remaining: 
+        logger.warning(f"No API results found for cities {sorted(remaining)}.")
+    return data
 
+
+def _extract_master_data_from_results(data: dict, 
+                                      drop_col_status: bool = True,
+                                      flatten_results: bool = True
+                                      ) -> typing.Tuple[DataFrame, DataFrame, DataFrame]: 
+    """Extract charging station, charging point and connector master data from API results read by `_read_api_results`"""
     df_md_cs = extract_master_data_cs(data)
     
     df_md_cp = expand_df_dicts(df_md_cs,
@@ -207,14 +569,47 @@ def extract_master_data(fullpath_query_result: str,
     return df_md_cs, df_md_cp, df_md_conn
 
 
-def extract_status(fullpath_query_result: str,
-                   return_type: str = "both"
+def extract_master_data(fullpath_query_result: typing.Union[str, typing.List[str]], 
+                        drop_col_status: bool = True,
+                        flatten_results: bool = True, 
+                        cities: typing.List[str] = None, 
+                        dir_archives: str = None
+                        ) -> typing.Tuple[DataFrame, DataFrame, DataFrame]: 
+    """Extract charging station, charging point and connector master data from API result
+
+    Args:
+        fullpath_query_result (typing.Union[str, typing.List[str]]): path to file of chargecloud API result or list of paths to city shards of one query interval
+        drop_col_status (bool, optional): whether to drop status column from API result. Defaults to True.
+        flatten_results (bool, optional): whether to drop columns containing non-flat datastructures (list, dicts). Defaults to True.
+        cities (typing.List[str], optional): cities to extract. If not specified all cities are extracted. Defaults to None.
+        dir_archives (str, optional): directory of archives to search for snapshots referenced by unchanged cities. Defaults to None.
+
+    Raises:
+        ValueError: Raised if API result contains none of the selected cities
+
+    Returns:
+        typing.Tuple[DataFrame, DataFrame, DataFrame]: charging station master data, charging point master data, connector master data
+    """    
+    data = _read_api_results(fullpath_query_result=fullpath_query_result, cities=cities, dir_archives=dir_archives)
+    if not data: 
+        raise ValueError(f"API result '{fullpath_query_result}' contains none of the selected cities.")
+    return _extract_master_data_from_results(data, drop_col_status=drop_col_status, flatten_results=flatten_results)
+
+
+def extract_status(fullpath_query_result: typing.Union[str, typing.List[str]],
+                   return_type: str = "both", 
+                   cities: typing.List[str] = None, 
+                   dir_archives: str = None, 
+                   loaded: dict = None
                    ) -> typing.Union[DataFrame, typing.Tuple[DataFrame, DataFrame, DataFrame]]: 
     """Extract status information from charging points and connectors
 
     Args:
-        fullpath_query_result (str): path to result of chargecloud API result
+        fullpath_query_result (typing.Union[str, typing.List[str]]): path to result of chargecloud API result or list of paths to city shards of one query interval
         return_type (str, optional): Any of {'status_cps', 'status_connectors', 'both'}. Whether to return status of chargingpoints, status of connectors or both. Defaults to "both".
+        cities (typing.List[str], optional): cities to extract. If not specified all cities are extracted. Defaults to None.
+        dir_archives (str, optional): directory of archives to search for snapshots referenced by unchanged cities. Defaults to None.
+        loaded (dict, optional): API results already loaded keyed by path. Defaults to None.
 
     Raises:
         ValueError: Raised if return_type is none of {'status_cps', 'status_connectors', 'both'}
@@ -222,7 +617,10 @@ def extract_status(fullpath_query_result: str,
     Returns:
         typing.Union[DataFrame, typing.Tuple[DataFrame, DataFrame, DataFrame]]: Status of chargingpoints, status of connectors or both
     """    
-    data = _read_api_results(fullpath_query_result=fullpath_query_result)
+    data = _read_api_results(fullpath_query_result=fullpath_query_result, 
+                             cities=cities, 
+                             dir_archives=dir_archives, 
+                             loaded=loaded)
     
     if data: 
         df_cs = _construct_df_from_json_with_ts(data)
@@ -263,141 +661,322 @@ def extract_status(fullpath_query_result: str,
 def _postprocess_master_data(files_results: list, 
                              dir_master_data: str, 
                              output_format: str = "csv", 
-                             storage_options: dict = None): 
-    """Postprocess master data of chargingstations, chargingpoints and connectors from API results
+                             storage_options: dict = None, 
+                             cities: typing.List[str] = None, 
+                             dir_archives: str = None, 
+                             validator: validation.Validator = None): 
+    """Postprocess master data of chargingstations, chargingpoints and connectors from API results. Master data of 
+    every city is taken from its newest API result. If only some cities are postprocessed, their master data replaces 
+    the master data of their charging stations in the existing tables and the other charging stations are kept.
 
     Args:
         files_results (list): list of paths of chargecloud API results
         dir_master_data (str): directory to save master data results to
         output_format (str, optional): output format for master data. Defaults to "csv".
         storage_options (dict, optional): storage options when writing to S3. 
+        cities (typing.List[str], optional): cities to postprocess. If not specified all cities are postprocessed. Defaults to None.
+        dir_archives (str, optional): directory of archives to search for snapshots referenced by unchanged cities. Defaults to None.
+        validator (validation.Validator, optional): data quality checks to run before saving master data. Defaults to None.
 
     Raises:
         NotImplementedError: Raised if invalid output format is provided.
+        ValueError: Raised if a data quality check fails and validator is strict.
+
+    Returns:
+        int: number of master data records of charging stations, charging points and connectors
     """    
-    # as results are sorted by date take the latest API result for most recent master data
-    df_md_cs, df_md_cp, df_md_conn = extract_master_data(files_results[-1])
+    if output_format != "csv": 
+        raise NotImplementedError("Other output formats other '.csv' are not yet implemented.")
+    
+    data = _read_latest_api_results(files_results, cities=cities, dir_archives=dir_archives)
+    if not data: 
+        logger.warning("No master data found in API results, master data is not updated.")
+        return 0
+    df_md_cs, df_md_cp, df_md_conn = _extract_master_data_from_results(data)
     
     logger.debug(f"Shape master data charging stations: {df_md_cs.shape}")
     logger.debug(f"Shape master data charging points: {df_md_cp.shape}")
     logger.debug(f"Shape master data connectors: {df_md_conn.shape}")
-
     
-    if output_format == "csv": 
-        fullpath_cs = os.path.join(dir_master_data, "charging_stations.csv")
-        logger.info(f"Saving master data charging stations to '{fullpath_cs}'")
-        df_md_cs.to_csv(fullpath_cs, sep=";", index=False, storage_options=storage_options)
-        
-        fullpath_cp = os.path.join(dir_master_data, "charging_points.csv")
-        logger.info(f"Saving master data charging points stations to '{fullpath_cp}'")
-        df_md_cp.to_csv(fullpath_cp, sep=";", index=False,  storage_options=storage_options)
-        
-        fullpath_conn = os.path.join(dir_master_data, "connectors.csv")
-        logger.info(f"Saving master data connectors to '{fullpath_conn}'")
-        df_md_conn.to_csv(fullpath_conn, sep=";", index=False, storage_options=storage_options)
-    else: 
-        raise NotImplementedError("Other output formats other '.csv' are not yet implemented.")
+    if validator is not None: 
+        with profiling.profile_stage("validation"): 
+            validator.validate_master_data(df_md_cs, df_md_cp, df_md_conn)
+    
+    # charging points and connectors are replaced together with their charging station
+    tables = [("charging_stations.csv", "charging stations", df_md_cs, "id", df_md_cs["id"]), 
+              ("charging_points.csv", "charging points", df_md_cp, "id_cs", df_md_cs["id"]), 
+              ("connectors.csv", "connectors", df_md_conn, "id_cp", df_md_cp["id"])]
+    for fname, name, df_md, col_parent, ids_parent in tables: 
+        fullpath = os.path.join(dir_master_data, fname)
+        if cities is not None: 
+            df_md = _merge_master_data(df_md, fullpath, col_parent, ids_parent, storage_options=storage_options)
+        logger.info(f"Saving master data {name} to '{fullpath}'")
+        with profiling.profile_stage("to_csv"): 
+            df_md.to_csv(fullpath, sep=";", index=False, storage_options=storage_options)
+    
+    return df_md_cs.shape[0] + df_md_cp.shape[0] + df_md_conn.shape[0]
+
+
+def _merge_master_data(df_md: DataFrame, 
+                       fullpath: str, 
+                       col_parent: str, 
+                       ids_parent: pd.Series, 
+                       storage_options: dict = None) -> DataFrame: 
+    """Replace rows of existing master data table belonging to the given parent ids, e.g. charging points of charging 
+    stations, by new master data. Existing rows are kept as text, so their values are written back unchanged."""
+    try: 
+        df_existing = pd.read_csv(fullpath, sep=";", dtype=str, keep_default_na=False, storage_options=storage_options)
+    except FileNotFoundError: 
+        return df_md
+    is_replaced = df_existing[col_parent].isin(ids_parent.astype(str))
+    logger.info(f"Replacing {is_replaced.sum()} of {df_existing.shape[0]} rows of '{fullpath}'.")
+    return pd.concat([df_existing[~is_replaced], df_md], ignore_index=True)[df_md.columns]
+
+
+def extract_time_dimension(*status: DataFrame, col_time: str = "timestamp") -> DataFrame: 
+    """Build rows of the time dimension from the distinct query times of status data. Date parts are computed in UTC 
+    like `extract` on TIMESTAMPTZ columns in Redshift, weekday counts from 0 for Sunday like `extract(dayofweek)`.
+
+    Args:
+        status (DataFrame): status data of charging points and connectors
+        col_time (str, optional): name of time column. Defaults to "timestamp".
+
+    Returns:
+        DataFrame: time dimension with columns query_time, hour, day, week, month, year and weekday
+    """    
+    query_times = pd.unique(pd.concat([df[col_time] for df in status], ignore_index=True))
+    ts = pd.DatetimeIndex(pd.to_datetime(query_times, utc=True))
+    return DataFrame({"query_time": query_times, 
+                      "hour": ts.hour, 
+                      "day": ts.day, 
+                      "week": ts.isocalendar().week.to_numpy(dtype=np.int64), 
+                      "month": ts.month, 
+                      "year": ts.year, 
+                      "weekday": (ts.dayofweek + 1) % 7}).sort_values("query_time", ignore_index=True)
 
 
 def _postprocess_status_data(files_results: str, 
                              dir_status_cps: str, 
                              dir_status_connectors: str, 
-                             storage_options: dict = None): 
-    """Postprocess status data of chargingpoints and connectors from API results
+                             storage_options: dict = None, 
+                             cities: typing.List[str] = None, 
+                             dir_archives: str = None, 
+                             dir_sessions: str = None, 
+                             validator: validation.Validator = None): 
+    """Postprocess status data of chargingpoints and connectors from API results. Status rows reference timestamps 
+    and ids by integer codes of the snapshot table and id dictionaries, see `status_tables`. The distinct query times are saved 
+    as rows of the time dimension next to the status data of charging points. Charging sessions are reconstructed 
+    incrementally from the status data, continuing the sessions of the previous run. If only some cities are 
+    postprocessed, their status data is merged into the existing status tables.
 
     Args:
         files_results (list): list of paths of chargecloud API results
         dir_status_cps (str): directory to save chargingpoint status data
         dir_status_connectors (str): directory to save connector status data
         storage_options (dict, optional): storage options when writing to S3. 
+        cities (typing.List[str], optional): cities to postprocess. If not specified all cities are postprocessed. Defaults to None.
+        dir_archives (str, optional): directory of archives to search for snapshots referenced by unchanged cities. Defaults to None.
+        dir_sessions (str, optional): directory to save charging sessions and their carry-over state. If not specified sessions are not reconstructed. Defaults to None.
+        validator (validation.Validator, optional): data quality checks to run on the status data of every API result. Defaults to None.
     
+    Raises:
+        ValueError: Raised if a data quality check fails and validator is strict.
+
+    Returns:
+        int: number of status records of charging points and connectors
     """    
     status_cps = []
     status_connectors = []
     
-    for f in files_results: 
-        df_status_cp, df_status_conn = extract_status(f, return_type="both")
+    # members of tar archives are read in one pass instead of once per API result
+    for f, loaded in _iter_loaded_api_results(files_results): 
+        status = extract_status(f, return_type="both", cities=cities, dir_archives=dir_archives, loaded=loaded)
+        if status is None: 
+            logger.debug(f"No status information for selected cities in '{f}'.")
+            continue
+        df_status_cp, df_status_conn = status
+        if validator is not None: 
+            with profiling.profile_stage("validation"): 
+                validator.validate_status(df_status_cp, table=validation.TABLE_STATUS_CPS)
+                validator.validate_status(df_status_conn, table=validation.TABLE_STATUS_CONNECTORS)
         
         status_cps.append(df_status_cp)
         status_connectors.append(df_status_conn)
+    
+    if not status_cps: 
+        logger.warning("No status information found in API results.")
+        return 0
         
     df_status_cps = pd.concat(status_cps)
     df_status_conns = pd.concat(status_connectors)    
     
     logger.debug(f"Shape status information chargingpoints: {df_status_cps.shape}")
     logger.debug(f"Shape status information connectors: {df_status_conns.shape}")
+    
+    # sessions are continued from the new status data only
+    status_by_entity = {sessions.ENTITY_CP: df_status_cps, sessions.ENTITY_CONNECTOR: df_status_conns}
+    n_status = df_status_cps.shape[0] + df_status_conns.shape[0]
+    if cities is not None: 
+        # status of other cities in the existing status tables is kept
+        df_status_cps = status_tables.merge_status_table(df_status_cps, 
+                                                         entity=status_tables.ENTITY_CP, 
+                                                         dir_status=dir_status_cps, 
+                                                         storage_options=storage_options)
+        df_status_conns = status_tables.merge_status_table(df_status_conns, 
+                                                           entity=status_tables.ENTITY_CONNECTOR, 
+                                                           dir_status=dir_status_connectors, 
+                                                           dir_snapshots=dir_status_cps, 
+                                                           storage_options=storage_options)
 
-    fullpath_status_cps = os.path.join(dir_status_cps, "status_cps.csv")
+    # status rows reference the snapshot table next to the status of charging points and the id dictionaries
+    logger.info(f"Saving status information charging points to '{dir_status_cps}'")
+    with profiling.profile_stage("to_csv"): 
+        status_tables.write_status_table(df_status_cps, 
+                                         entity=status_tables.ENTITY_CP, 
+                                         dir_status=dir_status_cps, 
+                                         storage_options=storage_options)
+    
+    logger.info(f"Saving status information connectors to '{dir_status_connectors}'")
+    with profiling.profile_stage("to_csv"): 
+        status_tables.write_status_table(df_status_conns, 
+                                         entity=status_tables.ENTITY_CONNECTOR, 
+                                         dir_status=dir_status_connectors, 
+                                         dir_snapshots=dir_status_cps, 
+                                         storage_options=storage_options)
     
-    logger.info(f"Saving status information charging points to '{fullpath_status_cps}'")
-    df_status_cps.to_csv(fullpath_status_cps, index=False, sep=";", storage_options=storage_options)
+    # the time dimension only needs the distinct query times, the ETL inserts those not yet loaded
+    df_time = extract_time_dimension(df_status_cps, df_status_conns)
+    fullpath_time = os.path.join(dir_status_cps, "time.csv")
+    logger.info(f"Saving {df_time.shape[0]} query times to '{fullpath_time}'")
+    df_time.to_csv(fullpath_time, index=False, sep=";", storage_options=storage_options)
     
-    fullpath_status_conn = os.path.join(dir_status_connectors, "status_connectors.csv")
-    logger.info(f"Saving status information connectors to '{fullpath_status_conn}'")
-    df_status_conns.to_csv(fullpath_status_conn, index=False, sep=";", storage_options=storage_options)
+    if dir_sessions is not None: 
+        with metrics.timer("preprocess_step", step="sessions") as t: 
+            t.rows = sessions.update_sessions(status_by_entity, 
+                                              dir_sessions=dir_sessions, 
+                                              storage_options=storage_options)
+    
+    return n_status
 
 
-def _archive_raw_results(files_result: str, dir_zip: str, name_zipfile: str = None, compression=zipfile.ZIP_BZIP2): 
-    """Convert raw results to ZIP-file for archieval purposes
+def _archive_raw_results(files_result: list, 
+                         dir_archive: str, 
+                         name_archive: str = None, 
+                         codec: str = DEFAULT_CODEC, 
+                         remove_originals: bool = False, 
+                         root_dir: str = None): 
+    """Compress raw results to an archive for archival purposes
 
     Args:
         files_results (list): list of paths of chargecloud API results
-        dir_zip (str): directory to save zip archive 
-        name_zipfile (str, optional): name of zipfile. If not provided date of last API result is incorporated in ZIP file. Defaults to None.
-        compression (int, optional): ZIPfile compression type. Defaults to zipfile.ZIP_BZIP2
+        dir_archive (str): directory to save archive 
+        name_archive (str, optional): name of archive. If not provided date of last API result is incorporated in name of archive. Defaults to None.
+        codec (str, optional): any of {'zstd', 'gzip', 'xz', 'bz2', 'zip'}. Defaults to 'zstd' if package zstandard is installed, else 'gzip'.
+        remove_originals (bool, optional): whether to remove raw results after the archive has been verified. Defaults to False.
+        root_dir (str, optional): directory of API results, names of archive members are relative to it and empty shard directories below it are removed. Defaults to the common directory of the API results.
     """    
-    
-    #https://thispointer.com/python-how-to-create-a-zip-archive-from-multiple-files-or-directory/
-   
-    if name_zipfile is None: 
-       query_datetime = basename(files_result[-1]).split("_cp_data_cities", maxsplit=1)[0]
-       name_zipfile = "archive_cp_data_cities_" + query_datetime + ".zip"
-    
-    fullpath_zip = os.path.join(dir_zip, name_zipfile)
-    
-    with ZipFile(fullpath_zip, 'w', compression=compression) as zip_obj:
-        for f in files_result: 
-            zip_obj.write(f)
+    # API results read from archives are already archived
+    files_loose = [[f for f in files if SEP_ARCHIVE_MEMBER not in f] if isinstance(files, list) else files 
+                   for files in files_result 
+                   if isinstance(files, list) or SEP_ARCHIVE_MEMBER not in files]
+    archive_raw_results(files_results=files_loose, 
+                        dir_archive=dir_archive, 
+                        name_archive=name_archive, 
+                        codec=codec, 
+                        remove_originals=remove_originals, 
+                        root_dir=root_dir)
 
     
 def postprocess_api_results(dir_api_results: str = DIR_SAVE_API_RESULTS, 
                             dir_status_cps: str = DIR_SAVE_RESULTS, 
                             dir_status_connectors: str = DIR_SAVE_RESULTS, 
                             dir_master_data: str = DIR_SAVE_RESULTS, 
-                            dir_zip_file: str = None):
+                            dir_sessions: str = DIR_SAVE_RESULTS, 
+                            dir_zip_file: str = None, 
+                            archive_codec: str = DEFAULT_CODEC, 
+                            remove_archived: bool = False, 
+                            dir_archives: str = None, 
+                            start: typing.Union[str, datetime.datetime, pd.Timestamp] = None, 
+                            end: typing.Union[str, datetime.datetime, pd.Timestamp] = None, 
+                            cities: typing.List[str] = None, 
+                            strict_validation: bool = False, 
+                            storage_options: dict = None):
     """Postprocess chargecloud API result. Extract master data (chargingstations, chargingpoints and connectors) and 
-    status information (chargingpoints, connectors) and archive raw API results. 
+    status information (chargingpoints, connectors) and archive raw API results. Data quality checks run on every 
+    API result before data is saved, their counts are saved as report next to the status data of charging points.
 
     Args:
         dir_api_results (str): directory containing API results.
         dir_status_cps (str): directory to save chargingpoint status data
         dir_status_connectors (str): directory to save connector status data
         dir_master_data (str): directory to save master data results to
-        dir_zip (str, optional): directory to save zip archive. If not specified raw files will not be archived. Defaults to None. 
-        
+        dir_sessions (str, optional): directory to save charging sessions reconstructed incrementally from the status data. If None, sessions are not reconstructed. Defaults to DIR_SAVE_RESULTS.
+        dir_zip_file (str, optional): directory to save archive of raw results. If not specified raw files will not be archived. Defaults to None. 
+        archive_codec (str, optional): codec of archive, any of {'zstd', 'gzip', 'xz', 'bz2', 'zip'}. Defaults to 'zstd' if package zstandard is installed, else 'gzip'.
+        remove_archived (bool, optional): whether to remove raw results after they have been archived and verified. Defaults to False.
+        dir_archives (str, optional): directory containing archives of previously archived API results to read without extraction. If not specified only API result files are read. Defaults to None.
+        start (typing.Union[str, datetime.datetime, pd.Timestamp], optional): only postprocess API results queried at or after start. Naive timestamps are interpreted as local time. Defaults to None.
+        end (typing.Union[str, datetime.datetime, pd.Timestamp], optional): only postprocess API results queried before end. Naive timestamps are interpreted as local time. Defaults to None.
+        cities (typing.List[str], optional): cities to postprocess. If not specified all cities are postprocessed. Defaults to None.
+        strict_validation (bool, optional): whether to stop at the first failing data quality check instead of only reporting it. Defaults to False.
+        storage_options (dict, optional): storage options when reading from and writing to S3. Raw results and archives are always local. Defaults to None.
+    
+    Raises:
+        ValueError: Raised if a data quality check fails and strict_validation is True.
     """    
-    fullpath_api_results = dir_api_results + "/*.json"
-    print(fullpath_api_results)
-    files_results = glob.glob(fullpath_api_results)
-    print(len(files_results))
-    files_results.sort()
+    files_results = _select_result_files(dir_api_results, 
+                                         start=start, 
+                                         end=end, 
+                                         cities=cities, 
+                                         dir_archives=dir_archives)
     logger.debug(f"Number of API results: {len(files_results)}")
+    if not files_results: 
+        logger.warning(f"No API results found in '{dir_api_results}' for the selected time range.")
+        return
+    
+    # snapshots referenced by unchanged cities may have been archived to dir_zip_file by a previous run
+    dir_archives_ref = dir_archives if dir_archives is not None else dir_zip_file
+    validator = validation.Validator(strict=strict_validation)
     
     logger.info("Postprocessing master data.")
-    _postprocess_master_data(files_results=files_results, dir_master_data=dir_master_data)
+    with metrics.timer("preprocess_step", track_memory=True, step="master_data") as t: 
+        t.rows = _postprocess_master_data(files_results=files_results, 
+                                          dir_master_data=dir_master_data, 
+                                          cities=cities, 
+                                          dir_archives=dir_archives_ref, 
+                                          validator=validator, 
+                                          storage_options=storage_options)
     
     logger.info("Postprocessing status data.")
-    _postprocess_status_data(files_results=files_results, 
-                             dir_status_cps=dir_status_cps, 
-                             dir_status_connectors=dir_status_connectors)
+    with metrics.timer("preprocess_step", track_memory=True, step="status_data") as t: 
+        t.rows = _postprocess_status_data(files_results=files_results, 
+                                          dir_status_cps=dir_status_cps, 
+                                          dir_status_connectors=dir_status_connectors, 
+                                          cities=cities, 
+                                          dir_archives=dir_archives_ref, 
+                                          dir_sessions=dir_sessions, 
+                                          validator=validator, 
+                                          storage_options=storage_options)
+    
+    fullpath_report = os.path.join(dir_status_cps, validation.FNAME_REPORT)
+    logger.info(f"Saving data quality report to '{fullpath_report}'")
+    validator.report.log_summary()
+    validator.report.to_frame().to_csv(fullpath_report, sep=";", index=False, storage_options=storage_options)
     
     if dir_zip_file is not None: 
         logger.info("Archiving raw results.")
-        _archive_raw_results(files_result=files_results, dir_zip_file=dir_zip_file)
+        with metrics.timer("preprocess_step", step="archive") as t: 
+            _archive_raw_results(files_result=files_results, 
+                                 dir_archive=dir_zip_file, 
+                                 codec=archive_codec, 
+                                 remove_originals=remove_archived, 
+                                 root_dir=dir_api_results)
+            t.rows = len(files_results)
 
 
-def _distance_matching_pois_cs(gdf_poi: GeoDataFrame, 
-                               gdf_cs: GeoDataFrame,
+@profiling.profiled()
+def _distance_matching_pois_cs(gdf_poi: "GeoDataFrame", 
+                               gdf_cs: "GeoDataFrame",
                                distances_poi_categories: typing.Dict[str, float], 
                                cols_relevant: typing.List[str] = ["id_poi", "id_cs"], 
                                default_distance: float = 30.0
@@ -415,6 +994,8 @@ def _distance_matching_pois_cs(gdf_poi: GeoDataFrame,
         DataFrame: Mapping table between POI locations and charging station locations
         
     """    
+    import geopandas as gpd
+    
     buffer_poi_cats = gdf_poi["poi_cat"].map(distances_poi_categories).fillna(default_distance)
     gdf_poi["geometry"] = gdf_poi["geometry"].buffer(buffer_poi_cats)
     
@@ -437,14 +1018,17 @@ def match_cs_to_poi(dir_charging_stations: str = DIR_SAVE_RESULTS,
     """Compute distance mapping table between charging station locations and POI locations
 
     Args:
-        dir_charging_stations (str, optional): directory containing chargecloud charging station locations. Defaults to "../data".
-        dir_osm_poi (str, optional): directory containing OSM POI locations. Defaults to "../data/osm".
-        dir_save_mapping_table (str, optional): directory to save mapping table to. Defaults to "../data/".
+        dir_charging_stations (str, optional): directory containing chargecloud charging station locations. Defaults to DIR_SAVE_RESULTS.
+        dir_osm_poi (str, optional): directory containing OSM POI locations. Defaults to DIR_SAVE_OSM.
+        dir_save_mapping_table (str, optional): directory to save mapping table to. Defaults to DIR_SAVE_RESULTS.
         distances_poi_categories (typing.Dict[str, float], optional): Distance in m between POI and charging station to spatially match the two locations together.
         POI category as key and distance in metres as value. Defaults to DISTANCES_BUFFER.
 
         
     """    
+    # geopandas is only needed for spatial matching and slow to import
+    import geopandas as gpd
+    
     logger.info("Reading OSM POI locations.")
     fullpaths_osm_poi = glob.glob(dir_osm_poi + "/**/*.shp", recursive=True)
     gdf_poi_osm = pd.concat([gpd.read_file(path_osm_poi) for path_osm_poi in fullpaths_osm_poi])
@@ -461,17 +1045,23 @@ def match_cs_to_poi(dir_charging_stations: str = DIR_SAVE_RESULTS,
     gdf_cs.to_crs("EPSG:25832", inplace=True)
  
     logger.info("Compute distance mapping between charging stations and OSM locations.")
-    mapping_poi_cs = _distance_matching_pois_cs(gdf_poi=gdf_poi_osm, 
-                                                gdf_cs=gdf_cs,
-                                                distances_poi_categories=distances_poi_categories)
+    with metrics.timer("preprocess_step", track_memory=True, step="match_cs_to_poi") as t: 
+        mapping_poi_cs = _distance_matching_pois_cs(gdf_poi=gdf_poi_osm, 
+                                                    gdf_cs=gdf_cs,
+                                                    distances_poi_categories=distances_poi_categories)
+        t.rows = mapping_poi_cs.shape[0]
     
     fullpath_mapping_table = os.path.join(dir_save_mapping_table, "mapping_poi_cs.csv")
     logger.info(f"Writing mapping table to directory '{fullpath_mapping_table}'")
-    mapping_poi_cs.to_csv(fullpath_mapping_table, sep=";", index=False)
+    with profiling.profile_stage("to_csv"): 
+        mapping_poi_cs.to_csv(fullpath_mapping_table, sep=";", index=False)
     
     
 
 if __name__ == '__main__': 
     logging.config.dictConfig(LOGGING_CONFIG)
+    metrics.configure(METRICS_FILENAME)
     postprocess_api_results()
-    match_cs_to_poi()
\ No newline at end of file
+    match_cs_to_poi()
+    metrics.METRICS.log_summary()
+    profiling.dump()
\ No newline at end of file
@@ -0,0 +1,175 @@
+import cProfile
+import pstats
+import contextlib
+import functools
+import datetime
+import logging
+import threading
+import tracemalloc
+import typing
+import io
+import os
+
+from settings import DIR_PROFILES
+
+logger = logging.getLogger(__name__)
+
+
+# profiling is enabled if set, e.g. CHARGINGDATA_PROFILE=1 or CHARGINGDATA_PROFILE=<directory of profile dumps>
+ENV_PROFILE = "CHARGINGDATA_PROFILE"
+TOP_N = 15
+
+
+class _StageProfile:
+    """cProfile and tracemalloc measurements of all calls of one stage"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.profile = cProfile.Profile()
+        self.n_calls = 0
+        self.max_allocated_bytes = 0
+        self.snapshot = None
+
+
+class Profiler:
+    """Collects a cProfile profile and the largest net memory allocation of every stage across all its calls
+
+    Nested stages are profiled as part of the enclosing stage only, as only one profiler can be active at a time.
+    Stages run in other threads than the first profiled thread are not profiled.
+    """
+
+    def __init__(self, dir_profiles: str = DIR_PROFILES, top_n: int = TOP_N):
+        self.dir_profiles = dir_profiles
+        self.top_n = top_n
+        self.stages = {}
+        self._active = threading.local()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Profile a block of code as stage `name`"""
+        if getattr(self._active, "stage", None) is not None:
+            yield
+            return
+        with self._lock:
+            stage = self.stages.setdefault(name, _StageProfile(name))
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._active.stage = stage
+        allocated_start = tracemalloc.get_traced_memory()[0]
+        try:
+            stage.profile.enable()
+        except ValueError:
+            # another profiler is active, e.g. in a different thread
+            self._active.stage = None
+            yield
+            return
+        try:
+            yield
+        finally:
+            stage.profile.disable()
+            self._active.stage = None
+            stage.n_calls += 1
+            allocated = tracemalloc.get_traced_memory()[0] - allocated_start
+            # snapshots are expensive, only the call retaining most memory is kept
+            if allocated > stage.max_allocated_bytes:
+                stage.max_allocated_bytes = allocated
+                stage.snapshot = tracemalloc.take_snapshot()
+
+    def summary(self, stage: _StageProfile, sort_by: str = "cumulative") -> str:
+        """Top-N hotspots of a stage by cumulative time and memory"""
+        stream = io.StringIO()
+        stats = pstats.Stats(stage.profile, stream=stream)
+        stream.write(f"Stage '{stage.name}': {stage.n_calls} calls, {stats.total_tt:.3f}s, "
+                     f"max net allocation {stage.max_allocated_bytes / 2**20:.1f} MiB\n")
+        stats.strip_dirs().sort_stats(sort_by).print_stats(self.top_n)
+        if stage.snapshot is not None:
+            stream.write(f"Top {self.top_n} allocations after call with max net allocation:\n")
+            for stat in stage.snapshot.statistics("lineno")[:self.top_n]:
+                stream.write(f"    {stat}\n")
+        return stream.getvalue()
+
+    def dump(self) -> typing.Optional[str]:
+        """Write a pstats dump and a text summary per stage and log the stages ordered by total time
+
+        Returns:
+            typing.Optional[str]: directory of profile dumps or None if no stage was profiled
+        """
+        if not self.stages:
+            return None
+        dir_run = os.path.join(self.dir_profiles, datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+        os.makedirs(dir_run, exist_ok=True)
+
+        stages = sorted(self.stages.values(), key=lambda s: pstats.Stats(s.profile).total_tt, reverse=True)
+        for stage in stages:
+            stage.profile.dump_stats(os.path.join(dir_run, f"{stage.name}.prof"))
+            summary = self.summary(stage)
+            with open(os.path.join(dir_run, f"{stage.name}.txt"), 'w', encoding='utf-8') as f:
+                f.write(summary)
+            logger.info(summary.split("\n")[0])
+        logger.info(f"Wrote profiles of {len(stages)} stages to '{dir_run}'.")
+        return dir_run
+
+
+_PROFILER = None
+
+
+def enable(dir_profiles: str = None, top_n: int = TOP_N) -> Profiler:
+    """Enable profiling of stages
+
+    Args:
+        dir_profiles (str, optional): directory of profile dumps. Defaults to DIR_PROFILES.
+        top_n (int, optional): number of hotspots in summaries. Defaults to TOP_N.
+
+    Returns:
+        Profiler: active profiler
+    """
+    global _PROFILER
+    _PROFILER = Profiler(dir_profiles=dir_profiles or DIR_PROFILES, top_n=top_n)
+    return _PROFILER
+
+
+def is_enabled() -> bool:
+    return _PROFILER is not None
+
+
+@contextlib.contextmanager
+def profile_stage(name: str):
+    """Profile a block of code as stage `name` if profiling is enabled, otherwise do nothing"""
+    if _PROFILER is None:
+        yield
+        return
+    with _PROFILER.stage(name):
+        yield
+
+
+def profiled(name: str = None) -> typing.Callable:
+    """Decorator profiling every call of a function as stage if profiling is enabled
+
+    Args:
+        name (str, optional): name of stage. Defaults to name of function.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _PROFILER is None:
+                return func(*args, **kwargs)
+            with _PROFILER.stage(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def dump() -> typing.Optional[str]:
+    """Write profiles of all stages if profiling is enabled
+
+    Returns:
+        typing.Optional[str]: directory of profile dumps or None
+    """
+    if _PROFILER is None:
+        return None
+    return _PROFILER.dump()
+
+
+if os.environ.get(ENV_PROFILE):
+    enable(dir_profiles=None if os.environ[ENV_PROFILE] == "1" else os.environ[ENV_PROFILE])
@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+import dataclasses
+import logging
+import typing
+
+from downsampling import POLLING_INTERVAL, MAX_GAP
+from sessions import SESSION_STATUSES, UNKNOWN_STATUSES
+
+logger = logging.getLogger(__name__)
+
+
+# code of time buckets without a status, neither observed nor forward-filled
+MISSING = -1
+MAX_CATEGORIES = np.iinfo(np.int8).max
+
+
+@dataclasses.dataclass
+class StatusGrid:
+    """Dense matrix of status codes with one row per charging point or connector and one column per time bucket
+
+    Attributes:
+        codes (np.ndarray): int8 matrix of shape (n_ids, n_buckets) with codes into categories, MISSING if unknown
+        ids (pd.Index): ids of rows
+        buckets (pd.DatetimeIndex): start of time buckets (UTC) of columns
+        categories (pd.Index): statuses of codes
+        freq (int): length of time buckets in seconds
+    """
+    codes: np.ndarray
+    ids: pd.Index
+    buckets: pd.DatetimeIndex
+    categories: pd.Index
+    freq: int
+
+    def mask(self, statuses: typing.List[str]) -> np.ndarray:
+        """Boolean matrix of buckets with any of the statuses"""
+        return np.isin(self.codes, self.categories.get_indexer(statuses))
+
+    def known(self, unknown_statuses: typing.List[str] = UNKNOWN_STATUSES) -> np.ndarray:
+        """Boolean matrix of buckets with a status other than MISSING and unknown_statuses"""
+        return (self.codes != MISSING) & ~self.mask(unknown_statuses)
+
+    def occupancy(self,
+                  statuses: typing.List[str] = SESSION_STATUSES,
+                  unknown_statuses: typing.List[str] = UNKNOWN_STATUSES,
+                  axis: int = 0) -> np.ndarray:
+        """Share of known buckets with an occupied status
+
+        Args:
+            statuses (typing.List[str], optional): occupied statuses. Defaults to SESSION_STATUSES.
+            unknown_statuses (typing.List[str], optional): statuses excluded like missing buckets. Defaults to UNKNOWN_STATUSES.
+            axis (int, optional): 0 for occupancy per time bucket across ids, 1 for occupancy per id across time. Defaults to 0.
+
+        Returns:
+            np.ndarray: occupancy, NaN where no bucket is known
+        """
+        n_known = self.known(unknown_statuses).sum(axis=axis)
+        n_occupied = self.mask(statuses).sum(axis=axis)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(n_known > 0, n_occupied / n_known, np.nan)
+
+    def coverage(self, axis: int = 0) -> np.ndarray:
+        """Share of buckets with a status, i.e. not MISSING"""
+        return (self.codes != MISSING).mean(axis=axis)
+
+    def status_counts(self, axis: int = 0) -> DataFrame:
+        """Number of buckets per status, with column 'MISSING' for buckets without status
+
+        Args:
+            axis (int, optional): 0 for counts per time bucket, 1 for counts per id. Defaults to 0.
+
+        Returns:
+            DataFrame: counts indexed by time buckets (axis=0) or ids (axis=1)
+        """
+        counts = {status: (self.codes == code).sum(axis=axis) for code, status in enumerate(self.categories)}
+        counts["MISSING"] = (self.codes == MISSING).sum(axis=axis)
+        return DataFrame(counts, index=self.buckets if axis == 0 else self.ids)
+
+    def to_frame(self) -> DataFrame:
+        """Long format with columns id, bucket and categorical status, NaN for missing buckets"""
+        return DataFrame({"id": np.repeat(self.ids.to_numpy(), len(self.buckets)),
+                          "bucket": np.tile(self.buckets, len(self.ids)),
+                          "status": pd.Categorical.from_codes(self.codes.ravel(), categories=self.categories)})
+
+
+def _to_utc(timestamp: typing.Union[str, pd.Timestamp]) -> pd.Timestamp:
+    timestamp = pd.Timestamp(timestamp)
+    return timestamp.tz_localize("UTC") if timestamp.tzinfo is None else timestamp.tz_convert("UTC")
+
+
+def _forward_fill(codes: np.ndarray, max_fill: int) -> np.ndarray:
+    """Forward-fill MISSING codes along rows for at most max_fill buckets after the last observation"""
+    n_buckets = codes.shape[1]
+    cols = np.arange(n_buckets)
+    idx_last = np.where(codes != MISSING, cols, -1)
+    np.maximum.accumulate(idx_last, axis=1, out=idx_last)
+    filled = np.take_along_axis(codes, np.maximum(idx_last, 0), axis=1)
+    valid = (idx_last >= 0) & (cols - idx_last <= max_fill)
+    return np.where(valid, filled, MISSING).astype(np.int8)
+
+
+def resample_status(df_status: DataFrame,
+                    freq: int = POLLING_INTERVAL,
+                    start: typing.Union[str, pd.Timestamp] = None,
+                    end: typing.Union[str, pd.Timestamp] = None,
+                    max_gap: float = MAX_GAP,
+                    categories: typing.List[str] = None,
+                    col_id: str = "id",
+                    col_status: str = "status",
+                    col_time: str = "timestamp") -> StatusGrid:
+    """Resample status records onto a regular time grid
+
+    Every bucket gets the last status observed within it. Buckets without observation get the last observed status
+    if it was observed at most max_gap seconds before the bucket, otherwise MISSING. Irregular polling and failed
+    API calls therefore do not bias shares computed from the grid.
+
+    Args:
+        df_status (DataFrame): status records, e.g. output of `extract_status`
+        freq (int, optional): length of time buckets in seconds. Defaults to POLLING_INTERVAL.
+        start (typing.Union[str, pd.Timestamp], optional): start of first bucket. Naive timestamps are interpreted as UTC. Defaults to first record floored to freq.
+        end (typing.Union[str, pd.Timestamp], optional): end of time grid (exclusive). Defaults to last record.
+        max_gap (float, optional): maximum time in seconds a status is carried forward, 0 to disable forward-filling. Defaults to MAX_GAP.
+        categories (typing.List[str], optional): statuses of codes, e.g. to align grids. Statuses not contained are MISSING. Defaults to statuses of df_status.
+        col_id (str, optional): name of id column. Defaults to "id".
+        col_status (str, optional): name of status column. Defaults to "status".
+        col_time (str, optional): name of time column. Defaults to "timestamp".
+
+    Raises:
+        ValueError: Raised if there are more than MAX_CATEGORIES statuses
+
+    Returns:
+        StatusGrid: dense status matrix
+    """
+    ts = pd.DatetimeIndex(pd.to_datetime(df_status[col_time], utc=True)).asi8
+    status = pd.Categorical(df_status[col_status], categories=categories)
+    if len(status.categories) > MAX_CATEGORIES:
+        raise ValueError(f"At most {MAX_CATEGORIES} statuses are supported, but there are {len(status.categories)}.")
+    id_codes, ids = pd.factorize(df_status[col_id], sort=True)
+
+    freq_ns = int(freq * 1e9)
+    if start is not None:
+        t_start = _to_utc(start).value
+    else:
+        t_start = (ts.min() // freq_ns) * freq_ns if ts.size else 0
+    if end is not None:
+        t_end = _to_utc(end).value
+    else:
+        t_end = ts.max() + 1 if ts.size else t_start
+    n_buckets = max(int(-(-(t_end - t_start) // freq_ns)), 0)
+    buckets = pd.date_range(pd.Timestamp(t_start, tz="UTC"), periods=n_buckets, freq=f"{int(freq)}s")
+
+    codes = np.full((len(ids), n_buckets), MISSING, dtype=np.int8)
+    bucket_codes = (ts - t_start) // freq_ns
+    in_range = (bucket_codes >= 0) & (bucket_codes < n_buckets)
+    cells = id_codes[in_range].astype(np.int64) * n_buckets + bucket_codes[in_range]
+    # the last record of a cell wins, as the order of repeated assignments to a cell is undefined in numpy
+    order = np.lexsort((ts[in_range], cells))
+    is_last = np.ones(order.size, dtype=bool)
+    is_last[:-1] = cells[order][1:] != cells[order][:-1]
+    idx = order[is_last]
+    codes.ravel()[cells[idx]] = status.codes[in_range][idx]
+
+    if max_gap > 0 and n_buckets > 0:
+        codes = _forward_fill(codes, max_fill=int(max_gap // freq))
+
+    logger.debug(f"Resampled {ts.size} status records to grid of {len(ids)} ids x {n_buckets} buckets.")
+    return StatusGrid(codes=codes, ids=pd.Index(ids), buckets=buckets, categories=status.categories, freq=int(freq))
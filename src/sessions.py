@@ -0,0 +1,214 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+import logging
+import typing
+import os
+
+from downsampling import MAX_GAP
+
+logger = logging.getLogger(__name__)
+
+
+# statuses of a charging point or connector occupied by a charging vehicle
+SESSION_STATUSES = ["CHARGING"]
+# statuses which do not tell whether a vehicle is charging, sessions next to them are censored
+UNKNOWN_STATUSES = ["UNKNOWN"]
+
+ENTITY_CP = "cp"
+ENTITY_CONNECTOR = "connector"
+
+FNAME_SESSIONS = "charging_sessions.csv"
+# last status record of every id and its open session, carried over to the next incremental run
+FNAME_SESSIONS_STATE = "charging_sessions_state.csv"
+
+COLS_SESSIONS = ["entity", "id", "session_start", "session_end", "duration_seconds", "n_samples",
+                 "censored_start", "censored_end"]
+COLS_STATE = ["id", "status", "timestamp", "run_start", "run_start_censored", "run_samples"]
+
+
+def _empty_state() -> DataFrame:
+    return DataFrame({"id": pd.Series(dtype=object),
+                      "status": pd.Series(dtype=object),
+                      "timestamp": pd.Series(dtype="datetime64[ns, UTC]"),
+                      "run_start": pd.Series(dtype="datetime64[ns, UTC]"),
+                      "run_start_censored": pd.Series(dtype=bool),
+                      "run_samples": pd.Series(dtype=np.int64)})
+
+
+def _to_epoch_ns(timestamps: typing.Union[pd.Series, np.ndarray]) -> np.ndarray:
+    """Convert timestamps to UTC nanoseconds since epoch without creating Timestamp objects"""
+    return pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True)).asi8
+
+
+def reconstruct_sessions(df_status: DataFrame,
+                         carry_over: DataFrame = None,
+                         session_statuses: typing.List[str] = SESSION_STATUSES,
+                         unknown_statuses: typing.List[str] = UNKNOWN_STATUSES,
+                         max_gap: float = MAX_GAP,
+                         flush: bool = False,
+                         col_id: str = "id",
+                         col_status: str = "status",
+                         col_time: str = "timestamp") -> typing.Tuple[DataFrame, DataFrame]:
+    """Reconstruct charging sessions from the status history of charging points or connectors
+
+    A session is a run of consecutive records of an id with a session status. It starts at its first record and ends
+    at the first record with a different status. The start (end) is censored if the session is preceded (followed) by
+    an unknown status, a gap longer than max_gap or the begin of the data, as the true start (end) is not observed.
+    Sessions still running at the last record of an id are not returned but carried over to the next call.
+
+    Args:
+        df_status (DataFrame): status records of charging points or connectors in any order
+        carry_over (DataFrame, optional): carry-over returned by the previous call. Records not newer than the carried over record of their id are skipped. Defaults to None.
+        session_statuses (typing.List[str], optional): statuses of an occupied charging point. Defaults to SESSION_STATUSES.
+        unknown_statuses (typing.List[str], optional): statuses censoring adjacent sessions. Defaults to UNKNOWN_STATUSES.
+        max_gap (float, optional): maximum time between two records in seconds before a session is interrupted. Defaults to MAX_GAP.
+        flush (bool, optional): whether to return running sessions as censored at their last record instead of carrying them over. Defaults to False.
+        col_id (str, optional): name of id column. Defaults to "id".
+        col_status (str, optional): name of status column. Defaults to "status".
+        col_time (str, optional): name of time column. Defaults to "timestamp".
+
+    Returns:
+        typing.Tuple[DataFrame, DataFrame]: finished sessions and carry-over of the last record of every id
+    """
+    # timestamps are handled as int64 nanoseconds, tz-aware columns would be converted to Timestamp objects
+    df = DataFrame({"id": df_status[col_id].astype(str).to_numpy(),
+                    "status": df_status[col_status].to_numpy(),
+                    "timestamp": _to_epoch_ns(df_status[col_time])})
+    df["carried"] = False
+    if carry_over is not None and carry_over.shape[0] > 0:
+        df_carried = carry_over.assign(timestamp=_to_epoch_ns(carry_over["timestamp"]),
+                                       run_start=_to_epoch_ns(carry_over["run_start"]),
+                                       carried=True)
+        last_ts = df["id"].map(df_carried.set_index("id")["timestamp"])
+        is_old = (df["timestamp"] <= last_ts).to_numpy()
+        if is_old.any():
+            logger.info(f"Skipping {is_old.sum()} status records not newer than the carried over state.")
+            df = df[~is_old]
+        df = pd.concat([df_carried, df], ignore_index=True)
+
+    df.sort_values(["id", "timestamp", "carried"], ascending=[True, True, False], kind="stable", inplace=True)
+    df.reset_index(drop=True, inplace=True)
+    n = df.shape[0]
+    if n == 0:
+        return DataFrame(columns=COLS_SESSIONS[1:]), _empty_state()
+
+    ids = df["id"].to_numpy()
+    status = df["status"].to_numpy()
+    ts = df["timestamp"].to_numpy(dtype=np.int64)
+
+    new_id = np.ones(n, dtype=bool)
+    new_id[1:] = ids[1:] != ids[:-1]
+    gap = np.zeros(n, dtype=bool)
+    gap[1:] = (ts[1:] - ts[:-1]) > max_gap * 1e9
+    gap &= ~new_id
+    boundary = new_id | gap
+    boundary[1:] |= status[1:] != status[:-1]
+
+    is_unknown = np.isin(status, unknown_statuses)
+    starts = np.flatnonzero(boundary)
+    ends = np.r_[starts[1:] - 1, n - 1]
+    # first index of the next run of the same id, n if the run is the last of its id
+    nexts = ends + 1
+    has_next = nexts < n
+    has_next[has_next] = ~new_id[nexts[has_next]]
+
+    run_start = ts[starts]
+    run_samples = ends - starts + 1
+    run_start_censored = new_id[starts] | gap[starts]
+    run_start_censored[starts > 0] |= is_unknown[starts[starts > 0] - 1]
+    # runs continuing a run of the previous call keep its start
+    carried = df["carried"].to_numpy()[starts]
+    if carried.any():
+        idx_carried = np.flatnonzero(carried)
+        run_start[idx_carried] = df["run_start"].to_numpy()[starts[idx_carried]].astype(np.int64)
+        run_start_censored[idx_carried] = df["run_start_censored"].to_numpy()[starts[idx_carried]].astype(bool)
+        run_samples[idx_carried] += df["run_samples"].to_numpy()[starts[idx_carried]].astype(np.int64) - 1
+
+    is_session = np.isin(status[starts], session_statuses)
+    is_finished = has_next | flush
+    mask = is_session & is_finished
+    idx_next = np.minimum(nexts, n - 1)
+    interrupted = ~has_next | gap[idx_next]
+    run_end = np.where(interrupted, ts[ends], ts[idx_next])
+    run_end_censored = interrupted | is_unknown[idx_next]
+
+    df_sessions = DataFrame({"id": ids[starts[mask]],
+                             "session_start": pd.to_datetime(run_start[mask], utc=True),
+                             "session_end": pd.to_datetime(run_end[mask], utc=True),
+                             "duration_seconds": (run_end[mask] - run_start[mask]) / 1e9,
+                             "n_samples": run_samples[mask],
+                             "censored_start": run_start_censored[mask],
+                             "censored_end": run_end_censored[mask]})
+
+    last_runs = ~has_next
+    df_state = DataFrame({"id": ids[ends[last_runs]],
+                          "status": status[ends[last_runs]],
+                          "timestamp": pd.to_datetime(ts[ends[last_runs]], utc=True),
+                          "run_start": pd.to_datetime(run_start[last_runs], utc=True),
+                          "run_start_censored": run_start_censored[last_runs],
+                          "run_samples": run_samples[last_runs]})
+    return df_sessions, df_state
+
+
+def _read_state(fullpath_state: str, storage_options: dict = None) -> typing.Dict[str, DataFrame]:
+    """Read carry-over of incremental session reconstruction per entity"""
+    try:
+        df_state = pd.read_csv(fullpath_state, sep=";", dtype={"id": str}, storage_options=storage_options)
+    except FileNotFoundError:
+        return {}
+    for col in ["timestamp", "run_start"]:
+        df_state[col] = pd.to_datetime(df_state[col], utc=True)
+    return {entity: df[COLS_STATE].reset_index(drop=True) for entity, df in df_state.groupby("entity")}
+
+
+def update_sessions(status_by_entity: typing.Dict[str, DataFrame],
+                    dir_sessions: str,
+                    flush: bool = False,
+                    max_gap: float = MAX_GAP,
+                    storage_options: dict = None) -> int:
+    """Incrementally reconstruct charging sessions from new status records
+
+    Sessions finished within the new status records are written to FNAME_SESSIONS, replacing the sessions of the
+    previous run. The last record and running session of every id are kept in FNAME_SESSIONS_STATE in the same
+    directory and continued by the next run.
+
+    Args:
+        status_by_entity (typing.Dict[str, DataFrame]): status records per entity, e.g. {'cp': df_status_cps, 'connector': df_status_connectors}
+        dir_sessions (str): directory of sessions and carry-over state
+        flush (bool, optional): whether to write running sessions as censored instead of carrying them over. Defaults to False.
+        max_gap (float, optional): maximum time between two records in seconds before a session is interrupted. Defaults to MAX_GAP.
+        storage_options (dict, optional): storage options when reading from and writing to S3. Defaults to None.
+
+    Returns:
+        int: number of written sessions
+    """
+    fullpath_state = os.path.join(dir_sessions, FNAME_SESSIONS_STATE)
+    states = _read_state(fullpath_state, storage_options=storage_options)
+
+    sessions = []
+    for entity, df_status in status_by_entity.items():
+        df_sessions, states[entity] = reconstruct_sessions(df_status,
+                                                           carry_over=states.get(entity),
+                                                           max_gap=max_gap,
+                                                           flush=flush)
+        sessions.append(df_sessions.assign(entity=entity))
+        logger.debug(f"Reconstructed {df_sessions.shape[0]} sessions of entity '{entity}'.")
+    df_sessions = pd.concat(sessions, ignore_index=True)[COLS_SESSIONS]
+
+    if storage_options is None:
+        os.makedirs(dir_sessions, exist_ok=True)
+    fullpath_sessions = os.path.join(dir_sessions, FNAME_SESSIONS)
+    logger.info(f"Saving {df_sessions.shape[0]} charging sessions to '{fullpath_sessions}'")
+    df_sessions.to_csv(fullpath_sessions, sep=";", index=False, storage_options=storage_options)
+
+    # state is replaced atomically after the sessions are written, so an interrupted run can be repeated. Objects in
+    # S3 are replaced atomically by every write.
+    df_state = pd.concat([df.assign(entity=entity) for entity, df in states.items()], ignore_index=True)
+    if storage_options is not None:
+        df_state.to_csv(fullpath_state, sep=";", index=False, storage_options=storage_options)
+    else:
+        fullpath_tmp = fullpath_state + ".tmp"
+        df_state.to_csv(fullpath_tmp, sep=";", index=False)
+        os.replace(fullpath_tmp, fullpath_state)
+    return df_sessions.shape[0]
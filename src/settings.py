@@ -1,4 +1,42 @@
-INFO_LOG_FILENAME = "chargecloud_api.log"
+import os
+
+# paths are relative to the repository root, so commands can be run from any working directory
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIR_DATA = os.path.join(ROOT_DIR, "data")
+CONFIG_FILE = os.path.join(ROOT_DIR, "config.cfg")
+DIR_SAVE_API_RESULTS = os.path.join(DIR_DATA, "scraped_data")
+# per tick snapshots merged from the city shards of several scraper nodes, see partitioning.py
+DIR_MERGED_API_RESULTS = os.path.join(DIR_DATA, "merged_data")
+DIR_SAVE_OSM = os.path.join(DIR_DATA, "osm")
+DIR_STATUS_LOG = os.path.join(DIR_DATA, "status_log")
+DIR_PROFILES = os.path.join(DIR_DATA, "profiles")
+DIR_TRANSITIONS = os.path.join(DIR_DATA, "transitions")
+DIR_FEATURES = os.path.join(DIR_DATA, "features")
+
+# defaults of the scraper, shared by get_chargecloud_data.py and the command line
+BASE_URL_CHARGECLOUD = "https://new-poi.chargecloud.de"
+# interval in minutes between API lookups
+SCRAPING_INTERVAL = 10
+# connect and read timeout in seconds of a single request
+REQUEST_TIMEOUT = (5, 30)
+MAX_RETRIES = 3
+FNAME_TRANSITIONS = "transitions.jsonl"
+FNAME_TRANSITIONS_DB = "transitions.sqlite"
+# lease table of scraper nodes sharing the cities and seconds after the end of a tick until it is merged
+FNAME_LEASE_DB = "leases.sqlite"
+MERGE_MIN_AGE = 60
+
+# local JSON API of the latest status of charging points, see latest_status.py
+LATEST_STATUS_HOST = "127.0.0.1"
+LATEST_STATUS_PORT = 8765
+# seconds between reads of new records of the status log
+LATEST_STATUS_POLL_INTERVAL = 5
+
+INFO_LOG_FILENAME = os.path.join(ROOT_DIR, "chargecloud_api.log")
+# timings and counters of each run are appended as JSON lines
+METRICS_FILENAME = os.path.join(DIR_DATA, "metrics.jsonl")
+# port of the Prometheus endpoint of long-running commands
+PROMETHEUS_PORT = 9108
 
 LOGGING_CONFIG = {
     "version": 1,
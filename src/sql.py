@@ -4,6 +4,8 @@ import pandas as pd
 import logging
 import typing 
 
+from downsampling import POLLING_INTERVAL, MAX_GAP
+
 logger = logging.getLogger(__name__)
 
 TEMPLATE_TEST_CASE_ROW_COUNT = "select count(*) > 0 from {SCHEMA}.{TABLE_NAME}"
@@ -23,6 +25,8 @@ class DataIngester:
     populate_table: str
     drop_constraints: str = None
     data_test_cases: typing.List[DataTestCase] = None
+    # build into shadow table {TABLE_NAME}, test and rename it to table_name, instead of dropping table_name first
+    swap: bool = False
  
 
 SQL_CONSTRAINTS = """ select tco.constraint_SCHEMA,
@@ -45,10 +49,10 @@ DROP_TABLE_STAGING_STATUS_CHARGING_POINTS = """DROP TABLE IF EXISTS {SCHEMA}.sta
 CREATE_TABLE_STAGING_STATUS_CHARGING_POINTS = """ 
                              CREATE TABLE IF NOT EXISTS {SCHEMA}.staging_status_cp 
                              (
+                              snapshot_id                INTEGER       NOT NULL, 
+                              id_code                    INTEGER       NOT NULL, 
                               status_cp                  VARCHAR       NOT NULL, 
-                              id_cp                      VARCHAR       NOT NULL, 
-                              parkingsensor_status       VARCHAR, 
-                              ts                         TIMESTAMPTZ   NOT NULL
+                              parkingsensor_status       VARCHAR
                              )
 """
 
@@ -76,9 +80,9 @@ DROP_TABLE_STAGING_STATUS_CONNECTORS = """DROP TABLE IF EXISTS {SCHEMA}.staging_
 CREATE_TABLE_STAGING_STATUS_CONNECTORS = """ 
                              CREATE TABLE IF NOT EXISTS {SCHEMA}.staging_status_connectors
                              (
-                              status_connector  VARCHAR       NOT NULL, 
-                              id_connector      VARCHAR       NOT NULL, 
-                              ts                TIMESTAMPTZ   NOT NULL
+                              snapshot_id       INTEGER       NOT NULL, 
+                              id_code           INTEGER       NOT NULL, 
+                              status_connector  VARCHAR       NOT NULL
                              )
 """
 
@@ -101,6 +105,127 @@ staging_status_connectors = DataIngester(table_name="staging_status_connectors",
                                          data_test_cases=DATA_TEST_CASES_STAGING_STATUS_CONN)
 
 
+DROP_TABLE_STAGING_SNAPSHOTS = """DROP TABLE IF EXISTS {SCHEMA}.staging_snapshot"""
+
+CREATE_TABLE_STAGING_SNAPSHOTS = """ 
+                             CREATE TABLE IF NOT EXISTS {SCHEMA}.staging_snapshot
+                             (
+                              snapshot_id       INTEGER       NOT NULL, 
+                              ts                TIMESTAMPTZ   NOT NULL
+                             )
+                             DISTSTYLE ALL
+"""
+
+COPY_TABLE_STAGING_SNAPSHOTS = """COPY {SCHEMA}.staging_snapshot
+                                  FROM '{SNAPSHOTS}'
+                                  CREDENTIALS 'aws_iam_role={ROLE_ARN}'
+                                  REGION 'us-east-2' 
+                                  DELIMITER ';' IGNOREHEADER 1;
+"""
+
+DATA_TEST_CASES_STAGING_SNAPSHOTS = [DataTestCase(name="row_count_staging_snapshot", 
+                                                  sql=TEMPLATE_TEST_CASE_ROW_COUNT)]
+
+# timestamps of the status data, referenced by snapshot_id from the staging status tables
+staging_snapshots = DataIngester(table_name="staging_snapshot", 
+                                 drop_table=DROP_TABLE_STAGING_SNAPSHOTS, 
+                                 create_table=CREATE_TABLE_STAGING_SNAPSHOTS, 
+                                 populate_table=COPY_TABLE_STAGING_SNAPSHOTS,
+                                 data_test_cases=DATA_TEST_CASES_STAGING_SNAPSHOTS)
+
+
+DROP_TABLE_STAGING_IDS = """DROP TABLE IF EXISTS {{SCHEMA}}.staging_ids_{entity}"""
+
+CREATE_TABLE_STAGING_IDS = """ 
+                             CREATE TABLE IF NOT EXISTS {{SCHEMA}}.staging_ids_{entity}
+                             (
+                              id_code           INTEGER       NOT NULL, 
+                              id                VARCHAR       NOT NULL
+                             )
+                             DISTSTYLE ALL
+"""
+
+COPY_TABLE_STAGING_IDS = """COPY {{SCHEMA}}.staging_ids_{entity}
+                            FROM '{{{config_key}}}'
+                            CREDENTIALS 'aws_iam_role={{ROLE_ARN}}'
+                            REGION 'us-east-2' 
+                            DELIMITER ';' IGNOREHEADER 1;
+"""
+
+# ids of charging points and connectors, referenced by id_code from the staging status tables
+staging_ids_cp, staging_ids_connector = [
+    DataIngester(table_name=f"staging_ids_{entity}", 
+                 drop_table=DROP_TABLE_STAGING_IDS.format(entity=entity), 
+                 create_table=CREATE_TABLE_STAGING_IDS.format(entity=entity), 
+                 populate_table=COPY_TABLE_STAGING_IDS.format(entity=entity, config_key=config_key),
+                 data_test_cases=[DataTestCase(name=f"row_count_staging_ids_{entity}", 
+                                               sql=TEMPLATE_TEST_CASE_ROW_COUNT)])
+    for entity, config_key in [("cp", "IDS_CHARGING_POINTS"), ("connector", "IDS_CONNECTORS")]]
+
+
+DROP_TABLE_STAGING_CHARGING_SESSIONS = """DROP TABLE IF EXISTS {SCHEMA}.staging_charging_session"""
+
+CREATE_TABLE_STAGING_CHARGING_SESSIONS = """ 
+                             CREATE TABLE IF NOT EXISTS {SCHEMA}.staging_charging_session
+                             (
+                              entity            VARCHAR       NOT NULL, 
+                              id                VARCHAR       NOT NULL, 
+                              session_start     TIMESTAMPTZ   NOT NULL, 
+                              session_end       TIMESTAMPTZ   NOT NULL, 
+                              duration_seconds  FLOAT         NOT NULL, 
+                              n_samples         INTEGER       NOT NULL, 
+                              censored_start    BOOLEAN       NOT NULL, 
+                              censored_end      BOOLEAN       NOT NULL
+                             )
+"""
+
+COPY_TABLE_STAGING_CHARGING_SESSIONS = """COPY {SCHEMA}.staging_charging_session
+                                          FROM '{CHARGING_SESSIONS}'
+                                          CREDENTIALS 'aws_iam_role={ROLE_ARN}'
+                                          REGION 'us-east-2' 
+                                          DELIMITER ';' IGNOREHEADER 1;
+"""
+
+# sessions are reconstructed incrementally, a load without new sessions is valid
+staging_charging_sessions = DataIngester(table_name="staging_charging_session", 
+                                         drop_table=DROP_TABLE_STAGING_CHARGING_SESSIONS, 
+                                         create_table=CREATE_TABLE_STAGING_CHARGING_SESSIONS, 
+                                         populate_table=COPY_TABLE_STAGING_CHARGING_SESSIONS)
+
+
+DROP_TABLE_STAGING_TIME = """DROP TABLE IF EXISTS {SCHEMA}.staging_time"""
+
+CREATE_TABLE_STAGING_TIME = """ 
+                             CREATE TABLE IF NOT EXISTS {SCHEMA}.staging_time
+                             (
+                              query_time        TIMESTAMPTZ   NOT NULL, 
+                              "hour"            INTEGER, 
+                              "day"             INTEGER, 
+                              week              INTEGER, 
+                              "month"           INTEGER, 
+                              "year"            INTEGER, 
+                              weekday           INTEGER
+                             )
+"""
+
+COPY_TABLE_STAGING_TIME = """COPY {SCHEMA}.staging_time
+                             FROM '{TIME_DATA}'
+                             CREDENTIALS 'aws_iam_role={ROLE_ARN}'
+                             REGION 'us-east-2' 
+                             DELIMITER ';' IGNOREHEADER 1;
+"""
+
+DATA_TEST_CASES_STAGING_TIME = [DataTestCase(name="row_count_staging_time", 
+                                             sql=TEMPLATE_TEST_CASE_ROW_COUNT)]
+
+# distinct query times of the status data, date parts are computed during preprocessing
+staging_time = DataIngester(table_name="staging_time", 
+                            drop_table=DROP_TABLE_STAGING_TIME, 
+                            create_table=CREATE_TABLE_STAGING_TIME, 
+                            populate_table=COPY_TABLE_STAGING_TIME,
+                            data_test_cases=DATA_TEST_CASES_STAGING_TIME)
+
+
 DROP_TABLE_STAGING_CHARGING_STATIONS = """DROP TABLE IF EXISTS {SCHEMA}.staging_charging_stations"""
 
 CREATE_TABLE_STAGING_CHARGING_STATIONS = """
@@ -212,27 +337,27 @@ staging_charging_connectors = DataIngester(table_name="staging_connectors",
 
 DROP_TABLE_STATUS_CHARGING_POINTS = "DROP TABLE IF EXISTS {SCHEMA}.status_chargingpoints"
 
-CREATE_TABLE_STATUS_CHARGING_POINTS = """CREATE TABLE IF NOT EXISTS {SCHEMA}.status_chargingpoints
+CREATE_TABLE_STATUS_CHARGING_POINTS = """CREATE TABLE IF NOT EXISTS {SCHEMA}.{TABLE_NAME}
                                         (
                                          id_status_cp               VARCHAR NOT NULL, 
                                          id_chargingpoint           VARCHAR NOT NULL, 
                                          query_time                 TIMESTAMPTZ NOT NULL, 
                                          status_cp                  VARCHAR, 
                                          status_parkingsensor       VARCHAR, 
-                                         CONSTRAINT status_chargingpoints_pkey PRIMARY KEY (id_status_cp)
+                                         CONSTRAINT {TABLE_NAME}_pkey PRIMARY KEY (id_status_cp)
                                         ) 
 """
 
-DROP_STATUS_CP_PKEY = "ALTER TABLE {SCHEMA}.status_chargingpoints DROP CONSTRAINT status_chargingpoints_pkey"
-
-INSERT_TABLE_STATUS_CHARGING_POINTS = """INSERT INTO {SCHEMA}.status_chargingpoints (
+INSERT_TABLE_STATUS_CHARGING_POINTS = """INSERT INTO {SCHEMA}.{TABLE_NAME} (
                                                 SELECT 
-                                                    md5(id_cp || ts) id_status_cp,
-                                                    id_cp as id_chargingpoint, 
-                                                    ts as query_time, 
-                                                    status_cp, 
-                                                    parkingsensor_status as status_parkingsensor 
-                                                FROM staging_status_cp)
+                                                    md5(ids.id || sn.ts) id_status_cp,
+                                                    ids.id as id_chargingpoint, 
+                                                    sn.ts as query_time, 
+                                                    s.status_cp, 
+                                                    s.parkingsensor_status as status_parkingsensor 
+                                                FROM staging_status_cp s
+                                                JOIN staging_snapshot sn ON sn.snapshot_id = s.snapshot_id
+                                                JOIN staging_ids_cp ids ON ids.id_code = s.id_code)
 """ 
 
 
@@ -244,31 +369,32 @@ status_chargingpoints = DataIngester(table_name="status_chargingpoints",
                                      drop_table=DROP_TABLE_STATUS_CHARGING_POINTS, 
                                      create_table=CREATE_TABLE_STATUS_CHARGING_POINTS, 
                                      populate_table=INSERT_TABLE_STATUS_CHARGING_POINTS, 
-                                     drop_constraints=DROP_STATUS_CP_PKEY, 
-                                     data_test_cases=DATA_TEST_CASES_STATUS_CP
+                                     data_test_cases=DATA_TEST_CASES_STATUS_CP, 
+                                     swap=True
                                      )
 
 
 DROP_TABLE_STATUS_CONNECTORS = "DROP TABLE IF EXISTS {SCHEMA}.status_connectors"
-DROP_STATUS_CONN_PKEY = "ALTER TABLE {SCHEMA}.status_connectors DROP CONSTRAINT status_connectors_pkey"
 
-CREATE_TABLE_STATUS_CONNECTORS = """CREATE TABLE IF NOT EXISTS {SCHEMA}.status_connectors
+CREATE_TABLE_STATUS_CONNECTORS = """CREATE TABLE IF NOT EXISTS {SCHEMA}.{TABLE_NAME}
                                     (
                                      id_status_connector                VARCHAR NOT NULL, 
                                      id_connector                       VARCHAR NOT NULL, 
                                      query_time                         TIMESTAMPTZ NOT NULL, 
                                      status_connector                   VARCHAR, 
-                                     CONSTRAINT status_connectors_pkey PRIMARY KEY (id_status_connector)
+                                     CONSTRAINT {TABLE_NAME}_pkey PRIMARY KEY (id_status_connector)
                                     ) 
 """
 
-INSERT_TABLE_STATUS_CONNECTORS = """INSERT INTO {SCHEMA}.status_connectors (
+INSERT_TABLE_STATUS_CONNECTORS = """INSERT INTO {SCHEMA}.{TABLE_NAME} (
                                                 SELECT 
-                                                    md5(id_connector || ts) id_status_cp,
-                                                    id_connector, 
-                                                    ts as query_time, 
-                                                    status_connector
-                                                FROM staging_status_connectors)
+                                                    md5(ids.id || sn.ts) id_status_cp,
+                                                    ids.id as id_connector, 
+                                                    sn.ts as query_time, 
+                                                    s.status_connector
+                                                FROM staging_status_connectors s
+                                                JOIN staging_snapshot sn ON sn.snapshot_id = s.snapshot_id
+                                                JOIN staging_ids_connector ids ON ids.id_code = s.id_code)
 """ 
 
 DATA_TEST_CASES_STATUS_CONN = [DataTestCase(name="row_count_status_conn", 
@@ -278,17 +404,65 @@ status_connectors = DataIngester(table_name="status_connectors",
                                  drop_table=DROP_TABLE_STATUS_CONNECTORS, 
                                  create_table=CREATE_TABLE_STATUS_CONNECTORS, 
                                  populate_table=INSERT_TABLE_STATUS_CONNECTORS, 
-                                 drop_constraints=DROP_STATUS_CONN_PKEY, 
-                                 data_test_cases=DATA_TEST_CASES_STATUS_CONN
+                                 data_test_cases=DATA_TEST_CASES_STATUS_CONN, 
+                                 swap=True
                                  )
 
 
+CREATE_TABLE_CHARGING_SESSION = """CREATE TABLE IF NOT EXISTS {SCHEMA}.charging_session
+                                   (
+                                    id_session              VARCHAR NOT NULL, 
+                                    entity                  VARCHAR NOT NULL, 
+                                    id                      VARCHAR NOT NULL, 
+                                    session_start           TIMESTAMPTZ NOT NULL, 
+                                    session_end             TIMESTAMPTZ NOT NULL, 
+                                    duration_seconds        FLOAT NOT NULL, 
+                                    n_samples               INTEGER NOT NULL, 
+                                    censored_start          BOOLEAN NOT NULL, 
+                                    censored_end            BOOLEAN NOT NULL, 
+                                    CONSTRAINT charging_session_pkey PRIMARY KEY (id_session)
+                                   )
+                                   DISTKEY (id)
+                                   SORTKEY (session_start)
+"""
+
+# sessions already loaded, e.g. by a repeated load, are not inserted again
+INSERT_TABLE_CHARGING_SESSION = """INSERT INTO {SCHEMA}.charging_session (
+                                        SELECT 
+                                            md5(s.entity || s.id || s.session_start::varchar) as id_session, 
+                                            s.entity, 
+                                            s.id, 
+                                            s.session_start, 
+                                            s.session_end, 
+                                            s.duration_seconds, 
+                                            s.n_samples, 
+                                            s.censored_start, 
+                                            s.censored_end
+                                        FROM {SCHEMA}.staging_charging_session s
+                                        LEFT JOIN {SCHEMA}.charging_session c 
+                                            ON c.id_session = md5(s.entity || s.id || s.session_start::varchar)
+                                        WHERE c.id_session IS NULL)
+"""
+
+DATA_TEST_CASES_CHARGING_SESSION = [DataTestCase(name="row_count_charging_session", 
+                                                 sql=TEMPLATE_TEST_CASE_ROW_COUNT), 
+                                    DataTestCase(name="duration_charging_session", 
+                                                 sql="select coalesce(min(duration_seconds) >= 0, true) from {SCHEMA}.{TABLE_NAME}")]
+
+# fact table of charging sessions per charging point and connector, appended with every load
+charging_session = DataIngester(table_name="charging_session", 
+                                drop_table=None, 
+                                create_table=CREATE_TABLE_CHARGING_SESSION, 
+                                populate_table=INSERT_TABLE_CHARGING_SESSION, 
+                                data_test_cases=DATA_TEST_CASES_CHARGING_SESSION
+                                )
+
+
 DROP_TABLE_CHARGING_STATION = "DROP TABLE IF EXISTS {SCHEMA}.charging_station"
-DROP_CS_PKEY = "ALTER TABLE {SCHEMA}.charging_station DROP CONSTRAINT charging_station_pkey"
 
 
 CREATE_TABLE_CHARGING_STATION = """
-                                CREATE TABLE IF NOT EXISTS {SCHEMA}.charging_station
+                                CREATE TABLE IF NOT EXISTS {SCHEMA}.{TABLE_NAME}
                                 (
                                  id_cs                      INTEGER, 
                                  name                       VARCHAR, 
@@ -303,11 +477,11 @@ CREATE_TABLE_CHARGING_STATION = """
                                  operator_name              VARCHAR, 
                                  operator_hotline           VARCHAR, 
                                  open_24_7                  BOOLEAN,
-                                 CONSTRAINT charging_station_pkey PRIMARY KEY (id_cs)
+                                 CONSTRAINT {TABLE_NAME}_pkey PRIMARY KEY (id_cs)
                                  )
 """
 
-INSERT_TABLE_CHARGING_STATION = """INSERT INTO  {SCHEMA}.charging_station (
+INSERT_TABLE_CHARGING_STATION = """INSERT INTO  {SCHEMA}.{TABLE_NAME} (
                                                 SELECT 
                                                     id as id_cs, 
                                                     name, 
@@ -329,22 +503,21 @@ INSERT_TABLE_CHARGING_STATION = """INSERT INTO  {SCHEMA}.charging_station (
 DATA_TEST_CASES_CHARGING_STATIONS = [DataTestCase(name="row_count_charging_stations", 
                                                   sql=TEMPLATE_TEST_CASE_ROW_COUNT), 
                                      DataTestCase(name="postal_code_length", 
-                                                  sql="select len(postal_code) = 5 from {SCHEMA}.charging_station")]
+                                                  sql="select len(postal_code) = 5 from {SCHEMA}.{TABLE_NAME}")]
 
 charging_station = DataIngester(table_name="charging_station", 
                                 drop_table=DROP_TABLE_CHARGING_STATION, 
                                 create_table=CREATE_TABLE_CHARGING_STATION, 
                                 populate_table=INSERT_TABLE_CHARGING_STATION, 
-                                drop_constraints=DROP_CS_PKEY, 
-                                data_test_cases=DATA_TEST_CASES_CHARGING_STATIONS
+                                data_test_cases=DATA_TEST_CASES_CHARGING_STATIONS, 
+                                swap=True
                                 )
 
 
 DROP_TABLE_CHARGING_POINT = "DROP TABLE IF EXISTS {SCHEMA}.charging_point"
-DROP_CP_PKEY = "ALTER TABLE {SCHEMA}.charging_point DROP CONSTRAINT charging_point_pkey"
 
 CREATE_TABLE_CHARGING_POINT = """ 
-                                CREATE TABLE IF NOT EXISTS {SCHEMA}.charging_point
+                                CREATE TABLE IF NOT EXISTS {SCHEMA}.{TABLE_NAME}
                                 (
                                  id_cp                          VARCHAR NOT NULL, 
                                  id_cs                          INTEGER NOT NULL,
@@ -355,12 +528,12 @@ CREATE_TABLE_CHARGING_POINT = """
                                  cp_position                    VARCHAR, 
                                  vehicle_type                   VARCHAR,
                                  floor_level                    VARCHAR,
-                                 CONSTRAINT charging_point_pkey PRIMARY KEY (id_cp)
+                                 CONSTRAINT {TABLE_NAME}_pkey PRIMARY KEY (id_cp)
                                 )
 """
 
 
-INSERT_TABLE_CHARGING_POINT = """INSERT INTO {SCHEMA}.charging_point (
+INSERT_TABLE_CHARGING_POINT = """INSERT INTO {SCHEMA}.{TABLE_NAME} (
                                                 SELECT 
                                                     id as id_cp,
                                                     id_cs,
@@ -382,16 +555,15 @@ charging_point = DataIngester(table_name="charging_point",
                               drop_table=DROP_TABLE_CHARGING_POINT, 
                               create_table=CREATE_TABLE_CHARGING_POINT, 
                               populate_table=INSERT_TABLE_CHARGING_POINT, 
-                              drop_constraints=DROP_CP_PKEY, 
-                              data_test_cases=DATA_TEST_CASES_CHARGING_POINTS
+                              data_test_cases=DATA_TEST_CASES_CHARGING_POINTS, 
+                              swap=True
                               )
 
 
 DROP_TABLE_CONNECTOR = "DROP TABLE IF EXISTS {SCHEMA}.connector"
-DROP_CONN_PKEY = "ALTER TABLE {SCHEMA}.connector DROP CONSTRAINT connector_pkey"
 
 CREATE_TABLE_CONNECTOR = """ 
-                         CREATE TABLE IF NOT EXISTS {SCHEMA}.connector 
+                         CREATE TABLE IF NOT EXISTS {SCHEMA}.{TABLE_NAME} 
                         (
                          id_connector               VARCHAR NOT NULL, 
                          id_cp                      VARCHAR NOT NULL,          
@@ -401,11 +573,11 @@ CREATE_TABLE_CONNECTOR = """
                          max_power                  INTEGER,
                          voltage                    INTEGER, 
                          standard                   VARCHAR,
-                         CONSTRAINT connector_pkey PRIMARY KEY (id_connector)
+                         CONSTRAINT {TABLE_NAME}_pkey PRIMARY KEY (id_connector)
                         )
 """
 
-INSERT_TABLE_CONNECTOR = """INSERT INTO {SCHEMA}.connector (
+INSERT_TABLE_CONNECTOR = """INSERT INTO {SCHEMA}.{TABLE_NAME} (
                                 SELECT 
                                     id as id_connector, 
                                     id_cp as id_cp, 
@@ -422,21 +594,18 @@ INSERT_TABLE_CONNECTOR = """INSERT INTO {SCHEMA}.connector (
 DATA_TEST_CASES_CONNECTORS = [DataTestCase(name="row_count_connectors", 
                                            sql=TEMPLATE_TEST_CASE_ROW_COUNT), 
                               DataTestCase(name="power_limits_connectors", 
-                                           sql="select (max_power > 2 and max_power < 400) from {SCHEMA}.connector")
+                                           sql="select (max_power > 2 and max_power < 400) from {SCHEMA}.{TABLE_NAME}")
                               ]
 
 connector = DataIngester(table_name="connector", 
                          drop_table=DROP_TABLE_CONNECTOR, 
                          create_table=CREATE_TABLE_CONNECTOR, 
                          populate_table=INSERT_TABLE_CONNECTOR, 
-                         drop_constraints=DROP_CONN_PKEY, 
-                         data_test_cases=DATA_TEST_CASES_CONNECTORS
+                         data_test_cases=DATA_TEST_CASES_CONNECTORS, 
+                         swap=True
                          )
 
 
-DROP_TABLE_TIME = "DROP TABLE IF EXISTS {SCHEMA}.time"
-DROP_TIME_PKEY = """ALTER TABLE {SCHEMA}."time" DROP CONSTRAINT time_pkey"""
-
 CREATE_TABLE_TIME = """CREATE TABLE IF NOT EXISTS {SCHEMA}."time" (
                         query_time                  timestamptz NOT NULL,
                         "hour"                      int4,
@@ -447,43 +616,49 @@ CREATE_TABLE_TIME = """CREATE TABLE IF NOT EXISTS {SCHEMA}."time" (
 	                    weekday                     int4,
 	                    CONSTRAINT time_pkey PRIMARY KEY (query_time)
                      )
+                     SORTKEY (query_time)
 """
 
+# only query times not yet loaded are inserted, the table is not rebuilt on every load
 INSERT_TABLE_TIME  = """ INSERT INTO {SCHEMA}."time"  (  
-                                    SELECT 
-                                        ts as query_time, 
-                                        min(extract(hour from ts)) as  "hour",
-                                        min(extract(day from ts)) as "day",
-                                        min(extract(week from ts)) as week, 
-                                        min(extract(month from ts)) as "month",
-                                        min(extract(year from ts)) as "year",
-                                        min(extract(dayofweek from ts)) as weekday
-                            FROM staging_status_cp 
-                            GROUP BY query_time
+                                    SELECT DISTINCT
+                                        s.query_time, 
+                                        s."hour",
+                                        s."day",
+                                        s.week, 
+                                        s."month",
+                                        s."year",
+                                        s.weekday
+                            FROM {SCHEMA}.staging_time s
+                            LEFT JOIN {SCHEMA}."time" t ON t.query_time = s.query_time
+                            WHERE t.query_time IS NULL
 )
 """
 
 DATA_TEST_CASES_TIME = [DataTestCase(name="row_count_time", 
-                                     sql=TEMPLATE_TEST_CASE_ROW_COUNT)]
+                                     sql=TEMPLATE_TEST_CASE_ROW_COUNT), 
+                        DataTestCase(name="staging_time_loaded", 
+                                     sql="""select count(*) = 0 from {SCHEMA}.staging_time s 
+                                            left join {SCHEMA}."time" t on t.query_time = s.query_time 
+                                            where t.query_time is null""")]
 
 time = DataIngester(table_name="time", 
-                    drop_table=DROP_TABLE_TIME, 
+                    drop_table=None, 
                     create_table=CREATE_TABLE_TIME, 
                     populate_table=INSERT_TABLE_TIME, 
-                    drop_constraints=DROP_TIME_PKEY, 
                     data_test_cases=DATA_TEST_CASES_TIME
                     )
 
 DROP_TABLE_MAPPING_POIS_CS = "DROP TABLE IF EXISTS {SCHEMA}.mapping_poi_cs"
 
 
-CREATE_TABLE_MAPPING_POIS = """CREATE TABLE IF NOT EXISTS {SCHEMA}.mapping_poi_cs (
+CREATE_TABLE_MAPPING_POIS = """CREATE TABLE IF NOT EXISTS {SCHEMA}.{TABLE_NAME} (
                                 id_poi          VARCHAR NOT NULL, 
                                 id_cs           INTEGER NOT NULL
                                 )
 """
 
-COPY_TABLE_MAPPING_POIS = """COPY {SCHEMA}.mapping_poi_cs 
+COPY_TABLE_MAPPING_POIS = """COPY {SCHEMA}.{TABLE_NAME} 
                              FROM '{MAPPING_POI_CS}' 
                              CREDENTIALS 'aws_iam_role={ROLE_ARN}'
                              REGION 'us-east-2' 
@@ -497,35 +672,34 @@ mapping_poi_cs = DataIngester(table_name="mapping_poi_cs",
                               drop_table=DROP_TABLE_MAPPING_POIS_CS, 
                               create_table=CREATE_TABLE_MAPPING_POIS, 
                               populate_table=COPY_TABLE_MAPPING_POIS, 
-                              data_test_cases=DATA_TEST_CASES_MAPPING_POIS_CS
+                              data_test_cases=DATA_TEST_CASES_MAPPING_POIS_CS, 
+                              swap=True
                               )
 
 
 DROP_TABLE_POIS = "DROP TABLE IF EXISTS {SCHEMA}.poi"
 
-DROP_POI_PKEY = "ALTER TABLE {SCHEMA}.poi DROP CONSTRAINT poi_pkey"
-
-CREATE_TABLE_POIS = """CREATE TABLE IF NOT EXISTS {SCHEMA}.poi (
+CREATE_TABLE_POIS = """CREATE TABLE IF NOT EXISTS {SCHEMA}.{TABLE_NAME} (
                         geom                Geometry, 
                         longitude FLOAT     NOT NULL, 
                         latitude FLOAT      NOT NULL,
                         id_poi VARCHAR      NOT NULL, 
                         poi_category        VARCHAR NOT NULL, 
-                        CONSTRAINT poi_pkey PRIMARY KEY (id_poi)
+                        CONSTRAINT {TABLE_NAME}_pkey PRIMARY KEY (id_poi)
                         )
 """
 
-COPY_TABLE_POIS = """COPY {SCHEMA}.poi 
+COPY_TABLE_POIS = """COPY {SCHEMA}.{TABLE_NAME} 
                      FROM '{SHAPEFILE_POI_POINTS}' 
                      CREDENTIALS 'aws_iam_role={ROLE_ARN}'
                      REGION 'us-east-2' 
                      SHAPEFILE; 
-                     COPY {SCHEMA}.poi 
+                     COPY {SCHEMA}.{TABLE_NAME} 
                      FROM '{SHAPEFILE_POI_POLYGONS}' 
                      CREDENTIALS 'aws_iam_role={ROLE_ARN}'
                      REGION 'us-east-2' 
                      SHAPEFILE; 
-                     COPY {SCHEMA}.poi 
+                     COPY {SCHEMA}.{TABLE_NAME} 
                      FROM '{SHAPEFILE_POI_MULTIPOLYGONS}' 
                      CREDENTIALS 'aws_iam_role={ROLE_ARN}'
                      REGION 'us-east-2' 
@@ -539,23 +713,189 @@ poi = DataIngester(table_name="poi",
                     drop_table=DROP_TABLE_POIS, 
                     create_table=CREATE_TABLE_POIS, 
                     populate_table=COPY_TABLE_POIS, 
-                    data_test_cases=DATA_TEST_CASES_POIS
+                    data_test_cases=DATA_TEST_CASES_POIS, 
+                    swap=True
                     )
 
 
+# statuses counted as occupied and as known in utilization rollups
+STATUS_OCCUPIED = "('CHARGING')"
+STATUS_NOT_KNOWN = "('UNKNOWN')"
+
+# hours of the status records of the current load, the rollups are only refreshed for these
+SELECT_LOADED_HOURS = """SELECT DISTINCT date_trunc('hour', sn.ts) as "hour" 
+                         FROM {SCHEMA}.staging_snapshot sn
+                         WHERE sn.snapshot_id IN (SELECT DISTINCT snapshot_id FROM {SCHEMA}.staging_status_cp)"""
+
+CREATE_TABLE_UTILIZATION_HOURLY_CS = """CREATE TABLE IF NOT EXISTS {SCHEMA}.{TABLE_NAME} (
+                                        "hour"              TIMESTAMPTZ NOT NULL, 
+                                        id_cs               INTEGER NOT NULL, 
+                                        city                VARCHAR, 
+                                        n_samples           INTEGER NOT NULL, 
+                                        seconds_known       FLOAT NOT NULL, 
+                                        seconds_occupied    FLOAT NOT NULL, 
+                                        occupancy           FLOAT
+                                        )
+                                        SORTKEY ("hour")
+"""
+
+# a status lasts until the next status of its charging point, at most MAX_GAP, and the last status one polling interval. 
+# The next status may fall into the hour after the loaded hours.
+INSERT_TABLE_UTILIZATION_HOURLY_CS = f"""DELETE FROM {{SCHEMA}}.{{TABLE_NAME}} 
+                                         USING ({SELECT_LOADED_HOURS}) loaded 
+                                         WHERE {{SCHEMA}}.{{TABLE_NAME}}."hour" = loaded."hour"; 
+                                         INSERT INTO {{SCHEMA}}.{{TABLE_NAME}} (
+                                            SELECT 
+                                                date_trunc('hour', s.query_time) as "hour", 
+                                                cp.id_cs, 
+                                                cs.city, 
+                                                count(*) as n_samples, 
+                                                sum(case when s.status_cp not in {STATUS_NOT_KNOWN} then s.duration else 0 end) as seconds_known, 
+                                                sum(case when s.status_cp in {STATUS_OCCUPIED} then s.duration else 0 end) as seconds_occupied, 
+                                                seconds_occupied / nullif(seconds_known, 0) as occupancy
+                                            FROM (SELECT id_chargingpoint, 
+                                                         query_time, 
+                                                         status_cp, 
+                                                         least(coalesce(datediff(second, query_time, lead(query_time) over (partition by id_chargingpoint order by query_time)), 
+                                                                        {POLLING_INTERVAL}), 
+                                                               {MAX_GAP}) as duration
+                                                  FROM {{SCHEMA}}.status_chargingpoints
+                                                  WHERE query_time >= (SELECT min("hour") FROM ({SELECT_LOADED_HOURS}) h)
+                                                    AND query_time < (SELECT max("hour") FROM ({SELECT_LOADED_HOURS}) h) 
+                                                                     + interval '1 hour' + interval '{MAX_GAP} seconds') s
+                                            JOIN ({SELECT_LOADED_HOURS}) loaded ON loaded."hour" = date_trunc('hour', s.query_time)
+                                            JOIN {{SCHEMA}}.charging_point cp ON cp.id_cp = s.id_chargingpoint
+                                            JOIN {{SCHEMA}}.charging_station cs ON cs.id_cs = cp.id_cs
+                                            GROUP BY 1, 2, 3
+)
+"""
+
+DATA_TEST_CASES_UTILIZATION_HOURLY_CS = [DataTestCase(name="row_count_utilization_hourly_cs", 
+                                                      sql=TEMPLATE_TEST_CASE_ROW_COUNT), 
+                                         DataTestCase(name="occupancy_range_utilization_hourly_cs", 
+                                                      sql="select coalesce(occupancy between 0 and 1, true) from {SCHEMA}.{TABLE_NAME}")]
+
+# hourly occupancy of charging stations weighted by the duration of the statuses, the hours of every load of the 
+# status tables are replaced
+utilization_hourly_cs = DataIngester(table_name="utilization_hourly_cs", 
+                                     drop_table=None, 
+                                     create_table=CREATE_TABLE_UTILIZATION_HOURLY_CS, 
+                                     populate_table=INSERT_TABLE_UTILIZATION_HOURLY_CS, 
+                                     data_test_cases=DATA_TEST_CASES_UTILIZATION_HOURLY_CS
+                                     )
+
+
+CREATE_TABLE_UTILIZATION_LATEST_CS = """CREATE TABLE IF NOT EXISTS {SCHEMA}.{TABLE_NAME} (
+                                        id_cs               INTEGER NOT NULL, 
+                                        query_time          TIMESTAMPTZ NOT NULL, 
+                                        n_cps               INTEGER NOT NULL, 
+                                        n_known             INTEGER NOT NULL, 
+                                        n_occupied          INTEGER NOT NULL, 
+                                        occupancy           FLOAT, 
+                                        CONSTRAINT {TABLE_NAME}_pkey PRIMARY KEY (id_cs)
+                                        )
+"""
+
+# charging stations of the charging points of the current load, only these are refreshed
+SELECT_LOADED_STATIONS = """SELECT DISTINCT cp.id_cs 
+                            FROM (SELECT DISTINCT id_code FROM {SCHEMA}.staging_status_cp) s
+                            JOIN {SCHEMA}.staging_ids_cp ids ON ids.id_code = s.id_code
+                            JOIN {SCHEMA}.charging_point cp ON cp.id_cp = ids.id"""
+
+INSERT_TABLE_UTILIZATION_LATEST_CS = f"""DELETE FROM {{SCHEMA}}.{{TABLE_NAME}} 
+                                         USING ({SELECT_LOADED_STATIONS}) loaded 
+                                         WHERE {{SCHEMA}}.{{TABLE_NAME}}.id_cs = loaded.id_cs; 
+                                         INSERT INTO {{SCHEMA}}.{{TABLE_NAME}} (
+                                            SELECT 
+                                                cp.id_cs, 
+                                                max(s.query_time) as query_time, 
+                                                count(*) as n_cps, 
+                                                sum(case when s.status_cp not in {STATUS_NOT_KNOWN} then 1 else 0 end) as n_known, 
+                                                sum(case when s.status_cp in {STATUS_OCCUPIED} then 1 else 0 end) as n_occupied, 
+                                                n_occupied::float / nullif(n_known, 0) as occupancy
+                                            FROM {{SCHEMA}}.status_chargingpoints s
+                                            JOIN {{SCHEMA}}.charging_point cp ON cp.id_cp = s.id_chargingpoint
+                                            JOIN ({SELECT_LOADED_STATIONS}) loaded ON loaded.id_cs = cp.id_cs
+                                            JOIN (SELECT id_chargingpoint, max(query_time) as query_time 
+                                                  FROM {{SCHEMA}}.status_chargingpoints 
+                                                  GROUP BY id_chargingpoint) latest 
+                                                ON latest.id_chargingpoint = s.id_chargingpoint 
+                                                AND latest.query_time = s.query_time
+                                            GROUP BY cp.id_cs
+)
+"""
+
+DATA_TEST_CASES_UTILIZATION_LATEST_CS = [DataTestCase(name="row_count_utilization_latest_cs", 
+                                                      sql=TEMPLATE_TEST_CASE_ROW_COUNT)]
+
+# occupancy of charging stations at the last status of each of their charging points, refreshed for the charging 
+# stations of every load of the status tables
+utilization_latest_cs = DataIngester(table_name="utilization_latest_cs", 
+                                     drop_table=None, 
+                                     create_table=CREATE_TABLE_UTILIZATION_LATEST_CS, 
+                                     populate_table=INSERT_TABLE_UTILIZATION_LATEST_CS, 
+                                     data_test_cases=DATA_TEST_CASES_UTILIZATION_LATEST_CS
+                                     )
+
+
+CREATE_TABLE_ETL_LOAD_LOG = """CREATE TABLE IF NOT EXISTS {SCHEMA}.etl_load_log (
+                                loaded_at           TIMESTAMPTZ NOT NULL
+                                )
+"""
+
+INSERT_ETL_LOAD_LOG = """INSERT INTO {SCHEMA}.etl_load_log VALUES (GETDATE())"""
+
+# records finished loads, e.g. to invalidate caches of the dashboard 
+etl_load_log = DataIngester(table_name="etl_load_log", 
+                            drop_table=None, 
+                            create_table=CREATE_TABLE_ETL_LOAD_LOG, 
+                            populate_table=INSERT_ETL_LOAD_LOG
+                            )
+
+
+SWAP_TABLE = "ALTER TABLE {SCHEMA}.{SHADOW_TABLE_NAME} RENAME TO {TABLE_NAME}"
+
+CREATE_TABLE_ETL_CHECKPOINT = """CREATE TABLE IF NOT EXISTS {SCHEMA}.etl_checkpoint (
+                                  run_id              VARCHAR NOT NULL, 
+                                  table_name          VARCHAR NOT NULL, 
+                                  completed_at        TIMESTAMPTZ NOT NULL
+                                  )
+"""
+
+INSERT_ETL_CHECKPOINT = """INSERT INTO {SCHEMA}.etl_checkpoint VALUES ('{RUN_ID}', '{TABLE_NAME}', GETDATE())"""
+
+# checkpoints of the last run, run ids sort by start time
+SELECT_LAST_RUN_CHECKPOINTS = """SELECT run_id, table_name, completed_at FROM {SCHEMA}.etl_checkpoint 
+                                 WHERE run_id = (SELECT max(run_id) FROM {SCHEMA}.etl_checkpoint)
+"""
+
+# table name of the checkpoint recorded after all tables of a run have been loaded
+CHECKPOINT_RUN_COMPLETED = "*"
+
+
 data_ingestions_staging = [staging_charging_connectors, 
                            staging_charging_points,
                            staging_charging_stations, 
+                           staging_snapshots, 
+                           staging_ids_cp, 
+                           staging_ids_connector, 
                            staging_status_charging_points, 
                            staging_status_connectors, 
+                           staging_charging_sessions, 
+                           staging_time, 
                            ]
 
 data_ingestions_main = [status_chargingpoints, 
                         status_connectors, 
+                        charging_session, 
+                        time, 
                         charging_station,
                         charging_point,
                         connector, 
                         mapping_poi_cs, 
-                        poi]
+                        poi, 
+                        utilization_hourly_cs, 
+                        utilization_latest_cs, 
+                        etl_load_log]
 
 
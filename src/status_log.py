@@ -0,0 +1,189 @@
+import numpy as np
+import datetime
+import logging
+import typing
+import json
+import os
+
+from settings import DIR_STATUS_LOG
+
+logger = logging.getLogger(__name__)
+
+
+FNAME_STATUS_LOG = "status_cps.bin"
+FNAME_DICTIONARY = "status_log_dictionary.json"
+
+# fixed-width record of 16 bytes, timestamp first to keep the int64 field aligned
+RECORD_DTYPE = np.dtype([("timestamp", "<i8"),
+                         ("id_cp", "<u4"),
+                         ("status", "u1"),
+                         ("parkingsensor_status", "u1"),
+                         ("reserved", "<u2")])
+
+DICTIONARY_KEYS = ["id_cp", "status", "parkingsensor_status"]
+FILL_VALUE_PARKINGSENSOR = "-"
+
+
+def _to_epoch(timestamp: typing.Union[str, datetime.datetime, None]) -> typing.Optional[int]:
+    """Convert ISO timestamp string or datetime to epoch seconds
+
+    Args:
+        timestamp (typing.Union[str, datetime.datetime, None]): timestamp to convert, e.g. pd.Timestamp. Naive timestamps are interpreted as local time.
+
+    Returns:
+        typing.Optional[int]: epoch seconds or None if no timestamp is provided
+    """
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, str):
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+    return int(timestamp.timestamp())
+
+
+def _read_dictionary(dir_log: str) -> typing.Dict[str, typing.List[str]]:
+    """Read id dictionary of status log
+
+    Args:
+        dir_log (str): directory of status log
+
+    Returns:
+        typing.Dict[str, typing.List[str]]: mapping containing dictionary name as key and list of values as value. The position in the list is the code stored in the status log.
+    """
+    fullpath_dictionary = os.path.join(dir_log, FNAME_DICTIONARY)
+    if not os.path.exists(fullpath_dictionary):
+        return {key: [] for key in DICTIONARY_KEYS}
+    with open(fullpath_dictionary, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_dictionary(dictionary: typing.Dict[str, typing.List[str]], dir_log: str):
+    """Atomically write id dictionary of status log
+
+    Args:
+        dictionary (typing.Dict[str, typing.List[str]]): mapping containing dictionary name as key and list of values as value
+        dir_log (str): directory of status log
+    """
+    fullpath_dictionary = os.path.join(dir_log, FNAME_DICTIONARY)
+    fullpath_tmp = fullpath_dictionary + ".tmp"
+    with open(fullpath_tmp, 'w', encoding='utf-8') as f:
+        json.dump(dictionary, f)
+    os.replace(fullpath_tmp, fullpath_dictionary)
+
+
+def _encode(value: str, dictionary: typing.List[str], lookup: typing.Dict[str, int]) -> int:
+    """Look up code of value and append value to dictionary if it is not yet contained"""
+    code = lookup.get(value)
+    if code is None:
+        code = len(dictionary)
+        dictionary.append(value)
+        lookup[value] = code
+    return code
+
+
+def append_status_log(data: dict, dir_log: str = DIR_STATUS_LOG) -> int:
+    """Append status of charging points of one API query interval to the binary status log
+
+    Args:
+        data (dict): mapping containing city as key and chargecloud API result for city as value
+        dir_log (str, optional): directory of status log. Defaults to DIR_STATUS_LOG.
+
+    Returns:
+        int: number of appended records
+    """
+    os.makedirs(dir_log, exist_ok=True)
+    dictionary = _read_dictionary(dir_log)
+    lookups = {key: {val: code for code, val in enumerate(dictionary[key])} for key in DICTIONARY_KEYS}
+    size_dictionary = {key: len(dictionary[key]) for key in DICTIONARY_KEYS}
+
+    records = []
+    for city in data:
+        # metadata of the scraper, e.g. '_scrape_status'
+        if city.startswith("_"):
+            continue
+        ts = _to_epoch(data[city]["timestamp"])
+        for cs in data[city]["data"]:
+            for evse in cs["evses"]:
+                records.append((ts,
+                                _encode(evse["id"], dictionary["id_cp"], lookups["id_cp"]),
+                                _encode(evse["status"], dictionary["status"], lookups["status"]),
+                                _encode(evse.get("parkingsensor_status", FILL_VALUE_PARKINGSENSOR),
+                                        dictionary["parkingsensor_status"],
+                                        lookups["parkingsensor_status"]),
+                                0))
+    if not records:
+        return 0
+
+    if len(dictionary["status"]) > 256 or len(dictionary["parkingsensor_status"]) > 256:
+        raise ValueError("Status log supports at most 256 distinct status values.")
+
+    arr_records = np.array(records, dtype=RECORD_DTYPE)
+    arr_records.sort(order=["timestamp", "id_cp"], kind="stable")
+
+    fullpath_log = os.path.join(dir_log, FNAME_STATUS_LOG)
+    log = read_status_log(dir_log)
+    if log.shape[0] > 0 and arr_records["timestamp"][0] < log["timestamp"][-1]:
+        logger.warning("Appending records older than the last record of the status log. Time range slicing assumes ordered records.")
+
+    # dictionary is written before records so every code in the log can be decoded
+    if any(len(dictionary[key]) != size_dictionary[key] for key in DICTIONARY_KEYS):
+        _write_dictionary(dictionary, dir_log)
+
+    with open(fullpath_log, 'ab') as f:
+        # drop trailing partial record of an interrupted write
+        incomplete_bytes = f.tell() % RECORD_DTYPE.itemsize
+        if incomplete_bytes:
+            f.truncate(f.tell() - incomplete_bytes)
+            f.seek(0, os.SEEK_END)
+        f.write(arr_records.tobytes())
+
+    logger.debug(f"Appended {arr_records.shape[0]} records to status log '{fullpath_log}'.")
+    return arr_records.shape[0]
+
+
+def read_status_log(dir_log: str = DIR_STATUS_LOG,
+                    start: typing.Union[str, datetime.datetime] = None,
+                    end: typing.Union[str, datetime.datetime] = None
+                    ) -> np.ndarray:
+    """Memory-map the binary status log and slice it by time range without copying
+
+    Args:
+        dir_log (str, optional): directory of status log. Defaults to DIR_STATUS_LOG.
+        start (typing.Union[str, datetime.datetime], optional): start of time range (inclusive). Defaults to None.
+        end (typing.Union[str, datetime.datetime], optional): end of time range (exclusive). Defaults to None.
+
+    Returns:
+        np.ndarray: memory-mapped structured array of dtype RECORD_DTYPE
+    """
+    fullpath_log = os.path.join(dir_log, FNAME_STATUS_LOG)
+    n_records = os.path.getsize(fullpath_log) // RECORD_DTYPE.itemsize if os.path.exists(fullpath_log) else 0
+    if n_records == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+
+    log = np.memmap(fullpath_log, dtype=RECORD_DTYPE, mode="r", shape=(n_records, ))
+
+    idx_start, idx_end = 0, n_records
+    if start is not None:
+        idx_start = np.searchsorted(log["timestamp"], _to_epoch(start), side="left")
+    if end is not None:
+        idx_end = np.searchsorted(log["timestamp"], _to_epoch(end), side="left")
+    return log[idx_start:idx_end]
+
+
+def status_log_to_frame(records: np.ndarray, dir_log: str = DIR_STATUS_LOG) -> "pd.DataFrame":
+    """Decode records of the status log to a DataFrame in the format of `preprocess_results.extract_status`
+
+    Args:
+        records (np.ndarray): records of status log, e.g. returned by `read_status_log`
+        dir_log (str, optional): directory of status log containing id dictionary. Defaults to DIR_STATUS_LOG.
+
+    Returns:
+        pd.DataFrame: status of charging points with columns id, status, parkingsensor_status and timestamp
+    """
+    import pandas as pd
+
+    dictionary = _read_dictionary(dir_log)
+    return pd.DataFrame({"id": np.asarray(dictionary["id_cp"], dtype=object)[records["id_cp"]],
+                         "status": pd.Categorical.from_codes(records["status"], dictionary["status"]),
+                         "parkingsensor_status": pd.Categorical.from_codes(records["parkingsensor_status"],
+                                                                           dictionary["parkingsensor_status"]),
+                         "timestamp": pd.to_datetime(records["timestamp"], unit="s", utc=True)})
@@ -0,0 +1,272 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+import logging
+import typing
+import os
+
+logger = logging.getLogger(__name__)
+
+
+ENTITY_CP = "cp"
+ENTITY_CONNECTOR = "connector"
+
+FNAMES_STATUS = {ENTITY_CP: "status_cps.csv", ENTITY_CONNECTOR: "status_connectors.csv"}
+# id dictionaries and snapshots are append-only, codes of earlier runs stay valid
+FNAMES_IDS = {ENTITY_CP: "ids_cps.csv", ENTITY_CONNECTOR: "ids_connectors.csv"}
+FNAME_SNAPSHOTS = "snapshots.csv"
+
+COL_SNAPSHOT = "snapshot_id"
+COL_ID_CODE = "id_code"
+
+# rows of status tables read at once when reading a time range
+CHUNKSIZE = 1000000
+
+
+def _read_dictionary(fullpath_dictionary: str, storage_options: dict = None) -> typing.Optional[DataFrame]:
+    try:
+        return pd.read_csv(fullpath_dictionary, sep=";", dtype=str, storage_options=storage_options)
+    except FileNotFoundError:
+        return None
+
+
+def _encode(values: pd.Series,
+            fullpath_dictionary: str,
+            col_code: str,
+            col_value: str,
+            key: typing.Callable[[pd.Series], np.ndarray] = None,
+            storage_options: dict = None) -> np.ndarray:
+    """Encode values by an append-only dictionary file, new values are appended to the dictionary
+
+    Args:
+        values (pd.Series): values to encode
+        fullpath_dictionary (str): path of dictionary with columns col_code and col_value
+        col_code (str): name of code column
+        col_value (str): name of value column
+        key (typing.Callable[[pd.Series], np.ndarray], optional): function mapping values to keys they are matched by, e.g. instants of timestamps with different offsets. Defaults to the values.
+        storage_options (dict, optional): storage options when reading from and writing to S3. Defaults to None.
+
+    Returns:
+        np.ndarray: int32 codes of values
+    """
+    key = key or (lambda ser: ser.to_numpy())
+    value_codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques)
+
+    dictionary = _read_dictionary(fullpath_dictionary, storage_options=storage_options)
+    if dictionary is None:
+        dictionary = DataFrame({col_code: pd.Series(dtype=np.int64), col_value: pd.Series(dtype=object)})
+    keys_dictionary = pd.Index(key(dictionary[col_value]))
+    code_of_unique = keys_dictionary.get_indexer(key(uniques))
+
+    is_new = code_of_unique < 0
+    if is_new.any():
+        code_of_unique[is_new] = np.arange(len(dictionary), len(dictionary) + is_new.sum())
+        df_new = DataFrame({col_code: code_of_unique[is_new], col_value: uniques[is_new].to_numpy()})
+        dictionary = pd.concat([dictionary, df_new], ignore_index=True)
+        # dictionary is written before the status rows referencing its codes
+        dictionary.to_csv(fullpath_dictionary, sep=";", index=False, storage_options=storage_options)
+        logger.debug(f"Appended {is_new.sum()} values to dictionary '{fullpath_dictionary}'.")
+    # codes are positions, as the dictionary is only appended to
+    return code_of_unique[value_codes].astype(np.int32)
+
+
+def _read_columns(fullpath: str, storage_options: dict = None) -> pd.Index:
+    return pd.read_csv(fullpath, sep=";", nrows=0, storage_options=storage_options).columns
+
+
+def _read_csv_filtered(fullpath: str,
+                       keep: typing.Callable[[DataFrame], np.ndarray] = None,
+                       chunksize: int = CHUNKSIZE,
+                       storage_options: dict = None) -> DataFrame:
+    """Read csv file in chunks, keeping only the rows selected by keep, so memory is bounded by the kept rows"""
+    if keep is None:
+        return pd.read_csv(fullpath, sep=";", storage_options=storage_options)
+    chunks = [chunk[keep(chunk)] for chunk in pd.read_csv(fullpath, sep=";", chunksize=chunksize,
+                                                          storage_options=storage_options)]
+    if not chunks:
+        return pd.read_csv(fullpath, sep=";", nrows=0, storage_options=storage_options)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _in_range(timestamps: pd.DatetimeIndex,
+              start: pd.Timestamp = None,
+              end: pd.Timestamp = None) -> np.ndarray:
+    mask = np.ones(len(timestamps), dtype=bool)
+    if start is not None:
+        mask &= timestamps >= pd.Timestamp(start)
+    if end is not None:
+        mask &= timestamps < pd.Timestamp(end)
+    return mask
+
+
+def _parse_timestamps(timestamps: pd.Series) -> pd.DatetimeIndex:
+    # all rows of a snapshot repeat its timestamp, only the distinct strings are parsed
+    codes, uniques = pd.factorize(timestamps)
+    return pd.DatetimeIndex(pd.to_datetime(uniques, utc=True)).take(codes)
+
+
+def _to_epoch_ns(timestamps: pd.Series) -> np.ndarray:
+    return pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True)).asi8
+
+
+def write_status_table(df_status: DataFrame,
+                       entity: str,
+                       dir_status: str,
+                       dir_snapshots: str = None,
+                       storage_options: dict = None) -> str:
+    """Write status rows referencing snapshots and ids by integer codes instead of repeating timestamps and ids
+
+    Args:
+        df_status (DataFrame): status data with columns id, status and timestamp, e.g. output of `extract_status`
+        entity (str): any of {'cp', 'connector'}
+        dir_status (str): directory of status table and id dictionary
+        dir_snapshots (str, optional): directory of snapshot table. Defaults to dir_status.
+        storage_options (dict, optional): storage options when writing to S3. Defaults to None.
+
+    Returns:
+        str: path of status table
+    """
+    dir_snapshots = dir_snapshots if dir_snapshots is not None else dir_status
+    snapshot_ids = _encode(df_status["timestamp"],
+                           os.path.join(dir_snapshots, FNAME_SNAPSHOTS),
+                           col_code=COL_SNAPSHOT,
+                           col_value="timestamp",
+                           key=_to_epoch_ns,
+                           storage_options=storage_options)
+    id_codes = _encode(df_status["id"].astype(str),
+                       os.path.join(dir_status, FNAMES_IDS[entity]),
+                       col_code=COL_ID_CODE,
+                       col_value="id",
+                       storage_options=storage_options)
+
+    cols_status = [col for col in df_status.columns if col not in ["id", "timestamp"]]
+    df_table = df_status[cols_status].copy()
+    df_table.insert(0, COL_ID_CODE, id_codes)
+    df_table.insert(0, COL_SNAPSHOT, snapshot_ids)
+
+    fullpath_status = os.path.join(dir_status, FNAMES_STATUS[entity])
+    df_table.to_csv(fullpath_status, sep=";", index=False, storage_options=storage_options)
+    return fullpath_status
+
+
+def read_status_table(entity: str,
+                      dir_status: str,
+                      dir_snapshots: str = None,
+                      storage_options: dict = None,
+                      start: pd.Timestamp = None,
+                      end: pd.Timestamp = None,
+                      chunksize: int = CHUNKSIZE) -> DataFrame:
+    """Read status table and decode snapshots and ids. Timestamps are only parsed once per snapshot.
+
+    Status tables written before the snapshot table was introduced, containing ids and timestamps, are read as is.
+    If a time range is given, the status table is read in chunks and only rows within the range are kept.
+
+    Args:
+        entity (str): any of {'cp', 'connector'}
+        dir_status (str): directory of status table and id dictionary
+        dir_snapshots (str, optional): directory of snapshot table. Defaults to dir_status.
+        storage_options (dict, optional): storage options when reading from S3. Defaults to None.
+        start (pd.Timestamp, optional): start of time range (inclusive), tz-aware. Defaults to None.
+        end (pd.Timestamp, optional): end of time range (exclusive), tz-aware. Defaults to None.
+        chunksize (int, optional): number of rows read at once when reading a time range. Defaults to CHUNKSIZE.
+
+    Returns:
+        DataFrame: status data with columns id, status (and parkingsensor_status) and timestamp (UTC)
+    """
+    dir_snapshots = dir_snapshots if dir_snapshots is not None else dir_status
+    fullpath_status = os.path.join(dir_status, FNAMES_STATUS[entity])
+    has_range = start is not None or end is not None
+    if COL_SNAPSHOT not in _read_columns(fullpath_status, storage_options=storage_options):
+        keep = (lambda chunk: _in_range(_parse_timestamps(chunk["timestamp"]), start, end)) if has_range else None
+        df_status = _read_csv_filtered(fullpath_status, keep=keep, chunksize=chunksize, storage_options=storage_options)
+        df_status["id"] = df_status["id"].astype(str)
+        df_status["timestamp"] = _parse_timestamps(df_status["timestamp"])
+        return df_status
+
+    snapshots = _read_dictionary(os.path.join(dir_snapshots, FNAME_SNAPSHOTS), storage_options=storage_options)
+    ids = _read_dictionary(os.path.join(dir_status, FNAMES_IDS[entity]), storage_options=storage_options)
+    if snapshots is None or ids is None:
+        raise ValueError(f"Snapshot table or id dictionary of status table '{fullpath_status}' not found.")
+    timestamps = pd.DatetimeIndex(pd.to_datetime(snapshots["timestamp"], utc=True))
+
+    keep = None
+    if has_range:
+        # rows are selected by the snapshots within the range, their timestamps are not parsed
+        snapshot_in_range = _in_range(timestamps, start, end)
+        keep = lambda chunk: snapshot_in_range[chunk[COL_SNAPSHOT].to_numpy()]
+    df_status = _read_csv_filtered(fullpath_status, keep=keep, chunksize=chunksize, storage_options=storage_options)
+
+    cols_status = [col for col in df_status.columns if col not in [COL_SNAPSHOT, COL_ID_CODE]]
+    df_decoded = df_status[cols_status].copy()
+    df_decoded.insert(0, "id", ids["id"].to_numpy()[df_status[COL_ID_CODE].to_numpy()])
+    df_decoded["timestamp"] = timestamps.take(df_status[COL_SNAPSHOT].to_numpy())
+    return df_decoded
+
+
+def merge_status_table(df_status: DataFrame,
+                       entity: str,
+                       dir_status: str,
+                       dir_snapshots: str = None,
+                       storage_options: dict = None) -> DataFrame:
+    """Combine status data with the rows of the existing status table, e.g. if only some cities are postprocessed
+
+    Args:
+        df_status (DataFrame): status data with columns id, status and timestamp, e.g. output of `extract_status`
+        entity (str): any of {'cp', 'connector'}
+        dir_status (str): directory of status table and id dictionary
+        dir_snapshots (str, optional): directory of snapshot table. Defaults to dir_status.
+        storage_options (dict, optional): storage options when reading from S3. Defaults to None.
+
+    Returns:
+        DataFrame: rows of existing status table and status data, rows of the same id and timestamp are taken from df_status
+    """
+    try:
+        df_existing = read_status_table(entity,
+                                        dir_status=dir_status,
+                                        dir_snapshots=dir_snapshots,
+                                        storage_options=storage_options)
+    except FileNotFoundError:
+        return df_status
+    df_new = df_status.assign(id=df_status["id"].astype(str),
+                              timestamp=pd.to_datetime(df_status["timestamp"], utc=True))
+    df_merged = pd.concat([df_existing, df_new], ignore_index=True)
+    logger.debug(f"Merging {df_new.shape[0]} status rows with {df_existing.shape[0]} rows of existing status table.")
+    return df_merged.drop_duplicates(["id", "timestamp"], keep="last", ignore_index=True)
+
+
+def read_status_time_range(entity: str,
+                           dir_status: str,
+                           dir_snapshots: str = None,
+                           storage_options: dict = None) -> typing.Optional[typing.Tuple[pd.Timestamp, pd.Timestamp]]:
+    """First and last timestamp of the rows of a status table, without decoding ids or parsing every timestamp
+
+    Only the snapshot column is read and its distinct snapshots are looked up in the snapshot table, which also holds
+    the snapshots of previous status tables.
+
+    Args:
+        entity (str): any of {'cp', 'connector'}
+        dir_status (str): directory of status table
+        dir_snapshots (str, optional): directory of snapshot table. Defaults to dir_status.
+        storage_options (dict, optional): storage options when reading from S3. Defaults to None.
+
+    Returns:
+        typing.Optional[typing.Tuple[pd.Timestamp, pd.Timestamp]]: first and last timestamp (UTC) or None if there is no status record
+    """
+    dir_snapshots = dir_snapshots if dir_snapshots is not None else dir_status
+    fullpath_status = os.path.join(dir_status, FNAMES_STATUS[entity])
+    if COL_SNAPSHOT in _read_columns(fullpath_status, storage_options=storage_options):
+        snapshot_ids = pd.read_csv(fullpath_status, sep=";", usecols=[COL_SNAPSHOT],
+                                   storage_options=storage_options)[COL_SNAPSHOT].unique()
+        if len(snapshot_ids) == 0:
+            return None
+        snapshots = _read_dictionary(os.path.join(dir_snapshots, FNAME_SNAPSHOTS), storage_options=storage_options)
+        if snapshots is None:
+            raise ValueError(f"Snapshot table of status table '{fullpath_status}' not found.")
+        values = snapshots["timestamp"].to_numpy()[snapshot_ids]
+    else:
+        values = pd.read_csv(fullpath_status, sep=";", usecols=["timestamp"], storage_options=storage_options)["timestamp"]
+    if len(values) == 0:
+        return None
+    timestamps = pd.DatetimeIndex(pd.to_datetime(pd.unique(values), utc=True))
+    return timestamps.min(), timestamps.max()
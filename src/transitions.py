@@ -0,0 +1,221 @@
+import dataclasses
+import threading
+import logging
+import sqlite3
+import typing
+import json
+import os
+
+from settings import DIR_TRANSITIONS, FNAME_TRANSITIONS, FNAME_TRANSITIONS_DB
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+TABLE_TRANSITIONS = "status_transition"
+
+ENTITY_CP = "cp"
+ENTITY_CONNECTOR = "connector"
+
+
+@dataclasses.dataclass(frozen=True)
+class Transition:
+    """Status change of a charging point or connector between two sweeps"""
+    entity: str
+    id: str
+    city: str
+    old: typing.Optional[str]
+    new: str
+    timestamp: str
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+
+def iter_status(data: dict) -> typing.Iterator[typing.Tuple[str, str, str, str, str]]:
+    """Iterate status of charging points and connectors of one query interval
+
+    Args:
+        data (dict): mapping containing city as key and chargecloud API result for city as value
+
+    Yields:
+        typing.Iterator[typing.Tuple[str, str, str, str, str]]: entity, id, city, status and timestamp
+    """
+    for city, result in data.items():
+        # metadata of the scraper, e.g. '_scrape_status'
+        if city.startswith("_"):
+            continue
+        ts = result["timestamp"]
+        for cs in result["data"]:
+            for evse in cs["evses"]:
+                yield ENTITY_CP, evse["id"], city, evse["status"], ts
+                for connector in evse.get("connectors", []):
+                    if "status" in connector:
+                        yield ENTITY_CONNECTOR, connector["id"], city, connector["status"], ts
+
+
+class JsonLinesSink:
+    """Appends transitions as JSON lines to a local file
+
+    Args:
+        path (str, optional): path of file. Defaults to FNAME_TRANSITIONS in DIR_TRANSITIONS.
+    """
+
+    def __init__(self, path: str = os.path.join(DIR_TRANSITIONS, FNAME_TRANSITIONS)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, transitions: typing.List[Transition]):
+        self._file.write("".join(json.dumps(t.to_dict()) + "\n" for t in transitions))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class SQLiteSink:
+    """Inserts transitions into a SQLite table indexed by id and timestamp
+
+    Args:
+        path (str, optional): path of database. Defaults to FNAME_TRANSITIONS_DB in DIR_TRANSITIONS.
+        table (str, optional): name of table. Defaults to TABLE_TRANSITIONS.
+    """
+
+    def __init__(self, path: str = os.path.join(DIR_TRANSITIONS, FNAME_TRANSITIONS_DB), table: str = TABLE_TRANSITIONS):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.table = table
+        # transitions are written by the writer thread of the scraper
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(f"""CREATE TABLE IF NOT EXISTS {table} (entity TEXT NOT NULL,
+                                                                      id TEXT NOT NULL,
+                                                                      city TEXT,
+                                                                      old TEXT,
+                                                                      new TEXT NOT NULL,
+                                                                      timestamp TEXT NOT NULL)""")
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_id_ts ON {table} (id, timestamp)")
+
+    def write(self, transitions: typing.List[Transition]):
+        with self._lock, self._conn:
+            self._conn.executemany(f"INSERT INTO {self.table} VALUES (?, ?, ?, ?, ?, ?)",
+                                   [dataclasses.astuple(t) for t in transitions])
+
+    def last_statuses(self) -> typing.Dict[typing.Tuple[str, str], str]:
+        """Latest status per entity and id, e.g. to seed a tracker after a restart"""
+        with self._lock:
+            rows = self._conn.execute(f"""SELECT entity, id, new FROM {self.table} AS t
+                                          WHERE timestamp = (SELECT max(timestamp) FROM {self.table}
+                                                             WHERE entity = t.entity AND id = t.id)""").fetchall()
+        return {(entity, id_): status for entity, id_, status in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PubSubSink:
+    """In-process publish/subscribe of transitions. Subscribers are called with the transitions of every sweep in
+    the thread writing them, e.g. pass `queue.put` to consume transitions in another thread.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self,
+                  callback: typing.Callable[[typing.List[Transition]], None],
+                  entity: str = None) -> typing.Callable[[], None]:
+        """Subscribe to transitions
+
+        Args:
+            callback (typing.Callable[[typing.List[Transition]], None]): function called with the transitions of a sweep
+            entity (str, optional): only pass transitions of this entity, any of {'cp', 'connector'}. Defaults to None.
+
+        Returns:
+            typing.Callable[[], None]: function cancelling the subscription
+        """
+        subscriber = (callback, entity)
+        with self._lock:
+            self._subscribers.append(subscriber)
+
+        def unsubscribe():
+            with self._lock:
+                if subscriber in self._subscribers:
+                    self._subscribers.remove(subscriber)
+        return unsubscribe
+
+    def write(self, transitions: typing.List[Transition]):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback, entity in subscribers:
+            _transitions = transitions if entity is None else [t for t in transitions if t.entity == entity]
+            if not _transitions:
+                continue
+            try:
+                callback(_transitions)
+            except Exception:
+                # a failing subscriber must not stop the scraper
+                logger.exception(f"Error occurred in subscriber '{getattr(callback, '__name__', callback)}'.")
+
+    def close(self):
+        with self._lock:
+            self._subscribers.clear()
+
+
+class TransitionTracker:
+    """Keeps the last known status of every charging point and connector and emits a transition for every change
+
+    The first status of an id after start is only recorded, unless the tracker is seeded with the last known statuses
+    or emit_initial is set.
+
+    Args:
+        sinks (list, optional): sinks with methods `write(transitions)` and `close()`. Defaults to None.
+        emit_initial (bool, optional): whether to emit transitions with old status None for ids seen for the first time. Defaults to False.
+        last_statuses (typing.Dict[typing.Tuple[str, str], str], optional): last known status per entity and id. Defaults to None.
+    """
+
+    def __init__(self,
+                 sinks: list = None,
+                 emit_initial: bool = False,
+                 last_statuses: typing.Dict[typing.Tuple[str, str], str] = None):
+        self.sinks = list(sinks or [])
+        self.emit_initial = emit_initial
+        self._last_status = dict(last_statuses or {})
+
+    def update(self, data: dict) -> typing.List[Transition]:
+        """Compare statuses of one query interval with the last known statuses and write transitions to all sinks
+
+        Args:
+            data (dict): mapping containing city as key and chargecloud API result for city as value
+
+        Returns:
+            typing.List[Transition]: transitions of the sweep
+        """
+        last_status = self._last_status
+        transitions = []
+        for entity, id_, city, status, ts in iter_status(data):
+            key = (entity, id_)
+            old = last_status.get(key)
+            if old == status:
+                continue
+            last_status[key] = status
+            if old is not None or self.emit_initial:
+                transitions.append(Transition(entity=entity, id=id_, city=city, old=old, new=status, timestamp=ts))
+
+        if transitions:
+            metrics.count("status_transitions", len(transitions))
+            for sink in self.sinks:
+                try:
+                    sink.write(transitions)
+                except Exception:
+                    metrics.count("transition_sink_errors")
+                    logger.exception(f"Error occurred while writing transitions to '{type(sink).__name__}'.")
+        logger.debug(f"{len(transitions)} status transitions.")
+        return transitions
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
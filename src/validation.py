@@ -0,0 +1,238 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+import dataclasses
+import logging
+import typing
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+TABLE_STATUS_CPS = "status_cps"
+TABLE_STATUS_CONNECTORS = "status_connectors"
+TABLE_CHARGING_STATIONS = "charging_stations"
+TABLE_CHARGING_POINTS = "charging_points"
+TABLE_CONNECTORS = "connectors"
+
+# statuses returned by the chargecloud API for charging points and connectors
+STATUSES = ["AVAILABLE", "CHARGING", "RESERVED", "BLOCKED", "OUTOFORDER", "INOPERATIVE", "UNKNOWN"]
+
+# expected columns and their types, 'str' columns must not be null
+SCHEMAS = {TABLE_STATUS_CPS: {"id": "str", "status": "str", "parkingsensor_status": "object", "timestamp": "datetime"},
+           TABLE_STATUS_CONNECTORS: {"id": "str", "status": "str", "timestamp": "datetime"},
+           TABLE_CHARGING_STATIONS: {"id": "str", "postal_code": "object", "latitude": "float", "longitude": "float"},
+           TABLE_CHARGING_POINTS: {"id": "str", "id_cs": "str"},
+           TABLE_CONNECTORS: {"id": "str", "id_cp": "str", "max_power": "float"}}
+
+# bounding box of the cities queried, charging stations outside are most likely misplaced
+COORDINATE_BOUNDS = {"latitude": (47.2, 55.1), "longitude": (5.8, 15.1)}
+PATTERN_POSTAL_CODE = r"^\d{5}$"
+# exclusive limits of the maximum power of connectors in kW, same as data test case 'power_limits_connectors'
+POWER_LIMITS = (2, 400)
+
+N_EXAMPLES = 5
+FNAME_REPORT = "validation_report.csv"
+
+
+@dataclasses.dataclass
+class CheckResult:
+    """Counts of a check aggregated over all chunks
+
+    Attributes:
+        table (str): name of checked table
+        check (str): name of check
+        n_rows (int): number of checked rows
+        n_failed (int): number of rows failing the check
+        examples (typing.List[str]): up to N_EXAMPLES values of failing rows
+    """
+    table: str
+    check: str
+    n_rows: int = 0
+    n_failed: int = 0
+    examples: typing.List[str] = dataclasses.field(default_factory=list)
+
+
+class ValidationReport:
+    """Counts of checked and failed rows per table and check"""
+
+    def __init__(self):
+        self.results: typing.Dict[typing.Tuple[str, str], CheckResult] = {}
+
+    def add(self, table: str, check: str, n_rows: int, failed: np.ndarray, values: pd.Series = None) -> int:
+        """Add outcome of a check on one chunk
+
+        Args:
+            table (str): name of checked table
+            check (str): name of check
+            n_rows (int): number of checked rows
+            failed (np.ndarray): boolean mask of failing rows
+            values (pd.Series, optional): values of checked rows to take examples of failing rows from. Defaults to None.
+
+        Returns:
+            int: number of failing rows of chunk
+        """
+        result = self.results.setdefault((table, check), CheckResult(table=table, check=check))
+        n_failed = int(np.count_nonzero(failed))
+        result.n_rows += n_rows
+        result.n_failed += n_failed
+        if n_failed and values is not None and len(result.examples) < N_EXAMPLES:
+            examples = [str(val) for val in pd.unique(np.asarray(values)[np.asarray(failed)])]
+            examples = [val for val in examples if val not in result.examples]
+            result.examples.extend(examples[:N_EXAMPLES - len(result.examples)])
+        return n_failed
+
+    @property
+    def failed(self) -> typing.List[CheckResult]:
+        """Checks with at least one failing row"""
+        return [result for result in self.results.values() if result.n_failed > 0]
+
+    def to_frame(self) -> DataFrame:
+        """Report with one row per table and check"""
+        return DataFrame([{**dataclasses.asdict(result), "examples": ", ".join(result.examples)}
+                          for result in self.results.values()],
+                         columns=[field.name for field in dataclasses.fields(CheckResult)])
+
+    def log_summary(self):
+        """Log failing checks as warnings"""
+        for result in self.failed:
+            logger.warning(f"Check '{result.check}' failed for {result.n_failed} of {result.n_rows} rows of "
+                           f"'{result.table}', e.g. {result.examples}.")
+        n_checks = len(self.results)
+        logger.info(f"{n_checks - len(self.failed)} of {n_checks} data quality checks passed.")
+
+
+def _format_failure(table: str, check: str, n_failed: int, n_rows: int) -> str:
+    return f"Data quality check '{check}' failed for {n_failed} of {n_rows} rows of '{table}'."
+
+
+class Validator:
+    """Vectorized data quality checks run on every chunk during preprocessing, before data is loaded into Redshift.
+    Duplicate keys of status data are also detected across chunks.
+
+    Args:
+        strict (bool, optional): whether to raise on the first failing check instead of only reporting it. Defaults to False.
+        coordinate_bounds (typing.Dict[str, typing.Tuple[float, float]], optional): inclusive bounds of latitude and longitude. Defaults to COORDINATE_BOUNDS.
+        statuses (typing.List[str], optional): valid statuses of charging points and connectors. Defaults to STATUSES.
+    """
+
+    def __init__(self,
+                 strict: bool = False,
+                 coordinate_bounds: typing.Dict[str, typing.Tuple[float, float]] = COORDINATE_BOUNDS,
+                 statuses: typing.List[str] = STATUSES):
+        self.strict = strict
+        self.coordinate_bounds = coordinate_bounds
+        self.statuses = statuses
+        self.report = ValidationReport()
+        # hashes of ids per query time (epoch ns) of status data already validated, per table
+        self._seen_keys: typing.Dict[str, typing.Dict[int, np.ndarray]] = {}
+
+    def _check(self, table: str, check: str, n_rows: int, failed: np.ndarray, values: pd.Series = None):
+        n_failed = self.report.add(table, check, n_rows=n_rows, failed=failed, values=values)
+        if n_failed:
+            metrics.count("validation_failed_rows", n_failed, table=table, check=check)
+            if self.strict:
+                err_msg = _format_failure(table, check, n_failed=n_failed, n_rows=n_rows)
+                logger.error(err_msg)
+                raise ValueError(err_msg)
+
+    def _check_schema(self, df: DataFrame, table: str) -> typing.List[str]:
+        """Check columns and types of SCHEMAS[table], returns columns available for further checks"""
+        n_rows = len(df)
+        cols_valid = []
+        for col, dtype in SCHEMAS[table].items():
+            if col not in df.columns:
+                self._check(table, f"column_{col}", n_rows=n_rows, failed=np.ones(n_rows, dtype=bool))
+                continue
+            ser = df[col]
+            if dtype == "str":
+                failed = ser.isna().to_numpy()
+            elif dtype == "float":
+                failed = (pd.to_numeric(ser, errors="coerce").isna() & ser.notna()).to_numpy()
+            elif dtype == "datetime":
+                # all rows of a snapshot share their timestamp, only distinct values are parsed
+                codes, uniques = pd.factorize(ser)
+                parsed = pd.to_datetime(pd.Series(uniques, dtype=object), errors="coerce", utc=True)
+                failed = (codes < 0) | parsed.isna().to_numpy()[codes]
+            else:
+                failed = np.zeros(n_rows, dtype=bool)
+            self._check(table, f"dtype_{col}", n_rows=n_rows, failed=failed, values=ser)
+            cols_valid.append(col)
+        return cols_valid
+
+    def validate_status(self, df_status: DataFrame, table: str):
+        """Check status data of one chunk, e.g. output of `extract_status` for one query interval
+
+        Args:
+            df_status (DataFrame): status data with columns id, status and timestamp
+            table (str): any of {TABLE_STATUS_CPS, TABLE_STATUS_CONNECTORS}
+
+        Raises:
+            ValueError: Raised in strict mode if a check fails
+        """
+        cols = self._check_schema(df_status, table)
+        n_rows = len(df_status)
+        if "status" in cols:
+            failed = ~df_status["status"].isin(self.statuses).to_numpy()
+            self._check(table, "status_domain", n_rows=n_rows, failed=failed, values=df_status["status"])
+
+        if "id" not in cols or "timestamp" not in cols:
+            return
+        codes, uniques = pd.factorize(df_status["timestamp"])
+        ts = pd.DatetimeIndex(pd.to_datetime(pd.Series(uniques, dtype=object), errors="coerce", utc=True)).asi8
+        ts = np.where(codes >= 0, ts[codes], np.iinfo(np.int64).min)
+        hashes = pd.util.hash_array(df_status["id"].astype(str).to_numpy())
+        keys = DataFrame({"ts": ts, "hash": hashes})
+        failed = keys.duplicated().to_numpy()
+
+        # duplicates of previous chunks can only share query times of previous chunks
+        seen_keys = self._seen_keys.setdefault(table, {})
+        for t in np.unique(ts):
+            is_t = ts == t
+            if t in seen_keys:
+                failed |= is_t & np.isin(hashes, seen_keys[t])
+                seen_keys[t] = np.union1d(seen_keys[t], hashes[is_t])
+            else:
+                seen_keys[t] = np.unique(hashes[is_t])
+        # keys are only formatted as examples if there are duplicates
+        keys_str = df_status["id"].astype(str) + "@" + df_status["timestamp"].astype(str) if failed.any() else None
+        self._check(table, "duplicate_id_timestamp", n_rows=n_rows, failed=failed, values=keys_str)
+
+    def validate_master_data(self, df_md_cs: DataFrame, df_md_cp: DataFrame, df_md_conn: DataFrame):
+        """Check master data of charging stations, charging points and connectors, e.g. output of `extract_master_data`
+
+        Args:
+            df_md_cs (DataFrame): master data of charging stations
+            df_md_cp (DataFrame): master data of charging points
+            df_md_conn (DataFrame): master data of connectors
+
+        Raises:
+            ValueError: Raised in strict mode if a check fails
+        """
+        for df, table in [(df_md_cs, TABLE_CHARGING_STATIONS),
+                          (df_md_cp, TABLE_CHARGING_POINTS),
+                          (df_md_conn, TABLE_CONNECTORS)]:
+            cols = self._check_schema(df, table)
+            if "id" in cols:
+                failed = df["id"].duplicated().to_numpy()
+                self._check(table, "duplicate_id", n_rows=len(df), failed=failed, values=df["id"])
+
+        cols = SCHEMAS[TABLE_CHARGING_STATIONS].keys() & set(df_md_cs.columns)
+        n_rows = len(df_md_cs)
+        if "postal_code" in cols:
+            postal_code = df_md_cs["postal_code"].astype("string")
+            failed = ~postal_code.str.match(PATTERN_POSTAL_CODE).fillna(False).to_numpy(dtype=bool)
+            self._check(TABLE_CHARGING_STATIONS, "postal_code_format", n_rows=n_rows, failed=failed, values=postal_code)
+        for col, (lower, upper) in self.coordinate_bounds.items():
+            if col not in cols:
+                continue
+            coord = pd.to_numeric(df_md_cs[col], errors="coerce")
+            failed = ~coord.between(lower, upper).to_numpy()
+            self._check(TABLE_CHARGING_STATIONS, f"{col}_bounds", n_rows=n_rows, failed=failed, values=df_md_cs[col])
+
+        if "max_power" in df_md_conn.columns:
+            max_power = pd.to_numeric(df_md_conn["max_power"], errors="coerce")
+            failed = ~((max_power > POWER_LIMITS[0]) & (max_power < POWER_LIMITS[1])).to_numpy()
+            self._check(TABLE_CONNECTORS, "power_limits", n_rows=len(df_md_conn), failed=failed,
+                        values=df_md_conn["max_power"])
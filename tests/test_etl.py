@@ -0,0 +1,166 @@
+import contextlib
+import re
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("psycopg2")
+
+import db
+import etl
+from sql import data_ingestions_main, data_ingestions_staging
+
+
+DSN_LOCAL = "host=localhost dbname=test user=postgres password= port=5432"
+CONFIG = """[CLUSTER]
+HOST=cluster.example.com
+DB_NAME=dev
+DB_USER=awsuser
+DB_PASSWORD=secret
+DB_PORT=5439
+DB_SCHEMA=chargecloud
+
+[IAM_ROLE]
+ARN=arn:aws:iam::123456789012:role/redshift
+
+[S3]
+STATUS_DATA_CHARGING_POINT=s3://bucket/status_cp
+STATUS_DATA_CHARGING_CONNECTORS=s3://bucket/status_con
+MASTER_DATA_CHARGING_STATIONS=s3://bucket/md_cs
+MASTER_DATA_CHARGING_POINTS=s3://bucket/md_cp
+MASTER_DATA_CONNECTORS=s3://bucket/md_con
+MAPPING_POI_CS=s3://bucket/mapping_poi_cs
+SNAPSHOTS=s3://bucket/snapshots
+IDS_CHARGING_POINTS=s3://bucket/ids_cp
+IDS_CONNECTORS=s3://bucket/ids_con
+CHARGING_SESSIONS=s3://bucket/sessions
+TIME_DATA=s3://bucket/time
+SHAPEFILE_POI_POINTS=s3://bucket/poi_points
+SHAPEFILE_POI_POLYGONS=s3://bucket/poi_polygons
+SHAPEFILE_POI_MULTIPOLYGONS=s3://bucket/poi_multipolygons
+"""
+
+
+class RecordingCursor:
+    """Cursor recording executed queries instead of sending them to a database"""
+
+    def __init__(self, queries):
+        self.queries = queries
+        self.rowcount = 0
+
+    def execute(self, query, vars=None):
+        self.queries.append(query)
+
+
+class RecordingConnection:
+
+    def __init__(self):
+        self.queries = []
+        self.commits = 0
+        self.closed = False
+
+    def cursor(self):
+        return RecordingCursor(self.queries)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class RecordingPool:
+    """Connection pool remembering the connection string it was created with"""
+
+    instances = []
+
+    def __init__(self, dsn, minconn=1, maxconn=1, **kwargs):
+        self.dsn = dsn
+        self.conn = RecordingConnection()
+        RecordingPool.instances.append(self)
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield self.conn
+
+    def close(self):
+        pass
+
+
+def _read_sql(con, sql, **kwargs):
+    con.queries.append(sql)
+    if "information_SCHEMA.table_constraints" in sql:
+        return pd.DataFrame(columns=["constraint_schema", "constraint_name"])
+    return pd.DataFrame({"passed": [True]})
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    fullpath = tmp_path / "config.cfg"
+    fullpath.write_text(CONFIG)
+    return str(fullpath)
+
+
+@pytest.fixture
+def recording_pool(monkeypatch):
+    RecordingPool.instances = []
+    monkeypatch.setattr(etl, "ConnectionPool", RecordingPool)
+    monkeypatch.setattr(etl, "LOGGING_CONFIG", {"version": 1, "disable_existing_loggers": False})
+    monkeypatch.setattr(etl.pd, "read_sql", _read_sql)
+    return RecordingPool
+
+
+def test_dsn_from_config(config_file, monkeypatch):
+    monkeypatch.delenv(db.ENV_DSN, raising=False)
+    assert db.dsn_from_config(config_file) == "host=cluster.example.com dbname=dev user=awsuser password=secret port=5439"
+
+
+def test_dsn_from_environment_overrides_config(config_file, monkeypatch):
+    monkeypatch.setenv(db.ENV_DSN, DSN_LOCAL)
+    assert db.dsn_from_config(config_file) == DSN_LOCAL
+
+
+def test_pool_connects_with_dsn(monkeypatch):
+    dsns = []
+    conn = RecordingConnection()
+    monkeypatch.setattr(db.psycopg2, "connect", lambda dsn, **kwargs: dsns.append(dsn) or conn)
+    pool = db.ConnectionPool(DSN_LOCAL, minconn=1, maxconn=1)
+    with pool.connection() as borrowed:
+        assert borrowed is conn
+    pool.close()
+    assert dsns == [DSN_LOCAL]
+    assert conn.closed
+
+
+@pytest.mark.parametrize("dsn_env, dsn_expected", [
+    (None, "host=cluster.example.com dbname=dev user=awsuser password=secret port=5439"),
+    (DSN_LOCAL, DSN_LOCAL),
+])
+def test_etl_connects_with_selected_dsn(config_file, recording_pool, monkeypatch, dsn_env, dsn_expected):
+    if dsn_env:
+        monkeypatch.setenv(db.ENV_DSN, dsn_env)
+    else:
+        monkeypatch.delenv(db.ENV_DSN, raising=False)
+    etl.main(config_file=config_file)
+    assert [pool.dsn for pool in recording_pool.instances] == [dsn_expected]
+
+
+def test_etl_renders_all_queries(config_file, recording_pool, monkeypatch):
+    monkeypatch.setenv(db.ENV_DSN, DSN_LOCAL)
+    etl.main(config_file=config_file)
+    queries = recording_pool.instances[0].conn.queries
+
+    # every placeholder is filled from the config
+    unfilled = [q for q in queries if re.search(r"[{}]", q)]
+    assert unfilled == []
+    assert all("public." not in q for q in queries)
+    assert any("s3://bucket/status_cp" in q for q in queries)
+    assert any("arn:aws:iam::123456789012:role/redshift" in q for q in queries)
+
+    # every table is created or populated and checkpointed
+    for data_obj in data_ingestions_staging + data_ingestions_main:
+        assert any(f"chargecloud.{data_obj.table_name}" in q for q in queries), data_obj.table_name
+        assert any("etl_checkpoint" in q and f"'{data_obj.table_name}'" in q for q in queries), data_obj.table_name
@@ -0,0 +1,99 @@
+import http.server
+import json
+import os
+import threading
+
+import pytest
+
+import get_chargecloud_data as g
+
+
+ETAG = '"v1"'
+PAYLOAD = {"data": [{"id": "cs1", "evses": [{"id": "cp1", "status": "AVAILABLE"}]}]}
+
+
+class ChargecloudStub(http.server.BaseHTTPRequestHandler):
+    """Chargecloud API answering with an ETag and '304 Not Modified' to requests with matching 'If-None-Match'. 
+    City 'flaky' fails with '503 Service Unavailable' on its first request."""
+
+    def do_GET(self):
+        city = self.path.strip("/")
+        self.server.requests.append((city, self.headers.get("If-None-Match")))
+        if city == "flaky" and sum(c == city for c, _ in self.server.requests) == 1:
+            self._respond(503)
+        elif self.headers.get("If-None-Match") == ETAG:
+            self._respond(304)
+        else:
+            self._respond(200, body=json.dumps({**PAYLOAD, "timestamp": "2022-01-11T21:58:24+01:00"}).encode())
+
+    def _respond(self, code: int, body: bytes = b""):
+        self.send_response(code)
+        if code in (200, 304):
+            self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ChargecloudStub)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def _load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_fetch_city_returns_payload_and_etag(base_url):
+    with g.requests.Session() as session:
+        data, status = g._fetch_city(session, "koeln", base_url=base_url)
+    assert data["data"] == PAYLOAD["data"]
+    assert status["ok"] and status["status_code"] == 200 and status["attempts"] == 1
+    assert status["etag"] == ETAG
+
+
+def test_fetch_city_not_modified(base_url):
+    with g.requests.Session() as session:
+        data, status = g._fetch_city(session, "koeln", base_url=base_url, headers={"If-None-Match": ETAG})
+    assert data is None
+    assert status["ok"] and status["not_modified"] and status["status_code"] == 304
+
+
+def test_fetch_city_retries_unavailable(base_url, monkeypatch):
+    monkeypatch.setattr(g, "_backoff_seconds", lambda attempt: 0)
+    with g.requests.Session() as session:
+        data, status = g._fetch_city(session, "flaky", base_url=base_url, max_retries=1)
+    assert data["data"] == PAYLOAD["data"]
+    assert status["ok"] and status["attempts"] == 2
+
+
+def test_scrape_saves_not_modified_city_as_marker(base_url, tmp_path):
+    dir_save = str(tmp_path)
+    payload_cache = g.PayloadCache()
+    
+    status_first = g.scrape_cp_cities(["koeln"], dir_save=dir_save, save_raw=True, base_url=base_url, 
+                                      payload_cache=payload_cache, query_time="20220111_215824")
+    assert payload_cache.request_headers("koeln") == {"If-None-Match": ETAG}
+    status_second = g.scrape_cp_cities(["koeln"], dir_save=dir_save, save_raw=True, base_url=base_url, 
+                                       payload_cache=payload_cache, query_time="20220111_220324")
+    
+    assert status_first["koeln"]["status_code"] == 200
+    assert status_second["koeln"]["status_code"] == 304 and status_second["koeln"]["unchanged"]
+    # the validator of the unchanged payload is kept for the next request
+    assert payload_cache.request_headers("koeln") == {"If-None-Match": ETAG}
+    
+    path_first = g._get_api_results_path(dir_save, "20220111_215824", save_raw=True)
+    path_second = g._get_api_results_path(dir_save, "20220111_220324", save_raw=True)
+    assert _load(path_first)["koeln"]["data"] == PAYLOAD["data"]
+    marker = _load(path_second)["koeln"]
+    assert marker[g.KEY_UNCHANGED] and marker["ref"] == os.path.basename(path_first)